@@ -1,4 +1,3 @@
-import requests
 import sys
 
 try:
@@ -8,19 +7,25 @@ except ImportError:
 
 from invtool.dispatch import Dispatch
 from invtool.lib.registrar import registrar
-from invtool.lib.config import REMOTE, auth
+from invtool.lib.config import REMOTE
+from invtool.lib.client import BA_HEADERS, inventory_client
+from invtool.lib.parser import add_concurrency_argument
+from invtool.lib.ba import ba_import_chunked, split_blob
 
 
 class BA(Dispatch):
     def handle_ba_resp(self, nas, query, resp):
+        was_json = nas.p_json
+        nas.p_json = True  # Do this so we can play with the response
         ret_code, raw_results = self.handle_resp(nas, query, resp)
         if ret_code:
             return (ret_code, raw_results)  # repack and go home
-        results = json.loads(raw_results[0])
-        if 'errors' in results:
-            return 1, [json.dumps(results, indent=4, sort_keys=True)]
-        else:
-            return 0, [json.dumps(results, indent=4, sort_keys=True)]
+        ret_code = 1 if raw_results[0].has_key('errors') else 0
+        if was_json:
+            return ret_code, raw_results  # The server's bytes, untouched
+        return ret_code, [
+            json.dumps(raw_results[0].data, indent=4, sort_keys=True)
+        ]
 
 
 class BAImportDispatch(BA):
@@ -36,6 +41,13 @@ class BAImportDispatch(BA):
             '--commit', action='store_true', default=False,
             help="Commit changes to the db."
         )
+        p.add_argument(
+            '--chunk-size', type=int, default=None, dest='chunk_size',
+            help="Send the systems this many at a time: every chunk is "
+            "validated concurrently, then (with --commit) committed. Chunks "
+            "are saved separately"
+        )
+        add_concurrency_argument(p)
 
     def route(self, nas):
         return getattr(self, nas.dtype)(nas)
@@ -43,18 +55,67 @@ class BAImportDispatch(BA):
     def ba_import(self, nas):
         # naively read in from stdin
         raw_json = nas.IN.read().strip('\n')
+        if nas.chunk_size:
+            return self.chunked_import(nas, raw_json)
         return self.do_import(nas, raw_json)
 
+    def chunked_import(self, nas, raw_json):
+        """
+        ba_import_chunked, with a line for every request as it finishes,
+        then every error, then the totals.
+        """
+        try:
+            blob = json.loads(raw_json)
+        except ValueError as e:
+            return 1, ["Couldn't decode the blob: {0}".format(e)]
+        url = "{0}{1}".format(REMOTE, "/en-US/bulk_action/import/")
+        if nas.explain:
+            for chunk in split_blob(blob, nas.chunk_size):
+                self.explain(nas, 'post', url, json.dumps(chunk))
+                if nas.commit:
+                    chunk['commit'] = True
+                    self.explain(nas, 'post', url, json.dumps(chunk))
+            return 0, []
+
+        def progress(timing):
+            if nas.p_json:
+                self.emit(nas, json.dumps(timing))
+                return
+            systems = timing['systems']
+            self.emit(nas, "{0} {1} systems ({2}..{3}) {4:.2f}s {5}".format(
+                timing['phase'], len(systems), systems[0], systems[-1],
+                timing['seconds'], "error: {0}".format(timing['error'])
+                if timing['error'] else 'ok'
+            ))
+
+        merged, errors, report = ba_import_chunked(
+            blob, commit=nas.commit, chunk_size=nas.chunk_size,
+            concurrency=nas.concurrency, progress=progress
+        )
+        stats = report['stats']
+        if nas.p_json:
+            return (1 if errors else 0), [json.dumps({
+                'errors': errors, 'summary': stats.as_dict()
+            })]
+        resp_list = [
+            "error {0}: {1}".format(', '.join(error['systems']),
+                                    error['errors'])
+            for error in errors
+        ]
+        return (1 if errors else 0), resp_list + ["# {0}".format(stats)]
+
     def do_import(self, nas, main_json):
         tmp_url = "/en-US/bulk_action/import/"
         url = "{0}{1}".format(REMOTE, tmp_url)
-        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
-        resp = requests.post(url, data=main_json, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'post', url, main_json)
+        resp = inventory_client().send(
+            'post', url, data=main_json, headers=BA_HEADERS
+        )
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, main_json
             ))
-        nas.p_json = True  # Do this so we can play with the response
         return self.handle_ba_resp(nas, main_json, resp)
 
 
@@ -84,14 +145,14 @@ class BAExportDispatch(BA):
     def query(self, nas):
         tmp_url = "/bulk_action/export/"
         url = "{0}{1}".format(REMOTE, tmp_url)
-        headers = {'content-type': 'application/json'}
         query = {'q': nas.query}
-        resp = requests.get(url, params=query, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'get', url, params=query)
+        resp = inventory_client().send('get', url, params=query)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, query
             ))
-        nas.p_json = True  # Do this so we can play with the response
         return self.handle_ba_resp(nas, query, resp)
 
 
@@ -7,6 +7,15 @@ from invtool.dispatch import ObjectDispatch
 from invtool.tests.utils import call_to_json, test_method_to_params, EXEC
 
 from invtool.lib.registrar import registrar
+from invtool.lib.config import REMOTE, API_MAJOR_VERSION
+from invtool.lib.concurrency import pmap
+from invtool.lib.bulk import Throughput
+from invtool.lib.parser import build_lookup_parser
+from invtool.lib.mirror import object_pk, open_mirror
+from invtool.lib.netindex import (
+    NetworkIndex, in_scope, load_network_index, match_scope, network_entries,
+    save_network_index
+)
 from invtool.lib.options import (
     description_argument, comment_argument, update_pk_argument,
     delete_pk_argument, detail_pk_argument
@@ -20,6 +29,17 @@ from invtool.lib.core_options import (
 
 # TODO, make a core_dispatch.py with CoreDispatch base class
 
+# (option, nas attribute) of the natural keys that can be used instead of --pk
+NETWORK_KEY = ('network-str', 'network_str')
+SITE_KEY = ('name', 'full_name')
+VLAN_KEY = ('name', 'name')
+
+# Objects per list request when building the network index
+INDEX_PAGE_SIZE = 500
+
+# `NET lookup` writes its answers this many lines at a time
+LOOKUP_BATCH = 2048
+
 
 class CoreDispatch(ObjectDispatch):
     object_url = "/en-US/core/api/v1_core/{1}/{2}/"
@@ -31,6 +51,9 @@ class DispatchNetwork(CoreDispatch):
     dtype = 'NET'
     dgroup = 'core'
     ip_type = None
+    natural_key = 'network_str'
+    update_key_fields = ('pk', 'network-str')
+    upsert_key = ('network_str',)
 
     def test_setup(self):
         def setUp(self):
@@ -121,7 +144,7 @@ class DispatchNetwork(CoreDispatch):
         network_str_argument('network-str'),
         comment_argument('comment'),
         description_argument('description'),
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, NETWORK_KEY)
     ]
 
     create_args = [
@@ -133,10 +156,10 @@ class DispatchNetwork(CoreDispatch):
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, NETWORK_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, NETWORK_KEY)]
 
     def get_create_data(self, nas):
         data = super(DispatchNetwork, self).get_create_data(nas)
@@ -146,6 +169,172 @@ class DispatchNetwork(CoreDispatch):
         data = super(DispatchNetwork, self).get_update_data(nas)
         return set_ip_type('network_str', data)
 
+    def build_parser(self, base_parser):
+        action_parser = super(DispatchNetwork, self).build_parser(base_parser)
+        build_lookup_parser(self, action_parser)
+        return action_parser
+
+    def list_url(self, resource):
+        return "{0}{1}".format(REMOTE, self.object_list_url.format(
+            API_MAJOR_VERSION, resource
+        ))
+
+    def fetch_networks(self, nas, site=None, vlan=None,
+                       page_size=INDEX_PAGE_SIZE):
+        """
+        Returns (networks, sites, vlans, error) from Inventory's lists.
+        Sites and vlans are matched the way site=: and vlan=: match them
+        and the network list is filtered on their pks by the server, so
+        only the networks of a site or vlan are paged through.
+        """
+        lists = dict(pmap(
+            lambda resource: self.fetch_all(
+                nas, self.list_url(resource), {'format': 'json'}, page_size
+            ), ['site', 'vlan'], nas.concurrency
+        ))
+        for resource in ('site', 'vlan'):
+            if lists[resource][1]:
+                return None, None, None, "{0}: {1}".format(
+                    resource, lists[resource][1]
+                )
+        sites, vlans = match_scope(
+            lists['site'][0], lists['vlan'][0], site, vlan
+        )
+        if (site and not sites) or (vlan and not vlans):
+            return [], sites, vlans, None
+        params = {'format': 'json'}
+        if site:
+            params['site__in'] = ','.join(
+                str(object_pk(obj)) for obj in sites
+            )
+        if vlan:
+            params['vlan__in'] = ','.join(
+                str(object_pk(obj)) for obj in vlans
+            )
+        url = self.list_url('network')
+        networks = []
+        for status, objects, error in self.fetch_pages(nas, url, params,
+                                                       page_size):
+            if status == 400 and len(params) > 1:
+                # The server won't filter networks on site or vlan; page
+                # through all of them and match them here
+                networks, error = self.fetch_all(
+                    nas, url, {'format': 'json'}, page_size
+                )
+                break
+            if error:
+                break
+            networks += objects
+        if error:
+            return None, None, None, "network: {0}".format(error)
+        return in_scope(networks, sites, vlans, site, vlan), sites, vlans, None
+
+    def network_index(self, nas):
+        """
+        Returns (NetworkIndex, error). The index comes from the mirror with
+        --local, otherwise from the on disk cache or, if that is stale,
+        from Inventory's network, site and vlan lists. An index limited to
+        --site or --vlan is never cached.
+        """
+        if nas.local:
+            mirror = open_mirror()
+            try:
+                if mirror.is_empty():
+                    return None, ("The local mirror is empty. Run `invtool "
+                                  "mirror sync` first.")
+                sites, vlans = match_scope(
+                    list(mirror.objects('SITE')),
+                    list(mirror.objects('VLAN')), nas.site, nas.vlan
+                )
+                networks = in_scope(mirror.objects('NET'), sites, vlans,
+                                    nas.site, nas.vlan)
+                return NetworkIndex(network_entries(
+                    networks, sites, vlans
+                )), None
+            finally:
+                mirror.close()
+        scoped = nas.site or nas.vlan
+        if not (nas.refresh or scoped):
+            index = load_network_index()
+            if index is not None:
+                return index, None
+        if nas.explain:
+            for resource in ('site', 'vlan', 'network'):
+                self.explain(nas, 'get', self.list_url(resource), params={
+                    'format': 'json', 'limit': INDEX_PAGE_SIZE, 'offset': 0
+                })
+            return None, None
+        networks, sites, vlans, error = self.fetch_networks(
+            nas, nas.site, nas.vlan
+        )
+        if error:
+            return None, error
+        index = NetworkIndex(network_entries(networks, sites, vlans))
+        if scoped:
+            return index, None
+        save_network_index(index)
+        return index, None
+
+    def lookup_line(self, nas, ip, entry):
+        if nas.p_json:
+            if entry is None:
+                return json.dumps({'ip': ip, 'network': None})
+            return json.dumps(dict(entry, ip=ip))
+        if entry is None:
+            return "{0} not in any network".format(ip)
+        return "{0} {1} {2} {3}".format(
+            ip, entry['network'], entry['site'] or '-', entry['vlan'] or '-'
+        )
+
+    def lookup(self, nas):
+        """
+        Print the network, site and vlan of every address given with --ip
+        or read from stdin. Answers are written in batches as they are
+        found, so a stream of any length runs in constant memory.
+        """
+        index, error = self.network_index(nas)
+        if error:
+            return 1, [json.dumps({'errors': error}) if nas.p_json
+                       else error]
+        if index is None:  # --explain
+            return 0, []
+        if nas.ips:
+            ips = nas.ips
+        else:
+            ips = (
+                line.split()[0] for line in nas.IN
+                if line.strip() and not line.startswith('#')
+            )
+        stats = Throughput(unit='addresses')
+        found = missing = bad = 0
+        lookup, batch = index.lookup, []
+        for ip in ips:
+            try:
+                entry = lookup(ip)
+            except ValueError as e:
+                bad += 1
+                batch.append(json.dumps({'ip': ip, 'error': str(e)})
+                             if nas.p_json else "{0} error: {1}".format(ip, e))
+                continue
+            if entry is None:
+                missing += 1
+            else:
+                found += 1
+            batch.append(self.lookup_line(nas, ip, entry))
+            if len(batch) >= LOOKUP_BATCH:
+                self.emit(nas, '\n'.join(batch))
+                batch = []
+        if batch:
+            self.emit(nas, '\n'.join(batch))
+        for status, count in (('found', found), ('not_found', missing),
+                              ('error', bad)):
+            if count:
+                stats.add(status, count)
+        ret_code = 1 if bad else 0
+        if nas.p_json:
+            return ret_code, [json.dumps({'summary': stats.as_dict()})]
+        return ret_code, ["# {0}".format(stats)]
+
 
 registrar.register(DispatchNetwork())
 
@@ -154,25 +343,28 @@ class DispatchSite(CoreDispatch):
     resource_name = 'site'
     dtype = 'SITE'
     dgroup = 'core'
+    natural_key = 'full_name'
+    update_key_fields = ('pk', 'full_name')
+    upsert_key = ('full_name',)
 
     update_args = [
-        name_argument('full_name'),
+        name_argument('full_name', option=SITE_KEY[0]),
         comment_argument('comment'),
         description_argument('description'),
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, SITE_KEY)
     ]
 
     create_args = [
-        name_argument('full_name', required=True),
+        name_argument('full_name', required=True, option=SITE_KEY[0]),
         comment_argument('comment'),
         description_argument('description')
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, SITE_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, SITE_KEY)]
 
 
 registrar.register(DispatchSite())
@@ -182,13 +374,16 @@ class DispatchVlan(CoreDispatch):
     resource_name = 'vlan'
     dtype = 'VLAN'
     dgroup = 'core'
+    natural_key = 'name'
+    update_key_fields = ('pk', 'name')
+    upsert_key = ('name', 'number')
 
     update_args = [
         name_argument('name'),
         number_argument('number'),
         comment_argument('comment'),
         description_argument('description'),
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, VLAN_KEY)
     ]
 
     create_args = [
@@ -199,10 +394,10 @@ class DispatchVlan(CoreDispatch):
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, VLAN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, VLAN_KEY)]
 
 
 registrar.register(DispatchVlan())
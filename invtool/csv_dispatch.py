@@ -1,4 +1,3 @@
-import requests
 import sys
 
 try:
@@ -8,7 +7,8 @@ except ImportError:
 
 from invtool.dispatch import Dispatch
 from invtool.lib.registrar import registrar
-from invtool.lib.config import REMOTE, auth
+from invtool.lib.config import REMOTE
+from invtool.lib.client import inventory_client
 
 
 class CSVDispatch(Dispatch):
@@ -37,9 +37,10 @@ class CSVDispatch(Dispatch):
     def query(self, nas):
         tmp_url = "/en-US/csv/ajax_csv_exporter/"
         url = "{0}{1}".format(REMOTE, tmp_url)
-        headers = {'content-type': 'application/json'}
         search = {'search': nas.query}
-        resp = requests.get(url, params=search, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'get', url, params=search)
+        resp = inventory_client().send('get', url, params=search)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, search
@@ -49,13 +50,12 @@ class CSVDispatch(Dispatch):
         ret_code, raw_results = self.handle_resp(nas, search, resp)
         if ret_code:
             return (ret_code, raw_results)  # repack and go home
-        results = json.loads(raw_results[0])
-        if 'csv_content' not in results:
+        if not raw_results[0].has_key('csv_content'):
             return 1, []
         else:
             if was_json:
                 return 0, raw_results
-            return 0, [''.join(results['csv_content'])]
+            return 0, [''.join(raw_results[0].data['csv_content'])]
 
 
 registrar.register(CSVDispatch())
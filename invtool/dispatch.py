@@ -4,17 +4,31 @@ except ImportError:
     import json
 import sys
 import requests
+import argparse
+from itertools import chain, islice
 
 from gettext import gettext as _
 from invtool.lib.registrar import registrar
-from invtool.lib.config import REMOTE, auth, API_MAJOR_VERSION
+from invtool.lib.config import REMOTE, API_MAJOR_VERSION
 from invtool.lib.parser import (
     build_create_parser, build_update_parser, build_delete_parser,
-    build_detail_parser
+    build_detail_parser, build_bulk_create_parser, build_bulk_delete_parser,
+    build_bulk_update_parser, build_upsert_parser, add_skip_unchanged_argument
 )
+from invtool.lib.bulk import (
+    read_rows, build_row_parser, parse_row, merge_rows, Throughput, BulkRow
+)
+from invtool.lib.concurrency import session, pmap, chunked
+from invtool.lib.response import RawJSON
+from invtool.lib.natural_keys import natural_key_index
+from invtool.lib.client import error_summary, format_errors, inventory_client
+from invtool.lib.search_results import parse_output_line
 
 # XXX API_MAJOR_VERSION is probably in the wrong place
 
+# Statuses whose JSON can be passed through as is, and their return codes
+RAW_STATUSES = {200: 0, 201: 0, 202: 0, 204: 0, 400: 1, 404: 1}
+
 
 class Dispatch(object):
     def format_response(self, nas, resp_msg, user_msg):
@@ -28,6 +42,11 @@ class Dispatch(object):
         return resp_list
 
     def handle_resp(self, nas, data, resp):
+        if nas.p_json and resp.status_code in RAW_STATUSES:
+            # Hand the server's bytes back untouched; they are only decoded if
+            # someone looks inside.
+            ret_code = RAW_STATUSES[resp.status_code]
+            return ret_code, [RawJSON(resp.content, resp.status_code)]
         try:
             resp_msg = self.get_resp_dict(resp)
         except json.decoder.JSONDecodeError:
@@ -78,13 +97,145 @@ class Dispatch(object):
             return self.error_out(nas, data, resp, resp_list=resp_list)
 
     def get_errors(self, resp_msg):
-        messages = json.loads(resp_msg, 'unicode')
-        errors = []
-        for error, msg in messages.iteritems():
-            if error == '__all__':
-                error = "Object Error"
-            errors.append("Error: {0}  {1}".format(error, ', '.join(msg)))
-        return 1, errors
+        return 1, format_errors(resp_msg)
+
+    def error_summary(self, resp):
+        """
+        Squash the errors in a response into one line. Bulk actions use this
+        to report a failure next to the row that caused it.
+        """
+        return error_summary(resp)
+
+    def emit(self, nas, line):
+        """
+        Write a result line as soon as it is ready instead of waiting for the
+        whole command to finish. Used by the bulk actions. Text decoded from
+        the server is written as UTF-8.
+        """
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        if not nas.p_silent:
+            nas.OUT.write(line + '\n')
+            nas.OUT.flush()
+
+    def emit_rows(self, nas, rows, stats):
+        for row in rows:
+            stats.add(row.status)
+            if nas.explain and not row.error:
+                continue  # The plan is printed instead
+            if nas.p_json:
+                self.emit(nas, json.dumps(row.as_dict()))
+            else:
+                self.emit(nas, str(row))
+
+    def bulk_summary(self, nas, stats):
+        ret_code = 1 if stats.counts.get('error') else 0
+        if nas.p_json:
+            return ret_code, [json.dumps({'summary': stats.as_dict()})]
+        return ret_code, [str(stats)]
+
+    def pk_nas(self, pk):
+        """
+        Build just enough of a namespace for the *_url methods to address the
+        object with primary key pk.
+        """
+        return argparse.Namespace(pk=pk)
+
+    def forget_pk(self, pk):
+        pass  # Only ObjectDispatch keeps a natural key index
+
+    def iter_delete_rows(self, nas):
+        dispatches = dict(
+            (d.dtype.lower(), d) for d in registrar.dispatches
+            if hasattr(d, 'delete_args')
+        )
+        for line_no, line in enumerate(nas.IN, 1):
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            row = BulkRow(line_no)
+            hit = parse_output_line(line) if len(tokens) > 2 else None
+            if hit is not None:  # Output of `invtool search`
+                row.dtype, row.pk = hit.type, str(hit.key()[1])
+            elif len(tokens) == 1:
+                row.dtype, row.pk = self.dtype, tokens[0]
+            elif len(tokens) == 2:
+                row.dtype, row.pk = tokens
+            else:
+                row.status, row.error = 'error', "expected '<dtype> <pk>'"
+                yield None, row
+                continue
+            dispatch = dispatches.get(row.dtype.lower())
+            if dispatch is None:
+                row.status = 'error'
+                row.error = "unknown dtype '{0}'".format(row.dtype)
+            elif not row.pk.isdigit() and not (
+                    getattr(dispatch, 'natural_key', None) or
+                    getattr(dispatch, 'named_pks', False)):
+                row.status, row.error = 'error', "pk must be an integer"
+            yield dispatch, row
+
+    def bulk_delete(self, nas):
+        """
+        Delete every '<dtype> <pk>' (or search result) read from nas.IN,
+        nas.concurrency at a time over one pooled session.
+        """
+        stats = Throughput(unit='objects')
+        headers = {'content-type': 'application/json'}
+
+        def delete(item):
+            dispatch, row = item
+            if row.error:
+                return row
+            if not row.pk.isdigit() and not dispatch.named_pks:
+                # A natural key, e.g. an fqdn
+                row.pk, cached, row.error = dispatch.resolve_pk(
+                    row.pk, plan=nas.plan if nas.explain else None
+                )
+                if row.error:
+                    row.status = 'error'
+                    return row
+            obj_nas = dispatch.pk_nas(row.pk)
+            url = "{0}{1}".format(REMOTE, dispatch.delete_url(obj_nas))
+            if nas.explain:
+                nas.plan.add('delete', url)
+                if nas.verify:
+                    nas.plan.add('get', "{0}{1}".format(
+                        REMOTE, dispatch.detail_url(obj_nas)
+                    ))
+                row.status = 'planned'
+                return row
+            resp = session(nas.concurrency).delete(
+                url, params={'format': 'json'}, headers=headers
+            )
+            row.http_status = resp.status_code
+            if resp.status_code not in (200, 202, 204):
+                row.status, row.error = 'error', self.error_summary(resp)
+                return row
+            row.status = 'deleted'
+            dispatch.forget_pk(row.pk)
+            if nas.verify:
+                url = "{0}{1}".format(REMOTE, dispatch.detail_url(obj_nas))
+                resp = session(nas.concurrency).get(
+                    url, params={'format': 'json'}, headers=headers
+                )
+                if resp.status_code != 404:
+                    row.status = 'error'
+                    row.error = (
+                        "still there after delete (http_status: {0})"
+                        .format(resp.status_code)
+                    )
+                else:
+                    row.status = 'verified'
+            return row
+
+        rows = pmap(delete, self.iter_delete_rows(nas), nas.concurrency)
+        for item, row in rows:
+            if row.error or nas.p_json:
+                self.emit_rows(nas, [row], stats)
+            else:
+                stats.add(row.status)
+        return self.bulk_summary(nas, stats)
 
     def get_resp_dict(self, resp):
         if resp.text:
@@ -95,6 +246,67 @@ class Dispatch(object):
         msg['http_status'] = resp.status_code
         return msg
 
+    def get_json(self, nas, url, params):
+        """
+        Returns (status, decoded body) or (status, error message).
+        """
+        resp = session(nas.concurrency).get(
+            url, params=params, headers={'content-type': 'application/json'}
+        )
+        if resp.status_code != 200:
+            return resp.status_code, self.error_summary(resp)
+        try:
+            return 200, json.loads(resp.text)
+        except json.decoder.JSONDecodeError:
+            return 200, "Couldn't understand the server's response"
+
+    def fetch_pages(self, nas, url, params, page_size, meta=None):
+        """
+        Yield (status, objects, error) for every page of a tastypie list.
+        The first page says how many there are; the rest are fetched
+        concurrently. If a meta dict is given the first page's meta is
+        copied into it.
+        """
+        params = dict(params, limit=page_size, offset=0)
+        status, body = self.get_json(nas, url, params)
+        if status != 200:
+            yield status, None, body
+            return
+        if meta is not None:
+            meta.update(body.get('meta', {}))
+        yield status, body.get('objects', []), None
+        total = body.get('meta', {}).get('total_count', 0)
+
+        def page(offset):
+            return self.get_json(nas, url, dict(params, offset=offset))
+
+        offsets = range(page_size, total, page_size)
+        for offset, (status, body) in pmap(page, offsets, nas.concurrency,
+                                           ordered=False):
+            if status != 200:
+                yield status, None, body
+            else:
+                yield status, body.get('objects', []), None
+
+    def fetch_all(self, nas, url, params, page_size):
+        """
+        Every object of a tastypie list. Returns (objects, error).
+        """
+        objects = []
+        for status, page, error in self.fetch_pages(nas, url, params,
+                                                    page_size):
+            if error:
+                return None, error
+            objects += page
+        return objects, None
+
+    def explain(self, nas, method, url, data=None, params=None):
+        """
+        Put a request in the --explain plan instead of sending it.
+        """
+        nas.plan.add(method, url, body=data, params=params)
+        return 0, []
+
     def error_out(self, nas, data, resp, resp_list=[]):
         resp_list.append(resp.content)
         resp_list.append(str(nas))
@@ -103,18 +315,20 @@ class Dispatch(object):
 
     def delete(self, nas):
         url = "{0}{1}?format=json".format(REMOTE, self.delete_url(nas))
-        headers = {'content-type': 'application/json'}
-        resp = requests.delete(url, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'delete', url)
+        resp = inventory_client().send('delete', url)
         return self.handle_resp(nas, {}, resp)
 
     def detail(self, nas):
         url = "{0}{1}?format=json".format(REMOTE, self.detail_url(nas))
-        headers = {'content-type': 'application/json'}
+        if nas.explain:
+            return self.explain(nas, 'get', url)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, {}
             ))
-        resp = requests.get(url, headers=headers, auth=auth())
+        resp = inventory_client().send('get', url)
         return self.handle_resp(nas, {}, resp)
 
     def update(self, nas):
@@ -134,11 +348,15 @@ class Dispatch(object):
         else:
             wire_data = data
 
+        if nas.explain:
+            return self.explain(nas, method.__name__, url, wire_data or None)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 method.__name__, url, json.dumps(data, indent=2)
             ))
-        resp = method(url, headers=headers, data=wire_data, auth=auth())
+        resp = inventory_client().send(
+            method.__name__, url, data=wire_data, headers=headers
+        )
         return self.handle_resp(nas, data, resp)
 
     def get_create_data(self, nas):
@@ -157,10 +375,23 @@ class Dispatch(object):
 class ObjectDispatch(Dispatch):  # Handy base class
     object_url = None  # fill me in
     object_list_url = None  # fill me in
+    update_key_fields = ('pk',)  # What bulk-update rows are keyed by
+    # A field (and nas attribute) that identifies an object as well as its
+    # pk does, e.g. 'fqdn'. Resolved pks are kept in the natural key index.
+    natural_key = None
+    # Fields every object of this dtype has, for resources shared by more
+    # than one dtype (A and AAAA are both addressrecords). Natural key
+    # lookups filter on them too.
+    natural_key_filters = {}
+    # The fields upsert uses to find an existing object
+    upsert_key = None
+    # True if the detail and delete URLs take a name in place of the pk
+    # (systems are addressed by hostname), so no lookup is needed.
+    named_pks = False
 
     def route(self, nas):
         if self.dtype.lower() == nas.dtype.lower():
-            return getattr(self, nas.action.lower())(nas)
+            return getattr(self, nas.action.lower().replace('-', '_'))(nas)
 
     def build_parser(self, base_parser):
         record_base_parser = base_parser.add_parser(
@@ -173,9 +404,686 @@ class ObjectDispatch(Dispatch):  # Handy base class
             dest='action'
         )
         build_create_parser(self, action_parser)
-        build_update_parser(self, action_parser)
+        add_skip_unchanged_argument(
+            build_update_parser(self, action_parser)
+        )
         build_delete_parser(self, action_parser)
         build_detail_parser(self, action_parser)
+        build_bulk_create_parser(self, action_parser)
+        build_bulk_delete_parser(self, action_parser)
+        build_bulk_update_parser(self, action_parser)
+        if self.upsert_key:
+            build_upsert_parser(self, action_parser)
+        return action_parser
+
+    def mirror_dtype(self, obj):
+        """
+        The dtype an object of this resource is stored under in the mirror.
+        """
+        return self.dtype
+
+    def upsert(self, nas):
+        """
+        Create the object, or if one with the same upsert_key already exists
+        PATCH only the fields that differ. That is one lookup and at most one
+        write.
+        """
+        data = self.get_create_data(nas)
+        key = dict((field, data.get(field)) for field in self.upsert_key)
+        missing = [field for field, value in key.items() if not value]
+        if missing:
+            return self.key_error(nas, "upsert needs {0}".format(
+                ', '.join(missing)
+            ))
+        url, params = self.upsert_lookup_request(key)
+        create_url = "{0}{1}".format(REMOTE, self.create_url(nas))
+        if nas.explain:
+            nas.plan.add('get', url, params=params)
+            # Followed by this or a (smaller) PATCH, depending on the lookup
+            nas.plan.add('post', create_url, body=data)
+            return 0, []
+
+        existing, error = self.find_existing(url, params, key)
+        if error:
+            return self.key_error(nas, error)
+        if existing is None:
+            self.forget_key(data.get(self.natural_key))
+            ret_code, resp_list = self.action(
+                nas, create_url, requests.post, data
+            )
+            return self.upsert_response(nas, ret_code, resp_list, 'created')
+
+        changes = self.differing_fields(existing, data)
+        if not changes:
+            existing['http_status'] = 200
+            return self.upsert_response(nas, 0, self.format_response(
+                nas, existing, "http_status: 200 (Success)"
+            ), 'unchanged')
+        url = "{0}{1}".format(
+            REMOTE, self.update_url(self.pk_nas(existing['pk']))
+        )
+        ret_code, resp_list = self.action(nas, url, requests.patch, changes)
+        return self.upsert_response(
+            nas, ret_code, resp_list, 'updated', sorted(changes)
+        )
+
+    def upsert_lookup_request(self, key):
+        url = "{0}{1}".format(REMOTE, self.object_list_url.format(
+            API_MAJOR_VERSION, self.resource_name
+        ))
+        params = dict(key)
+        params.update({'format': 'json', 'limit': 2})
+        return url, params
+
+    def find_existing(self, url, params, key):
+        """
+        Returns (object, error); object is None if nothing matches key.
+        """
+        resp = session().get(
+            url, params=params, headers={'content-type': 'application/json'}
+        )
+        if resp.status_code != 200:
+            return None, self.error_summary(resp)
+        try:
+            resp_msg = self.get_resp_dict(resp)
+        except json.decoder.JSONDecodeError:
+            return None, "Couldn't understand the server's response"
+        returned = resp_msg.get('objects', [])
+        key_str = ', '.join(
+            "{0}={1}".format(f, v) for f, v in sorted(key.items())
+        )
+        # Filters the server doesn't know about are ignored, so double check
+        objects = [
+            obj for obj in returned
+            if all(same_value(obj.get(f), v) for f, v in key.items())
+        ]
+        if len(objects) > 1:
+            return None, "More than one {0} matches {1} (pks: {2})".format(
+                self.dtype, key_str, ', '.join(
+                    str(obj['pk']) for obj in objects
+                )
+            )
+        total = resp_msg.get('meta', {}).get('total_count', len(returned))
+        if total > len(returned):
+            # The match could be among the rows that weren't returned, so
+            # creating could make a duplicate
+            return None, ("The server found {0} {1} objects for {2}; it "
+                          "may not filter on all of them. Use update "
+                          "--pk".format(total, self.dtype, key_str))
+        return (objects[0] if objects else None), None
+
+    def differing_fields(self, existing, data):
+        """
+        The part of data that would change existing. Override this for
+        fields the server hands back differently than they are sent.
+        """
+        changes = {}
+        for field, value in data.iteritems():
+            if field != 'comment' and not same_value(existing.get(field),
+                                                     value):
+                changes[field] = value
+        if changes and data.get('comment'):
+            changes['comment'] = data['comment']
+        return changes
+
+    def upsert_response(self, nas, ret_code, resp_list, status, fields=()):
+        if ret_code:
+            return ret_code, resp_list
+        if nas.p_json:
+            obj = resp_list[0]
+            obj = obj.data if isinstance(obj, RawJSON) else json.loads(obj)
+            obj['upsert'] = status
+            return ret_code, [json.dumps(obj, indent=2)]
+        msg = "upsert: {0}".format(status)
+        if fields:
+            msg += " ({0})".format(', '.join(fields))
+        return ret_code, [msg] + resp_list
+
+    def bulk_create(self, nas):
+        """
+        Create one object per NDJSON/CSV row read from nas.IN. Rows are sent
+        in chunks with a tastypie bulk PATCH to the list endpoint. If the
+        endpoint doesn't allow that we fall back to POSTing every row.
+        """
+        parser = build_row_parser(self.create_args)
+        url = "{0}{1}".format(REMOTE, self.create_url(nas))
+        state = {'patch': not nas.no_patch}
+        chunk_size = max(1, nas.chunk_size) if state['patch'] else 1
+        stats = Throughput()
+
+        def prepare(row):
+            row_nas = parse_row(parser, row)
+            if row_nas is not None:
+                row.data = self.get_create_data(row_nas)
+                if not nas.explain:
+                    self.forget_key(row.data.get(self.natural_key))
+            return row
+
+        def submit(rows):
+            ready = [row for row in rows if not row.error]
+            if nas.explain:
+                self.plan_rows(nas, url, ready, state['patch'])
+                return rows
+            if ready and state['patch']:
+                if self.bulk_patch(nas, url, ready):
+                    return rows
+                state['patch'] = False
+            for row in ready:
+                self.bulk_post(nas, url, row)
+            return rows
+
+        chunks = chunked((prepare(row) for row in read_rows(nas.IN)),
+                         chunk_size)
+        for chunk, rows in pmap(submit, chunks, nas.concurrency):
+            self.emit_rows(nas, rows, stats)
+        return self.bulk_summary(nas, stats)
+
+    def plan_rows(self, nas, url, rows, patch):
+        if patch and rows:
+            nas.plan.add(
+                'patch', url, body={'objects': [row.data for row in rows]}
+            )
+        for row in rows:
+            if not patch:
+                nas.plan.add('post', url, body=row.data)
+            row.status = 'planned'
+
+    def bulk_patch(self, nas, url, rows):
+        """
+        Send rows to the list endpoint in one PATCH. Returns False if the
+        server doesn't support bulk PATCH so the caller can fall back.
+        """
+        headers = {'content-type': 'application/json'}
+        body = {'objects': [row.data for row in rows]}
+        if nas.DEBUG:
+            sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
+                'patch', url, json.dumps(body, indent=2)
+            ))
+        resp = session(nas.concurrency).patch(
+            url, headers=headers, data=json.dumps(body)
+        )
+        if resp.status_code in (405, 501):
+            return False
+
+        created = []
+        if resp.status_code in (200, 201, 202, 204):
+            status, error = 'created', None
+            try:
+                created = self.get_resp_dict(resp).get('objects', [])
+            except json.decoder.JSONDecodeError:
+                pass
+        else:
+            status, error = 'error', self.error_summary(resp)
+
+        for i, row in enumerate(rows):
+            row.status, row.error = status, error
+            row.http_status = resp.status_code
+            if len(created) == len(rows):
+                row.pk = created[i].get('pk', created[i].get('id'))
+        return True
+
+    def bulk_update(self, nas):
+        """
+        Apply NDJSON/CSV rows read from nas.IN as updates. All rows touching
+        the same object are merged and sent as a single PATCH. Unless
+        --no-skip-unchanged is given the objects are fetched first (a chunk
+        at a time) and only the fields that differ are sent.
+        """
+        parser = build_row_parser(self.update_args, required=False)
+        stats = Throughput(unit='objects')
+        merged, errors = merge_rows(read_rows(nas.IN), self.update_key_fields)
+        self.emit_rows(nas, errors, stats)
+
+        def update(row):
+            url = self.prepare_update_row(nas, parser, row)
+            if url is None:
+                return row
+            if nas.explain:
+                nas.plan.add('patch', url, body=row.data)
+                row.status = 'planned'
+                return row
+            return self.bulk_patch_one(nas, url, row)
+
+        def update_changed(rows):
+            urls = [self.prepare_update_row(nas, parser, row) for row in rows]
+            ready = [(row, url) for row, url in zip(rows, urls) if url]
+            if nas.explain:
+                self.plan_fetch_current(nas, [row.pk for row, url in ready])
+                for row, url in ready:
+                    nas.plan.add('patch', url, body=row.data)
+                    row.status = 'planned'
+                return rows
+            current = self.fetch_current(nas, [row.pk for row, url in ready])
+            for row, url in ready:
+                obj = current.get(str(row.pk))
+                if obj is None:
+                    row.status = 'error'
+                    row.error = "http_status: 404 (not found)"
+                    continue
+                changes = self.differing_fields(obj, row.data)
+                if not changes:
+                    row.status = 'unchanged'
+                    continue
+                row.data = changes
+                self.bulk_patch_one(nas, url, row)
+            return rows
+
+        if nas.skip_unchanged:
+            results = (
+                rows for chunk, rows in pmap(
+                    update_changed, chunked(merged, self.detail_set_size),
+                    nas.concurrency
+                )
+            )
+        else:
+            results = (
+                [row] for item, row in pmap(update, merged, nas.concurrency)
+            )
+        for rows in results:
+            self.emit_rows(nas, rows, stats)
+        return self.bulk_summary(nas, stats)
+
+    def prepare_update_row(self, nas, parser, row):
+        """
+        Validate a merged bulk-update row and find the object it is for.
+        Returns the URL to PATCH, or None if there is nothing to send.
+        """
+        if row.error:
+            return None
+        if not set(row.fields) - set(self.update_key_fields):
+            row.status = 'skipped'
+            return None
+        row_nas = parse_row(parser, row)
+        if row_nas is None:
+            return None
+        if row_nas.pk is None:
+            row_nas.pk, cached, row.error = self.resolve_pk(
+                self.natural_key_value(row_nas),
+                plan=nas.plan if nas.explain else None
+            )
+            if row.error:
+                row.status = 'error'
+                return None
+        elif self.natural_key_value(row_nas) and not nas.explain:
+            self.forget_pk(row_nas.pk)  # The natural key may change
+        row.data = self.get_update_data(row_nas)
+        row.pk = row_nas.pk
+        return "{0}{1}".format(REMOTE, self.update_url(row_nas))
+
+    def fetch_current(self, nas, pks):
+        """
+        Fetch the objects with the given pks as they are now. Returns a dict
+        of str(pk) -> object; objects that don't exist are left out.
+        """
+        pks = [str(pk) for pk in pks]
+        numeric = [pk for pk in pks if pk.isdigit()]
+        results = self.fetch_set(nas, numeric) if numeric else []
+        if results is None:
+            results = self.fetch_each(nas, numeric)
+        current = dict(
+            (pk, obj) for pk, status, obj in results if status == 200
+        )
+        for pk in pks:
+            if not pk.isdigit():  # e.g. a SYS hostname
+                resp = session(nas.concurrency).get(
+                    "{0}{1}".format(REMOTE, self.detail_url(self.pk_nas(pk))),
+                    params={'format': 'json'},
+                    headers={'content-type': 'application/json'}
+                )
+                if resp.status_code == 200:
+                    current[pk] = self.get_resp_dict(resp)
+        return current
+
+    def plan_fetch_current(self, nas, pks):
+        # '{pk}' stands for a pk that a natural key lookup would find
+        pks = [str(pk) for pk in pks]
+        numeric = [pk for pk in pks if pk.isdigit() or pk == '{pk}']
+        if numeric:
+            nas.plan.add('get', "{0}{1}".format(REMOTE, self.set_url(numeric)),
+                         params={'format': 'json'})
+        for pk in pks:
+            if pk not in numeric:
+                nas.plan.add('get', "{0}{1}".format(
+                    REMOTE, self.detail_url(self.pk_nas(pk))
+                ), params={'format': 'json'})
+
+    def bulk_patch_one(self, nas, url, row):
+        headers = {'content-type': 'application/json'}
+        if nas.DEBUG:
+            sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
+                'patch', url, json.dumps(row.data, indent=2)
+            ))
+        resp = session(nas.concurrency).patch(
+            url, headers=headers, data=json.dumps(row.data)
+        )
+        row.http_status = resp.status_code
+        if resp.status_code in (200, 202, 204):
+            row.status = 'updated'
+        else:
+            row.status = 'error'
+            row.error = self.error_summary(resp)
+        return row
+
+    def bulk_post(self, nas, url, row):
+        headers = {'content-type': 'application/json'}
+        if nas.DEBUG:
+            sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
+                'post', url, json.dumps(row.data, indent=2)
+            ))
+        resp = session(nas.concurrency).post(
+            url, headers=headers, data=json.dumps(row.data)
+        )
+        row.http_status = resp.status_code
+        if resp.status_code == 201:
+            row.status = 'created'
+            try:
+                row.pk = self.get_resp_dict(resp).get('pk')
+            except json.decoder.JSONDecodeError:
+                pass
+        else:
+            row.status = 'error'
+            row.error = self.error_summary(resp)
+        return row
+
+    detail_set_size = 50  # How many pks to ask for in one set/ request
+
+    def detail(self, nas):
+        pk_file = getattr(nas, 'pk_file', None)
+        if isinstance(nas.pk, list) and len(nas.pk) == 1 and not pk_file:
+            nas.pk = nas.pk[0]
+        if isinstance(nas.pk, list) or pk_file:
+            return self.multi_detail(nas)
+        return self.by_natural_key(nas, super(ObjectDispatch, self).detail)
+
+    def update(self, nas):
+        # With --pk the natural key option is a new value for the key
+        renaming = nas.pk is not None and self.natural_key_value(nas)
+        if renaming and not nas.explain:
+            self.forget_pk(nas.pk)
+        if nas.skip_unchanged:
+            return self.by_natural_key(nas, self.update_changed)
+        return self.by_natural_key(nas, super(ObjectDispatch, self).update)
+
+    def update_changed(self, nas):
+        """
+        Fetch the object and PATCH only the fields that would change it, or
+        nothing at all if it already looks like that.
+        """
+        data = self.get_update_data(nas)
+        detail_url = "{0}{1}".format(REMOTE, self.detail_url(nas))
+        update_url = "{0}{1}".format(REMOTE, self.update_url(nas))
+        if nas.explain:
+            nas.plan.add('get', detail_url, params={'format': 'json'})
+            return self.explain(nas, 'patch', update_url, data)
+        resp = session().get(
+            detail_url, params={'format': 'json'},
+            headers={'content-type': 'application/json'}
+        )
+        if resp.status_code != 200:
+            return self.handle_resp(nas, data, resp)
+        current = self.get_resp_dict(resp)
+        changes = self.differing_fields(current, data)
+        if not changes:
+            if nas.p_json:
+                return 0, [json.dumps(
+                    {'pk': current.get('pk'), 'http_status': 200,
+                     'update': 'unchanged'}, indent=2
+                )]
+            return 0, ["update: unchanged (nothing was sent)"]
+        return self.action(nas, update_url, requests.patch, changes)
+
+    def delete(self, nas):
+        ret = self.by_natural_key(nas, super(ObjectDispatch, self).delete)
+        if not nas.explain:
+            self.forget_pk(nas.pk)
+        return ret
+
+    def create(self, nas):
+        if not nas.explain:
+            self.forget_key(self.natural_key_value(nas))
+        return super(ObjectDispatch, self).create(nas)
+
+    def natural_key_value(self, nas):
+        if self.natural_key is None:
+            return None
+        return getattr(nas, self.natural_key, None) or None
+
+    def forget_key(self, value):
+        # e.g. a new A record makes its fqdn ambiguous
+        if self.natural_key is not None and value:
+            natural_key_index().forget(self.dtype, value)
+
+    def forget_pk(self, pk):
+        if self.natural_key is not None and pk is not None:
+            natural_key_index().forget_pk(self.dtype, pk)
+
+    def by_natural_key(self, nas, action):
+        """
+        Run action (detail, update or delete) on the object named by the
+        natural key when --pk wasn't given. If a remembered pk doesn't work
+        out the server is asked again and, if it disagrees, action is retried
+        once with the pk it gave us.
+        """
+        value = self.natural_key_value(nas)
+        if nas.pk is not None or value is None:
+            if nas.pk is None:
+                return self.key_error(nas, (
+                    "Use --pk or --{0} to say which {1} to {2}".format(
+                        self.natural_key.replace('_', '-'), self.dtype,
+                        nas.action
+                    ) if self.natural_key else "--pk is required"
+                ))
+            return action(nas)
+        nas.pk, cached, error = self.resolve_pk(
+            value, plan=nas.plan if nas.explain else None
+        )
+        if error:
+            return self.key_error(nas, error)
+        ret_code, resp_list = action(nas)
+        if ret_code and cached:
+            pk, cached, error = self.resolve_pk(value, refresh=True)
+            if pk is not None and pk != nas.pk:
+                nas.pk = pk
+                ret_code, resp_list = action(nas)
+        return ret_code, resp_list
+
+    def key_error(self, nas, error):
+        if nas.p_json:
+            return 1, [json.dumps({'message': error}, indent=2)]
+        return 1, [error]
+
+    def resolve_pk(self, value, refresh=False, plan=None):
+        """
+        Find the pk of the object whose natural key is value. Returns
+        (pk, cached, error); cached is True if the pk came from the index
+        without asking the server. If a plan is given (--explain) the lookup
+        goes into it and a placeholder pk is returned.
+        """
+        index = natural_key_index()
+        if not refresh:
+            pk = index.get(self.dtype, value)
+            if pk is not None:
+                return pk, True, None
+        if plan is not None:
+            url, params = self.lookup_request(value)
+            plan.add('get', url, params=params)
+            return '{pk}', False, None
+        index.forget(self.dtype, value)
+        pk, error = self.lookup_pk(value)
+        if pk is not None:
+            index.remember(self.dtype, value, pk)
+        return pk, False, error
+
+    def lookup_request(self, value):
+        url = "{0}{1}".format(REMOTE, self.object_list_url.format(
+            API_MAJOR_VERSION, self.resource_name
+        ))
+        params = {'format': 'json', self.natural_key: value, 'limit': 2}
+        params.update(self.natural_key_filters)
+        return url, params
+
+    def lookup_pk(self, value):
+        """
+        Ask the server for the object whose natural key is exactly value.
+        Returns (pk, error).
+        """
+        url, params = self.lookup_request(value)
+        resp = session().get(
+            url, params=params, headers={'content-type': 'application/json'}
+        )
+        if resp.status_code != 200:
+            return None, self.error_summary(resp)
+        try:
+            resp_msg = self.get_resp_dict(resp)
+        except json.decoder.JSONDecodeError:
+            return None, "Couldn't understand the server's response"
+        objects = resp_msg.get('objects', [])
+        # Filters the server doesn't know about are ignored, so double check
+        objects = [
+            obj for obj in objects if obj.get(self.natural_key) == value and
+            all(str(obj.get(field)) == str(field_value)
+                for field, field_value in self.natural_key_filters.items())
+        ]
+        if not objects:
+            return None, "No {0} with {1} '{2}'".format(
+                self.dtype, self.natural_key, value
+            )
+        if len(objects) > 1 or resp_msg.get('meta', {}).get(
+                'total_count', 1) > 1:
+            return None, ("More than one {0} has {1} '{2}' (pks: {3}); use "
+                          "--pk".format(
+                              self.dtype, self.natural_key, value,
+                              ', '.join(str(obj['pk']) for obj in objects)
+                          ))
+        return objects[0]['pk'], None
+
+    def iter_detail_pks(self, nas):
+        for pk in nas.pk or []:
+            yield str(pk)
+        if nas.pk_file:
+            for line in nas.pk_file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+    def multi_detail(self, nas):
+        """
+        Detail many objects. pks are fetched in chunks with tastypie's
+        ``<resource>/set/1;2;3/`` endpoint; if the endpoint doesn't support
+        that every pk is fetched on its own. Results are written in input
+        order as soon as they are available.
+        """
+        pks = iter(self.iter_detail_pks(nas))
+        if nas.explain:
+            for chunk in chunked(pks, self.detail_set_size):
+                nas.plan.add('get', "{0}{1}".format(
+                    REMOTE, self.set_url(chunk)
+                ), params={'format': 'json'})
+            return 0, []
+        first = list(islice(pks, self.detail_set_size))
+        first_results = self.fetch_set(nas, first)
+        if first_results is None:
+            fetch, size = self.fetch_each, 1
+            first_results = fetch(nas, first)
+        else:
+            fetch, size = self.fetch_set, self.detail_set_size
+
+        def do_fetch(chunk):
+            results = fetch(nas, chunk)
+            if results is None:  # Only some chunks can't use set/
+                results = self.fetch_each(nas, chunk)
+            return results
+
+        stats = Throughput(unit='objects')
+        missing = 0
+        chunks = pmap(do_fetch, chunked(pks, size), nas.concurrency)
+        results = chain(
+            [first_results], (results for chunk, results in chunks)
+        )
+        for chunk_results in results:
+            for pk, status, obj in chunk_results:
+                if status == 200:
+                    stats.add('found')
+                else:
+                    stats.add('missing')
+                    missing += 1
+                self.emit_detail(nas, pk, status, obj)
+
+        if nas.p_json:
+            return (1 if missing else 0), []
+        return (1 if missing else 0), [str(stats)]
+
+    def emit_detail(self, nas, pk, status, obj):
+        if status == 200:
+            obj['http_status'] = status
+            if nas.p_json:
+                self.emit(nas, json.dumps(obj))
+            else:
+                self.emit(nas, '\n'.join(self.format_response(
+                    nas, obj, "http_status: 200 (Success)"
+                )) + '\n')
+        elif nas.p_json:
+            self.emit(nas, json.dumps({'pk': pk, 'http_status': status}))
+        else:
+            self.emit(nas, "pk {0}: http_status: {1} ({2})\n".format(
+                pk, status, 'not found' if status == 404 else 'error'
+            ))
+
+    def fetch_set(self, nas, pks):
+        """
+        Returns a list of (pk, http_status, object) tuples in the order of
+        pks or None if the server doesn't support set/ requests.
+        """
+        valid = [pk for pk in pks if pk.isdigit()]
+        if not valid:
+            return [(pk, 400, None) for pk in pks]
+        url = "{0}{1}".format(REMOTE, self.set_url(valid))
+        if nas.DEBUG:
+            sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
+                'get', url, {}
+            ))
+        resp = session(nas.concurrency).get(
+            url, params={'format': 'json'},
+            headers={'content-type': 'application/json'}
+        )
+        if resp.status_code != 200:
+            return None
+        try:
+            objects = self.get_resp_dict(resp).get('objects', [])
+        except json.decoder.JSONDecodeError:
+            return None
+        by_pk = dict((str(obj.get('pk', obj.get('id'))), obj)
+                     for obj in objects)
+        return [
+            (pk, 200, by_pk[pk]) if pk in by_pk else
+            (pk, 404 if pk.isdigit() else 400, None)
+            for pk in pks
+        ]
+
+    def fetch_each(self, nas, pks):
+        results = []
+        for pk in pks:
+            if not pk.isdigit():
+                results.append((pk, 400, None))
+                continue
+            url = "{0}{1}".format(
+                REMOTE, self.detail_url(argparse.Namespace(pk=pk))
+            )
+            resp = session(nas.concurrency).get(
+                url, params={'format': 'json'},
+                headers={'content-type': 'application/json'}
+            )
+            if resp.status_code == 200:
+                results.append((pk, 200, self.get_resp_dict(resp)))
+            else:
+                results.append((pk, resp.status_code, None))
+        return results
+
+    def set_url(self, pks):
+        return self.object_url.format(
+            API_MAJOR_VERSION, self.resource_name,
+            'set/{0}'.format(';'.join(str(pk) for pk in pks))
+        )
 
     # TODO, dedup this code
     def delete_url(self, nas):
@@ -199,6 +1107,32 @@ class ObjectDispatch(Dispatch):  # Handy base class
         )
 
 
+def same_value(current, wanted):
+    """
+    Compare a value the server sent with one we would send. The server
+    answers with ints where we send strings, nests foreign keys and uses
+    null for blank.
+    """
+    if current in (None, '') or wanted in (None, ''):
+        return current in (None, '') and wanted in (None, '')
+    if isinstance(current, dict):
+        current = current.get('pk', current.get('id'))
+    elif (isinstance(current, basestring) and current.endswith('/') and
+            unicode(wanted).isdigit()):
+        current = current.rstrip('/').rsplit('/', 1)[-1]  # A resource_uri
+    lists = (list, tuple)
+    if isinstance(current, lists) or isinstance(wanted, lists):
+        if not (isinstance(current, lists) and isinstance(wanted, lists)):
+            return False
+        return sorted(map(unicode, current)) == sorted(map(unicode, wanted))
+    if unicode(current) == unicode(wanted):
+        return True
+    try:
+        return float(current) == float(wanted)
+    except (TypeError, ValueError):
+        return False
+
+
 def dispatch(nas):
     for dispatch in registrar.dispatches:
         if dispatch.dtype.lower() == nas.dtype.lower():
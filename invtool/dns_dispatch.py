@@ -20,15 +20,48 @@ from invtool.lib.parser import (
 )
 
 
+# (option, nas attribute) of the natural key that can be used instead of --pk
+FQDN_KEY = ('fqdn', 'fqdn')
+
+
 class DNSDispatch(ObjectDispatch):
     object_url = "/en-US/mozdns/api/v{0}_dns/{1}/{2}/"
     object_list_url = "/en-US/mozdns/api/v{0}_dns/{1}/"
+    natural_key = 'fqdn'
+    update_key_fields = ('pk', 'fqdn')
+    upsert_key = ('fqdn',)
+
+    def differing_fields(self, existing, data):
+        # We send view changes ('private', 'no-public'); the server sends
+        # back the views a record is in. A view we don't mention is left
+        # alone.
+        data = dict(data)
+        views = data.pop('views', None)
+        changes = super(DNSDispatch, self).differing_fields(existing, data)
+        if views:
+            current = set(
+                view.get('name') if isinstance(view, dict) else view
+                for view in existing.get('views') or []
+            )
+            wanted = set(current)
+            for view in views:
+                if view.startswith('no-'):
+                    wanted.discard(view[3:])
+                else:
+                    wanted.add(view)
+            if wanted != current:
+                changes['views'] = views
+                if data.get('comment'):
+                    changes['comment'] = data['comment']
+        return changes
 
 
 class DispatchA(DNSDispatch):
     resource_name = 'addressrecord'
     dtype = 'A'
     dgroup = 'dns'
+    upsert_key = ('fqdn', 'ip_type', 'ip_str')
+    natural_key_filters = {'ip_type': '4'}
 
     create_args = [
         fqdn_argument('fqdn', dtype),  # ~> (labmda, lambda)
@@ -40,14 +73,14 @@ class DispatchA(DNSDispatch):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
     def determine_ip_type(self, ip_str):
         if ip_str.find(':') > -1:
@@ -65,11 +98,18 @@ class DispatchA(DNSDispatch):
         data = super(DispatchA, self).get_update_data(nas)
         return data
 
+    def mirror_dtype(self, obj):
+        # A and AAAA records are both addressrecords
+        return 'AAAA' if str(obj.get('ip_type')) == '6' else 'A'
+
 
 class DispatchPTR(DNSDispatch):
     resource_name = 'ptr'
     dtype = 'PTR'
     dgroup = 'dns'
+    upsert_key = ('ip_str',)
+    natural_key = None  # PTRs don't have an fqdn
+    update_key_fields = ('pk',)
 
     create_args = [
         ttl_argument('ttl'),
@@ -111,6 +151,7 @@ class DispatchPTR(DNSDispatch):
 class DispatchAAAA(DispatchA):
     dtype = 'AAAA'
     dgroup = 'dns'
+    natural_key_filters = {'ip_type': '6'}
 
     create_args = [
         fqdn_argument('fqdn', dtype),  # ~> (labmda, lambda)
@@ -122,14 +163,14 @@ class DispatchAAAA(DispatchA):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
 
 class DispatchCNAME(DNSDispatch):
@@ -147,20 +188,21 @@ class DispatchCNAME(DNSDispatch):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
 
 class DispatchSRV(DNSDispatch):
     resource_name = 'srv'
     dtype = 'SRV'
     dgroup = 'dns'
+    upsert_key = ('fqdn', 'target', 'port')
 
     create_args = [
         fqdn_argument('fqdn', dtype),  # ~> (labmda, lambda)
@@ -175,20 +217,21 @@ class DispatchSRV(DNSDispatch):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
 
 class DispatchMX(DNSDispatch):
     resource_name = 'mx'
     dtype = 'MX'
     dgroup = 'dns'
+    upsert_key = ('fqdn', 'server')
 
     create_args = [
         fqdn_argument('fqdn', dtype),  # ~> (labmda, lambda)
@@ -201,20 +244,21 @@ class DispatchMX(DNSDispatch):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
 
 class DispatchTXT(DNSDispatch):
     resource_name = 'txt'
     dtype = 'TXT'
     dgroup = 'dns'
+    upsert_key = ('fqdn', 'txt_data')
 
     create_args = [
         fqdn_argument('fqdn', dtype),  # ~> (labmda, lambda)
@@ -226,14 +270,14 @@ class DispatchTXT(DNSDispatch):
     ]
 
     update_args = create_args + [
-        update_pk_argument('pk', dtype)
+        update_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
     delete_args = [
-        delete_pk_argument('pk', dtype)
+        delete_pk_argument('pk', dtype, FQDN_KEY)
     ]
 
-    detail_args = [detail_pk_argument('pk', dtype)]
+    detail_args = [detail_pk_argument('pk', dtype, FQDN_KEY)]
 
 
 registrar.register(DispatchA())
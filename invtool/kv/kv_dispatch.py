@@ -2,6 +2,7 @@ try:
     import simplejson as json
 except ImportError:
     import json
+import argparse
 import requests
 
 from invtool.dispatch import Dispatch
@@ -9,7 +10,7 @@ from invtool.lib.config import REMOTE
 
 from invtool.lib.parser import (
     build_create_parser, build_update_parser, build_delete_parser,
-    build_detail_parser
+    build_detail_parser, build_bulk_delete_parser
 )
 
 
@@ -24,7 +25,7 @@ def build_kvlist_parser(dispatch, action_parser):
 class DispatchKV(Dispatch):
     def route(self, nas):
         if self.dtype.lower() == nas.dtype.lower():
-            return getattr(self, nas.action.lower())(nas)
+            return getattr(self, nas.action.lower().replace('-', '_'))(nas)
 
     def build_parser(self, base_parser):
         record_base_parser = base_parser.add_parser(
@@ -50,6 +51,13 @@ class DispatchKV(Dispatch):
             self, action_parser, help="Detail a {0} KV pair".format(self.dtype)
         )
         build_kvlist_parser(self, action_parser)
+        build_bulk_delete_parser(
+            self, action_parser, help="Delete many KV pairs. Reads "
+            "'<dtype> <kv-pk>' (or just '<kv-pk>') lines from stdin"
+        )
+
+    def pk_nas(self, pk):
+        return argparse.Namespace(kv_pk=pk)
 
     def action(self, nas, url, method, data, **kwargs):
         kwargs.update(**{'form_encode': False})
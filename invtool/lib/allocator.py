@@ -0,0 +1,229 @@
+"""
+Hand out free IP addresses from the ranges Inventory reports as vacant.
+
+``search --range --display-integers`` and the ``gather_vlan_pools`` bulk
+action answer with ``free_ranges``: ``[first, last]`` pairs of integers.
+IPAllocator keeps them as sorted, disjoint intervals, so finding, taking
+and giving back an address is a bisect away, for IPv4 and IPv6 alike.
+"""
+import bisect
+import socket
+import struct
+
+IP_MAX = {'4': (1 << 32) - 1, '6': (1 << 128) - 1}
+
+# Fully used intervals are skipped, not deleted, until this many pile up
+COMPACT_AFTER = 64
+
+
+class PoolExhausted(StopIteration):
+    pass
+
+
+def ip_type_of(ip_str):
+    return '6' if ':' in ip_str else '4'
+
+
+def ip_to_int(ip_str):
+    try:
+        if ':' in ip_str:
+            high, low = struct.unpack(
+                '!QQ', socket.inet_pton(socket.AF_INET6, ip_str)
+            )
+            return high << 64 | low
+        return struct.unpack('!I', socket.inet_aton(ip_str))[0]
+    except (socket.error, TypeError):
+        raise ValueError("'{0}' isn't an ip address".format(ip_str))
+
+
+def int_to_ip(n, ip_type='4'):
+    if not 0 <= n <= IP_MAX[ip_type]:
+        raise ValueError("{0} isn't an IPv{1} address".format(n, ip_type))
+    if ip_type == '4':
+        return socket.inet_ntoa(struct.pack('!I', n))
+    return socket.inet_ntop(
+        socket.AF_INET6, struct.pack('!QQ', n >> 64, n & ((1 << 64) - 1))
+    )
+
+
+class IPAllocator(object):
+    """
+    A pool of free addresses, handed out lowest first. free_ranges are
+    inclusive [first, last] pairs of integers or address strings, as
+    Inventory sends them; overlapping and adjacent pairs are merged.
+
+    Only one thread should use an allocator.
+    """
+    def __init__(self, free_ranges=(), ip_type='4', name=None):
+        self.ip_type = ip_type
+        self.name = name
+        self.free = 0  # Can be larger than a C long, so no __len__
+        self._firsts = []
+        self._lasts = []
+        self._head = 0  # Intervals before this one are used up
+        for first, last in free_ranges:
+            self.release_range(first, last)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def next(self):
+        """
+        Take the lowest free address.
+        """
+        if self._head == len(self._firsts):
+            raise self.exhausted()
+        n = self._firsts[self._head]
+        self._remove(self._head, n, n)
+        return int_to_ip(n, self.ip_type)
+
+    def __contains__(self, ip):
+        return self._find(self._int(ip)) is not None
+
+    def __repr__(self):
+        return '<IPAllocator {0} free in {1} ranges>'.format(
+            self.free, len(self._firsts) - self._head
+        )
+
+    def exhausted(self, count=None):
+        where = " in {0}".format(self.name) if self.name else ""
+        if count is None:
+            return PoolExhausted("No more free ip addresses{0}".format(where))
+        return PoolExhausted(
+            "Wanted {0} free ip addresses{1} but only {2} are left".format(
+                count, where, self.free
+            )
+        )
+
+    def ranges(self):
+        """
+        The free (first, last) addresses, lowest first.
+        """
+        return [
+            (int_to_ip(first, self.ip_type), int_to_ip(last, self.ip_type))
+            for first, last in zip(self._firsts[self._head:],
+                                   self._lasts[self._head:])
+        ]
+
+    def allocate(self, count):
+        """
+        Take the count lowest free addresses, wherever they are. Nothing is
+        taken if there aren't enough.
+        """
+        if count > self.free:
+            raise self.exhausted(count)
+        ips = []
+        while count:
+            first, last = self._firsts[self._head], self._lasts[self._head]
+            last = min(last, first + count - 1)
+            ips += self._ips(first, last)
+            self._remove(self._head, first, last)
+            count -= last - first + 1
+        return ips
+
+    def allocate_block(self, count):
+        """
+        Take count consecutive addresses from the lowest interval that has
+        room for them.
+        """
+        for i in xrange(self._head, len(self._firsts)):
+            first = self._firsts[i]
+            if self._lasts[i] - first + 1 >= count:
+                self._remove(i, first, first + count - 1)
+                return self._ips(first, first + count - 1)
+        raise PoolExhausted(
+            "No block of {0} consecutive free ip addresses{1}".format(
+                count, " in {0}".format(self.name) if self.name else ""
+            )
+        )
+
+    def take(self, ip):
+        """
+        Take a particular address. Returns False if it wasn't free.
+        """
+        n = self._int(ip)
+        i = self._find(n)
+        if i is None:
+            return False
+        self._remove(i, n, n)
+        return True
+
+    def release(self, ip):
+        """
+        Give an address back.
+        """
+        n = self._int(ip)
+        self.release_range(n, n)
+
+    def release_range(self, first, last):
+        first, last = self._int(first), self._int(last)
+        if first > last:
+            return
+        firsts, lasts, head = self._firsts, self._lasts, self._head
+        # Intervals that overlap or touch [first, last] are merged into it
+        lo = bisect.bisect_left(lasts, first - 1, head)
+        hi = bisect.bisect_right(firsts, last + 1, head)
+        if lo < hi:
+            first = min(first, firsts[lo])
+            last = max(last, lasts[hi - 1])
+            self.free -= sum(
+                l - f + 1 for f, l in zip(firsts[lo:hi], lasts[lo:hi])
+            )
+        firsts[lo:hi] = [first]
+        lasts[lo:hi] = [last]
+        self.free += last - first + 1
+
+    def _int(self, ip):
+        if isinstance(ip, basestring):
+            return ip_to_int(ip)
+        return int(ip)
+
+    def _ips(self, first, last):
+        ips = []
+        while first <= last:  # xrange() can't count past a C long
+            ips.append(int_to_ip(first, self.ip_type))
+            first += 1
+        return ips
+
+    def _find(self, n):
+        """
+        Index of the interval n is in, or None.
+        """
+        i = bisect.bisect_right(self._firsts, n, self._head) - 1
+        if i >= self._head and self._lasts[i] >= n:
+            return i
+        return None
+
+    def _remove(self, i, first, last):
+        """
+        Take [first, last], which is inside interval i, out of the pool.
+        """
+        f, l = self._firsts[i], self._lasts[i]
+        self.free -= last - first + 1
+        if f == first and l == last and i == self._head:
+            self._head += 1
+            if (self._head >= COMPACT_AFTER and
+                    self._head * 2 >= len(self._firsts)):
+                del self._firsts[:self._head]
+                del self._lasts[:self._head]
+                self._head = 0
+            return
+        pieces = []
+        if f < first:
+            pieces.append((f, first - 1))
+        if last < l:
+            pieces.append((last + 1, l))
+        self._firsts[i:i + 1] = [p[0] for p in pieces]
+        self._lasts[i:i + 1] = [p[1] for p in pieces]
+
+
+def allocator_for_range(ip_range, free_ranges):
+    """
+    An allocator for the free_ranges of ip_range ('<start>,<end>').
+    """
+    return IPAllocator(
+        free_ranges, ip_type_of(ip_range.split(',')[0]), name=ip_range
+    )
@@ -1,11 +1,23 @@
 #!/usr/bin/env python
-import simplejson as json
-import shlex
-import io
-import requests
+import time
+import urllib
 
-from invtool.main import do_dispatch
-from invtool.lib.config import REMOTE, auth
+from invtool.lib.bulk import Throughput
+from invtool.lib.client import (
+    InventoryClient, InventoryError, inventory_client
+)
+from invtool.lib.concurrency import DEFAULT_CONCURRENCY, chunked, pmap
+from invtool.lib.pools import pool_cache, range_pool_key, vlan_pool_key
+from invtool.lib.records import Record
+
+# Hostname exports are split so that no single search has more than this
+# many hostnames or a query string longer than this many (url encoded)
+# bytes. Inventory evaluates one regex per hostname.
+EXPORT_CHUNK_HOSTNAMES = 100
+EXPORT_MAX_QUERY_LENGTH = 4000
+
+# Systems per request when an import is split up (see ba_import_chunked)
+IMPORT_CHUNK_SYSTEMS = 50
 
 
 class BAError(Exception):
@@ -19,24 +31,12 @@ def ba_gather_vlan_pools(site, vlan_name, vlan_number, ip_type='4'):
     This function should phone home to inventory and pull down a list of ip
     ranges.
     """
-    tmp_url = "/en-US/bulk_action/gather_vlan_pools/"
-    url = "{0}{1}".format(REMOTE, tmp_url)
-    headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
-    data = {
-        'vlan_name': vlan_name,
-        'vlan_number': vlan_number,
-        'site_name': site,
-        'ip_type': ip_type
-    }
-
-    resp = requests.get(url, params=data, headers=headers, auth=auth())
-    json_resp = json.loads(resp.content)
-    if 'errors' in json_resp:
-        return None, json_resp['errors']
-    assert 'free_ranges' in json_resp, (
-        "Something is broken. 'free_ranges' was not returen by Inventory"
-    )
-    return json_resp['free_ranges'], None
+    try:
+        return inventory_client().vlan_pools(
+            site, vlan_name, vlan_number, ip_type
+        ), None
+    except InventoryError as e:
+        return None, e.errors
 
 
 def ba_gather_range_pool(ip_range):
@@ -47,21 +47,49 @@ def ba_gather_range_pool(ip_range):
 
 
 def ba_gather_ip_pool(ip_range):
-    command = '--json search --display-integers --range {0}'.format(ip_range)
-    nas, (resp_code, resp_list) = do_dispatch(shlex.split(command))
-    raw_json = '\n'.join(resp_list)
-    if 'error_messages' in raw_json:
-        return None, raw_json
-    return json.loads(raw_json), None
+    start, end = [ip.strip() for ip in ip_range.split(',')]
+    try:
+        return inventory_client().range_usage(start, end, integers=True), None
+    except InventoryError as e:
+        return None, str(e)
+
+
+def ba_gather_pools(pools, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Gather the free ranges of several pools at once. A pool is either the
+    arguments of ba_gather_vlan_pools as a dict (site, vlan_name,
+    vlan_number, ip_type) or {'ip_range': '<ip-start>,<ip-end>'}.
+
+    Returns a list of ``(free_ranges, errors)``, one per pool and in the
+    same order. Answers are cached for a few minutes (see
+    invtool.lib.pools), so most runs don't ask Inventory at all.
+    """
+    cache = pool_cache()
+
+    def gather(pool):
+        if 'ip_range' in pool:
+            key = range_pool_key(pool['ip_range'])
+        else:
+            key = vlan_pool_key(**pool)
+        free_ranges = cache.get(key)
+        if free_ranges is not None:
+            return free_ranges, None
+        if 'ip_range' in pool:
+            free_ranges, errors = ba_gather_range_pool(pool['ip_range'])
+        else:
+            free_ranges, errors = ba_gather_vlan_pools(**pool)
+        if not errors:
+            cache.put(key, free_ranges)
+        return free_ranges, errors
+
+    return [result for pool, result in pmap(gather, pools, concurrency)]
 
 
 def ba_export_systems_raw(search):
-    command = 'ba_export --query {0}'.format(search)
-    nas, (resp_code, resp_list) = do_dispatch(shlex.split(command))
-    raw_json = '\n'.join(resp_list)
-    if 'errors' in raw_json:
-        return None, raw_json
-    return json.loads(raw_json), None
+    try:
+        return inventory_client().ba_export(search), None
+    except InventoryError as e:
+        return None, str(e)
 
 
 def ba_export_systems_regex(search):
@@ -73,19 +101,88 @@ def ba_export_systems_regex(search):
     return ba_export_systems_raw("/{search}".format(search=search))
 
 
+def hostname_term(hostname):
+    return "/^{h}$".format(h=hostname)
+
+
+def hostname_chunks(hostnames, max_count=EXPORT_CHUNK_HOSTNAMES,
+                    max_length=EXPORT_MAX_QUERY_LENGTH):
+    """
+    Split hostnames into lists whose OR-ed search stays under max_count
+    terms and max_length url encoded bytes. A hostname that doesn't fit on
+    its own still gets a chunk to itself.
+    """
+    separator = len(urllib.quote_plus(' OR '))
+    chunk, length = [], 0
+    for hostname in hostnames:
+        term = len(urllib.quote_plus(hostname_term(hostname)))
+        if chunk and (len(chunk) >= max_count or
+                      length + separator + term > max_length):
+            yield chunk
+            chunk, length = [], 0
+        length += term + (separator if chunk else 0)
+        chunk.append(hostname)
+    if chunk:
+        yield chunk
+
+
+def ba_export_systems_hostnames(hostnames, concurrency=DEFAULT_CONCURRENCY,
+                                max_count=EXPORT_CHUNK_HOSTNAMES,
+                                max_length=EXPORT_MAX_QUERY_LENGTH):
+    """
+    Export a list of systems by hostname. The list is split into chunks (see
+    hostname_chunks) which are exported concurrently and merged.
+
+    Returns ``(blob, unmatched, errors)``. ``unmatched`` lists the hostnames
+    no system was found for. Search has no exact match, so each hostname is
+    an anchored regex and systems Inventory returns that weren't asked for
+    (a '.' in a regex matches any character) are dropped.
+
+    :param hostnames: A list of full hostnames
+    :type hostnames: list
+
+    """
+    wanted = {}
+    for hostname in hostnames:
+        wanted.setdefault(hostname.lower(), hostname)
+
+    def export(chunk):
+        search = '"{search}"'.format(
+            search=' OR '.join(map(hostname_term, chunk))
+        )
+        return ba_export_systems_raw(search)
+
+    chunks = hostname_chunks(wanted.values(), max_count, max_length)
+    blob, errors = {'systems': {}}, []
+    for chunk, (chunk_blob, error) in pmap(export, chunks, concurrency):
+        if error:
+            errors.append(error)
+            continue
+        for key, value in chunk_blob.iteritems():
+            if key != 'systems':
+                blob.setdefault(key, value)
+        for hostname, system in chunk_blob.get('systems', {}).iteritems():
+            if hostname.lower() in wanted:
+                blob['systems'][hostname] = system
+    if errors:
+        return None, None, '\n'.join(errors)
+    found = set(h.lower() for h in blob['systems'])
+    unmatched = [h for h in hostnames if h.lower() not in found]
+    return blob, unmatched, None
+
+
 def ba_export_systems_hostname_list(hostnames):
     """
     Export a list of systems by hostname.
 
-    :param hostnames: A list of full hostnames that will be looked up in a
-        single api call.
+    :param hostnames: A list of full hostnames. Long lists are exported in
+        concurrent chunks; use ba_export_systems_hostnames to find out which
+        hostnames matched nothing.
     :type hostnames: list
 
     """
-    search = '"{search}"'.format(
-        search=' OR '.join(map(lambda h: "/^{h}$".format(h=h), hostnames))
-    )
-    return ba_export_systems_raw(search)
+    blob, unmatched, errors = ba_export_systems_hostnames(hostnames)
+    return blob, errors
 
 
 def ba_import(dict_blob, commit=False):
@@ -103,18 +200,219 @@ def ba_import(dict_blob, commit=False):
     :type dict_blob: dict
 
     """
+    try:
+        blob = inventory_client().ba_import(dict_blob, commit=commit)
+    except InventoryError as e:
+        return None, str(e)
     if commit:
-        dict_blob['commit'] = True
-    json_blob = json.dumps(dict_blob)
-    command = ['ba_import']
-    if commit:
-        command.append('--commit')
-    with io.BytesIO(json_blob) as json_blob_fd:
-        nas, (resp_code, resp_list) = do_dispatch(command, IN=json_blob_fd)
-        raw_json = '\n'.join(resp_list)
-        if 'errors' in raw_json:
-            return None, raw_json
-        return json.loads(raw_json), None
+        # Addresses the cached pools have as free may be used now
+        pool_cache().invalidate()
+    return blob, None
+
+
+def split_blob(dict_blob, chunk_size=IMPORT_CHUNK_SYSTEMS):
+    """
+    Split a blob into blobs of at most chunk_size systems. Everything in it
+    besides 'systems' is copied into each one, except 'commit': whether a
+    chunk is saved is up to the caller.
+    """
+    rest = dict(
+        (k, v) for k, v in dict_blob.iteritems()
+        if k not in ('systems', 'commit')
+    )
+    for names in chunked(sorted(dict_blob.get('systems', {})), chunk_size):
+        chunk = dict(rest)
+        chunk['systems'] = dict(
+            (name, dict_blob['systems'][name]) for name in names
+        )
+        yield chunk
+
+
+def ba_import_chunked(dict_blob, commit=False, chunk_size=IMPORT_CHUNK_SYSTEMS,
+                      concurrency=DEFAULT_CONCURRENCY, progress=None,
+                      client=None):
+    """
+    Import a blob in chunks of chunk_size systems, concurrency requests at
+    a time:
+
+    1. Every chunk is validated (nothing is saved).
+    2. The systems of chunks that failed are validated one by one to find
+       the ones Inventory rejects.
+    3. If nothing failed and commit is True, every chunk is committed.
+
+    Returns ``(blob, errors, report)``. blob merges the processed chunks
+    (None if anything failed). errors lists ``{'systems': [...], 'errors':
+    ...}``, one per rejected system or per chunk that failed to commit.
+    report has the ``stats`` (a Throughput) and the ``chunks``: the phase,
+    systems, seconds and error of every request. progress, if given, is
+    called with each of those as it finishes.
+
+    Unlike ba_import the chunks are saved separately: if one fails to
+    commit, the ones committed before it stay saved.
+    """
+    client = client or InventoryClient(concurrency=concurrency)
+    stats = Throughput(unit='systems')
+    timings = []
+
+    def send(phase, save):
+        def request(chunk):
+            start = time.time()
+            try:
+                blob, error = client.ba_import(chunk, commit=save), None
+            except InventoryError as e:
+                blob, error = None, e.errors
+            timing = {
+                'phase': phase, 'systems': sorted(chunk['systems']),
+                'seconds': round(time.time() - start, 3), 'error': error
+            }
+            timings.append(timing)
+            if progress:
+                progress(timing)
+            return blob, error
+        return request
+
+    def run(phase, chunks, save=False):
+        results = pmap(send(phase, save), chunks, concurrency, ordered=False)
+        return [(chunk, blob, error) for chunk, (blob, error) in results]
+
+    chunks = list(split_blob(dict_blob, chunk_size))
+    errors = []
+    checked = run('validate', chunks)
+    failed = [chunk for chunk, blob, error in checked if error]
+    if failed:
+        singles = [system for chunk in failed
+                   for system in split_blob(chunk, 1)]
+        for chunk, blob, error in run('isolate', singles):
+            if error:
+                errors.append({
+                    'systems': sorted(chunk['systems']), 'errors': error
+                })
+        if not errors:  # Only failed together
+            errors = [{'systems': sorted(chunk['systems']), 'errors': error}
+                      for chunk, blob, error in checked if error]
+    elif commit:
+        checked = run('commit', chunks, save=True)
+        errors = [{'systems': sorted(chunk['systems']), 'errors': error}
+                  for chunk, blob, error in checked if error]
+        if len(errors) < len(chunks):
+            # Addresses the cached pools have as free may be used now
+            pool_cache().invalidate()
+    rejected = sum(len(error['systems']) for error in errors)
+    if rejected:
+        stats.add('error', rejected)
+    if len(dict_blob.get('systems', {})) > rejected:
+        stats.add('committed' if commit and not failed else 'valid',
+                  len(dict_blob['systems']) - rejected)
+    report = {'stats': stats, 'chunks': timings}
+    if errors:
+        return None, errors, report
+    merged = {'systems': {}}
+    for chunk, blob, error in checked:
+        for key, value in blob.iteritems():
+            if key != 'systems':
+                merged.setdefault(key, value)
+        merged['systems'].update(blob.get('systems', {}))
+    return merged, [], report
+
+
+def is_collection(value):
+    """
+    Sub-objects keyed by name, like a system's staticreg_set or keyvalue_set.
+    """
+    return (isinstance(value, dict) and bool(value) and
+            all(isinstance(v, dict) for v in value.itervalues()))
+
+
+def diff_object(old, new, path, changed):
+    """
+    The parts of new that differ from old, or None if nothing does. The
+    object's own fields are always kept (they carry its pk); sub-objects
+    are kept only if they, or something under them, changed. The path of
+    every changed field is appended to changed. old may be a Record (see
+    invtool.lib.records.snapshot_export).
+    """
+    if isinstance(old, Record):
+        old = old.as_dict()
+    if old == new:
+        return None
+    if not isinstance(old, dict):
+        changed.append('.'.join(path) + ' (new)' if path else '(new)')
+        return new
+    result = {}
+    for key, value in new.iteritems():
+        old_value = old.get(key)
+        if is_collection(value):
+            if not isinstance(old_value, dict):
+                old_value = {}
+            parts = {}
+            for name, obj in value.iteritems():
+                part = diff_object(
+                    old_value.get(name), obj, path + [key, name], changed
+                )
+                if part is not None:
+                    parts[name] = part
+            if parts:
+                result[key] = parts
+        elif key == 'cname' and isinstance(value, list):
+            # CNAMEs are a list; match them up by pk
+            old_cnames = dict(
+                (c.get('pk'), c) for c in old_value or [] if c.get('pk')
+            )
+            parts = []
+            for cname in value:
+                part = diff_object(
+                    old_cnames.get(cname.get('pk')), cname, path + [key],
+                    changed
+                )
+                if part is not None:
+                    parts.append(part)
+            if parts:
+                result[key] = parts
+        else:
+            result[key] = value
+            if value != old_value:
+                changed.append('.'.join(path + [key]))
+    return result
+
+
+def ba_diff(original, modified):
+    """
+    The smallest blob that makes Inventory's copy of original look like
+    modified, which was made by editing an export of original. Returns
+    ``(blob, changes)``; blob only has the systems that changed and of those
+    only the sub-objects (staticreg_set, cname, keyvalue_set, ...) that
+    changed. changes maps every system sent to the paths of what changed in
+    it.
+
+    Systems and sub-objects removed from modified aren't in the diff:
+    ba_import never deletes anything either.
+    """
+    old_systems = original.get('systems', {})
+    blob = dict((k, v) for k, v in modified.iteritems() if k != 'systems')
+    blob['systems'] = {}
+    changes = {}
+    for name, system in modified.get('systems', {}).iteritems():
+        changed = []
+        part = diff_object(old_systems.get(name), system, [], changed)
+        if part is not None:
+            blob['systems'][name] = part
+            changes[name] = changed
+    return blob, changes
+
+
+def change_summary(changes, total):
+    """
+    Lines describing the changes of ba_diff, one per system.
+    """
+    lines = ["{0} of {1} systems changed".format(len(changes), total)]
+    for name in sorted(changes):
+        if changes[name] == ['(new)']:
+            lines.append("+ {0}".format(name))
+            continue
+        lines.append("~ {0}: {1}".format(
+            name, ', '.join(changes[name]) or 'no field changes'
+        ))
+    return lines
 
 
 def removes_pk_attrs(blobs):
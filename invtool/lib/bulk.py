@@ -0,0 +1,263 @@
+import argparse
+import csv
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+class RowError(Exception):
+    pass
+
+
+class RowParser(argparse.ArgumentParser):
+    """
+    An ArgumentParser that raises RowError instead of printing usage and
+    exiting. One bad row shouldn't kill a bulk run.
+    """
+    def error(self, message):
+        raise RowError(message)
+
+
+class BulkRow(object):
+    """
+    One line of bulk input and what happened to it.
+    """
+    def __init__(self, line, fields=None, error=None):
+        self.line = line
+        self.fields = fields or {}
+        self.error = error
+        self.data = None
+        self.status = 'error' if error else None
+        self.http_status = None
+        self.pk = None
+        self.dtype = None
+
+    def as_dict(self):
+        ret = {'line': self.line, 'status': self.status}
+        if self.dtype is not None:
+            ret['dtype'] = self.dtype
+        if self.pk is not None:
+            ret['pk'] = self.pk
+        if self.http_status is not None:
+            ret['http_status'] = self.http_status
+        if self.error:
+            ret['errors'] = self.error
+        return ret
+
+    def __str__(self):
+        msg = "line {0}: {1}".format(self.line, self.status)
+        if self.dtype is not None:
+            msg = "line {0}: {1} {2}".format(
+                self.line, self.dtype, self.status
+            )
+        if self.pk is not None:
+            msg += " (pk: {0})".format(self.pk)
+        if self.error:
+            msg += ": {0}".format(self.error)
+        return msg
+
+
+def build_row_parser(args, required=True):
+    """
+    Build a parser out of a dispatch's ``*_args`` so bulk rows are validated
+    by exactly the same code as the single object commands.
+    """
+    parser = RowParser(add_help=False)
+    for add_arg, extract_arg, test_method in args:
+        if required:
+            add_arg(parser)
+        else:
+            add_arg(parser, required=False)
+    return parser
+
+
+TRUE_STRINGS = ('true', 'yes', 'y', '1')
+
+
+def row_to_argv(fields, flags=()):
+    """
+    Turn a row into a list of command line arguments. Keys are option names
+    without the leading '--' (e.g. 'fqdn', 'ip', 'no-public'). True means
+    "pass the flag", False/None/'' mean "leave it out". For the options in
+    flags (ones that don't take a value) strings like 'true' count as True,
+    which is all a CSV cell can say.
+    """
+    argv = []
+    for name, value in sorted(fields.items()):
+        name = name.strip().lstrip('-')
+        if name in flags and isinstance(value, basestring):
+            value = value.strip().lower() in TRUE_STRINGS
+        if value is None or value is False or value == '':
+            continue
+        argv.append('--{0}'.format(name))
+        if value is not True:
+            argv.append(unicode(value).encode('utf-8'))
+    return argv
+
+
+def flag_options(parser):
+    """
+    The names (without '--') of parser's options that don't take a value.
+    """
+    return set(
+        option.lstrip('-') for action in parser._actions
+        if action.nargs == 0 for option in action.option_strings
+    )
+
+
+def parse_row(parser, row):
+    """
+    Run a row through parser. On success the parsed namespace is returned,
+    otherwise row.error is set and None is returned.
+    """
+    if row.error:
+        return None
+    try:
+        return parser.parse_args(
+            row_to_argv(row.fields, flag_options(parser))
+        )
+    except RowError, e:
+        row.status = 'error'
+        row.error = str(e)
+        return None
+
+
+def read_rows(fd):
+    """
+    Yield a BulkRow for every record in fd. fd may contain NDJSON (one JSON
+    object per line) or CSV with a header line; the format is sniffed from
+    the first non-blank line.
+    """
+    first = ''
+    line_no = 0
+    for first in fd:
+        line_no += 1
+        if first.strip():
+            break
+    else:
+        return
+
+    if first.lstrip().startswith('{'):
+        for row in _read_ndjson(first, line_no, fd):
+            yield row
+    else:
+        for row in _read_csv(first, line_no, fd):
+            yield row
+
+
+def _read_ndjson(first, line_no, fd):
+    def decode(line, line_no):
+        try:
+            fields = json.loads(line)
+        except ValueError, e:
+            return BulkRow(line_no, error="invalid JSON: {0}".format(e))
+        if not isinstance(fields, dict):
+            return BulkRow(line_no, error="expected a JSON object")
+        return BulkRow(line_no, fields=fields)
+
+    yield decode(first, line_no)
+    for line in fd:
+        line_no += 1
+        if line.strip():
+            yield decode(line, line_no)
+
+
+def _read_csv(header, line_no, fd):
+    fieldnames = [h.strip() for h in next(csv.reader([header]))]
+    for values in csv.reader(fd):
+        line_no += 1
+        if not values:
+            continue
+        if len(values) != len(fieldnames):
+            yield BulkRow(line_no, error="expected {0} columns, got {1}"
+                          .format(len(fieldnames), len(values)))
+            continue
+        yield BulkRow(line_no, fields=dict(
+            (name, value.strip()) for name, value in zip(fieldnames, values)
+        ))
+
+
+def merge_rows(rows, key_fields):
+    """
+    Coalesce rows that address the same object. Rows are keyed by the first
+    field in key_fields they have a value for. Blank values mean "leave this
+    field alone". Returns (merged, errors): merged is a list of BulkRows in
+    the order their objects were first seen, with ``line`` listing every
+    line that contributed; errors are rows that couldn't be merged.
+    """
+    merged = {}
+    order = []
+    errors = []
+    for row in rows:
+        if row.error:
+            errors.append(row)
+            continue
+        key = None
+        for key_field in key_fields:
+            if row.fields.get(key_field) not in (None, ''):
+                key = (key_field, unicode(row.fields[key_field]))
+                break
+        if key is None:
+            row.status = 'error'
+            row.error = "no {0} to identify the object".format(
+                ' or '.join(key_fields)
+            )
+            errors.append(row)
+            continue
+        if key not in merged:
+            merged[key] = BulkRow(str(row.line))
+            order.append(key)
+        else:
+            merged[key].line += ',{0}'.format(row.line)
+        target = merged[key]
+        for name, value in row.fields.items():
+            if value is None or value == '':
+                continue
+            if name in target.fields and target.fields[name] != value:
+                target.status = 'error'
+                target.error = (
+                    "conflicting values for '{0}': {1!r} and {2!r}".format(
+                        name, target.fields[name], value
+                    )
+                )
+            target.fields[name] = value
+    return [merged[key] for key in order], errors
+
+
+class Throughput(object):
+    """
+    Count outcomes of a bulk run and report how fast it went.
+    """
+    def __init__(self, unit='rows'):
+        self.unit = unit
+        self.start = time.time()
+        self.counts = {}
+        self.total = 0
+
+    def add(self, status, count=1):
+        self.counts[status] = self.counts.get(status, 0) + count
+        self.total += count
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def as_dict(self):
+        elapsed = self.elapsed()
+        ret = dict(self.counts)
+        ret['total'] = self.total
+        ret['seconds'] = round(elapsed, 3)
+        ret['per_second'] = round(self.total / elapsed, 1) if elapsed else 0
+        return ret
+
+    def __str__(self):
+        elapsed = self.elapsed()
+        counts = ', '.join(
+            "{0}: {1}".format(k, v) for k, v in sorted(self.counts.items())
+        )
+        return "{0} {1} in {2:.2f}s ({3:.1f} {1}/s) {4}".format(
+            self.total, self.unit, elapsed,
+            self.total / elapsed if elapsed else 0, counts
+        ).strip()
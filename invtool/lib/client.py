@@ -0,0 +1,410 @@
+"""
+A Python client for Inventory.
+
+Scripts used to drive invtool by building a command line, running it
+through the argparse tree and decoding the JSON it printed. InventoryClient
+sends the same requests directly over the shared, pooled session (see
+invtool.lib.concurrency.session) and returns decoded objects. Failures
+raise InventoryError. The command line dispatches send their requests
+through InventoryClient.send and only add parsing and formatting.
+
+    from invtool.lib.client import inventory_client
+
+    client = inventory_client()
+    client.create('A', {'label': 'www', 'domain': 'mozilla.com', ...})
+    client.range_usage('10.0.0.0', '10.0.0.255', integers=True)
+    for hit in client.search('/^www'):
+        print hit.fqdn
+
+ConcurrentClient runs the same calls on a bounded pool of worker threads
+and hands back Futures, for fanning out many operations at once.
+"""
+import argparse
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.config import REMOTE, API_MAJOR_VERSION
+from invtool.lib.concurrency import (
+    DEFAULT_CONCURRENCY, WorkerPool, as_completed, pmap, session
+)
+from invtool.lib.registrar import registrar
+from invtool.lib.records import loads_export
+from invtool.lib.search_results import iter_hits
+
+OK_STATUSES = (200, 201, 202, 204)
+
+SEARCH_URL = "/core/search/search_dns_text/"
+USAGE_URL = "/core/range/usage_text/"
+VLAN_POOLS_URL = "/en-US/bulk_action/gather_vlan_pools/"
+BA_EXPORT_URL = "/bulk_action/export/"
+BA_IMPORT_URL = "/en-US/bulk_action/import/"
+CSV_URL = "/en-US/csv/ajax_csv_exporter/"
+BA_HEADERS = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+
+# Objects per request when listing
+LIST_PAGE_SIZE = 500
+
+
+class InventoryError(Exception):
+    """
+    Inventory refused or failed a request. errors is what it said went
+    wrong, body the whole decoded response (or None).
+    """
+    def __init__(self, status, errors, body=None):
+        self.status = status
+        self.errors = errors
+        self.body = body
+        super(InventoryError, self).__init__(status, errors)
+
+    def __str__(self):
+        if self.body is not None:
+            return json.dumps(self.body, indent=2)
+        return str(self.errors)
+
+
+def format_errors(error_messages):
+    """
+    One line per field of a tastypie error_messages blob.
+    """
+    messages = json.loads(error_messages, 'unicode')
+    errors = []
+    for error, msg in messages.iteritems():
+        if error == '__all__':
+            error = "Object Error"
+        errors.append("Error: {0}  {1}".format(error, ', '.join(msg)))
+    return errors
+
+
+def error_summary(resp):
+    """
+    Squash the errors in a response into one line.
+    """
+    if resp.status_code == 404:
+        return "http_status: 404 (not found)"
+    try:
+        resp_msg = json.loads(resp.text, 'unicode') if resp.text else None
+    except json.decoder.JSONDecodeError:
+        resp_msg = None
+    if not isinstance(resp_msg, dict):
+        return "http_status: {0}".format(resp.status_code)
+    if 'error_messages' in resp_msg:
+        return '; '.join(format_errors(resp_msg['error_messages']))
+    elif 'message' in resp_msg:
+        return resp_msg['message']
+    elif 'error_message' in resp_msg:
+        return resp_msg['error_message']
+    elif 'error' in resp_msg:  # tastypie's own errors (bad filters, ...)
+        return resp_msg['error']
+    return "http_status: {0}".format(resp.status_code)
+
+
+def load_dispatches():
+    """
+    {dtype: dispatch} of every enabled dispatch. Imported on first use:
+    the dispatches send their requests through this module.
+    """
+    from invtool.main import enabled_dispatches  # noqa
+    return dict((d.dtype.lower(), d) for d in registrar.dispatches)
+
+
+class InventoryClient(object):
+    def __init__(self, remote=REMOTE, concurrency=DEFAULT_CONCURRENCY):
+        self.remote = remote
+        self.concurrency = concurrency
+        self._dispatches = None
+
+    def url(self, path):
+        return path if '://' in path else self.remote + path
+
+    def send(self, method, path, params=None, data=None, headers=None):
+        """
+        Send a request and return the requests.Response, whatever its
+        status. data is sent as is: a string as the body, a dict form
+        encoded.
+        """
+        if headers is None:
+            headers = {'content-type': 'application/json'}
+        return session(self.concurrency).request(
+            method.upper(), self.url(path), params=params, data=data,
+            headers=headers
+        )
+
+    def decode(self, resp):
+        """
+        The decoded body of a response. Raises InventoryError if it failed
+        or isn't JSON.
+        """
+        if resp.status_code not in OK_STATUSES:
+            try:
+                body = json.loads(resp.text) if resp.text else None
+            except json.decoder.JSONDecodeError:
+                body = None
+            raise InventoryError(resp.status_code, error_summary(resp), body)
+        if not resp.content:
+            return {}
+        try:
+            return json.loads(resp.content)
+        except json.decoder.JSONDecodeError:
+            raise InventoryError(
+                resp.status_code, "Couldn't understand the server's response"
+            )
+
+    def request(self, method, path, params=None, data=None, headers=None):
+        return self.decode(self.send(method, path, params, data, headers))
+
+    def get(self, path, params=None):
+        return self.request('get', path, params=params)
+
+    # Objects
+
+    def dispatch(self, dtype):
+        if self._dispatches is None:
+            self._dispatches = load_dispatches()
+        try:
+            return self._dispatches[dtype.lower()]
+        except KeyError:
+            raise ValueError("Unknown dtype '{0}'".format(dtype))
+
+    def detail(self, dtype, pk):
+        d = self.dispatch(dtype)
+        return self.get(d.detail_url(d.pk_nas(pk)), {'format': 'json'})
+
+    def create(self, dtype, data):
+        """
+        Create an object from API fields (not command line options) and
+        return it as Inventory saved it.
+        """
+        d = self.dispatch(dtype)
+        return self.request('post', d.create_url(None), data=json.dumps(data))
+
+    def update(self, dtype, pk, data):
+        d = self.dispatch(dtype)
+        return self.request(
+            'patch', d.update_url(d.pk_nas(pk)), data=json.dumps(data)
+        )
+
+    def delete(self, dtype, pk):
+        d = self.dispatch(dtype)
+        self.request(
+            'delete', d.delete_url(d.pk_nas(pk)), params={'format': 'json'}
+        )
+
+    def iter_pages(self, path, params=None, page_size=LIST_PAGE_SIZE):
+        """
+        Yield the objects of every page of a tastypie list. The first page
+        says how many there are; the rest are fetched concurrently.
+        """
+        params = dict(params or {}, format='json', limit=page_size, offset=0)
+        body = self.get(path, params)
+        for obj in body.get('objects', []):
+            yield obj
+        total = body.get('meta', {}).get('total_count', 0)
+        pages = pmap(
+            lambda offset: self.get(path, dict(params, offset=offset)),
+            range(page_size, total, page_size), self.concurrency
+        )
+        for offset, body in pages:
+            for obj in body.get('objects', []):
+                yield obj
+
+    def list(self, dtype, **filters):
+        """
+        Every object of a dtype, filtered like the API's list endpoint
+        (e.g. site=3).
+        """
+        return self.iter_pages(self.list_path(dtype), filters)
+
+    def list_path(self, dtype):
+        d = self.dispatch(dtype)
+        return d.object_list_url.format(API_MAJOR_VERSION, d.resource_name)
+
+    # Key value pairs
+
+    def kv_list(self, dtype, obj_pk):
+        d = self.dispatch(dtype)
+        return self.get(
+            d.kvlist_url(argparse.Namespace(obj_pk=obj_pk)),
+            {'format': 'json'}
+        )
+
+    def kv_detail(self, dtype, kv_pk):
+        d = self.dispatch(dtype)
+        return self.get(d.detail_url(d.pk_nas(kv_pk)), {'format': 'json'})
+
+    def kv_create(self, dtype, obj_pk, key, value):
+        d = self.dispatch(dtype)
+        return self.request(
+            'post', d.create_url(argparse.Namespace(obj_pk=obj_pk)),
+            data={'key': key, 'value': value, 'obj_pk': obj_pk}
+        )
+
+    def kv_update(self, dtype, kv_pk, key, value):
+        d = self.dispatch(dtype)
+        return self.request(
+            'post', d.update_url(d.pk_nas(kv_pk)),
+            data={'key': key, 'value': value, 'kv_pk': kv_pk}
+        )
+
+    def kv_delete(self, dtype, kv_pk):
+        d = self.dispatch(dtype)
+        self.request(
+            'delete', d.delete_url(d.pk_nas(kv_pk)), params={'format': 'json'}
+        )
+
+    # Search and ranges
+
+    def search_text(self, query):
+        """
+        Inventory's text answer to a search, '' if nothing matched.
+        """
+        body = self.get(SEARCH_URL, {'search': query})
+        if 'text_response' not in body:
+            if body.get('error_messages'):
+                raise InventoryError(200, body['error_messages'], body)
+            return ''
+        return body['text_response']
+
+    def search(self, query):
+        """
+        A SearchHit (see invtool.lib.search_results) per object found.
+        """
+        return list(iter_hits(self.search_text(query)))
+
+    def range_usage(self, start, end, integers=False):
+        """
+        {'used', 'unused', 'free_ranges'} of the range [start, end].
+        """
+        params = {'start': start, 'end': end}
+        if integers:
+            params['format'] = 'integers'
+        body = self.get(USAGE_URL, params)
+        if 'free_ranges' not in body:
+            raise InventoryError(
+                200, body.get('error_messages', "no usage returned"), body
+            )
+        return body
+
+    def vlan_pools(self, site, vlan_name, vlan_number, ip_type='4'):
+        """
+        The free ranges of a vlan's networks in a site.
+        """
+        body = self.request('get', VLAN_POOLS_URL, params={
+            'vlan_name': vlan_name, 'vlan_number': vlan_number,
+            'site_name': site, 'ip_type': ip_type
+        }, headers=BA_HEADERS)
+        if 'errors' in body:
+            raise InventoryError(200, body['errors'], body)
+        if 'free_ranges' not in body:
+            raise InventoryError(
+                200, "Inventory didn't return 'free_ranges'", body
+            )
+        return body['free_ranges']
+
+    def csv(self, query):
+        body = self.get(CSV_URL, {'search': query})
+        return ''.join(body.get('csv_content', []))
+
+    # Bulk actions
+
+    def ba_export(self, query, as_records=False):
+        """
+        The systems a search finds. With as_records they are decoded into
+        SystemRecords with interned strings (see
+        invtool.lib.records.loads_export).
+        """
+        resp = self.send('get', BA_EXPORT_URL, params={'q': query})
+        if resp.status_code not in OK_STATUSES:
+            self.decode(resp)  # Raises
+        blob = loads_export(resp.content, as_records=as_records)
+        if isinstance(blob, dict) and 'errors' in blob:
+            raise InventoryError(resp.status_code, blob['errors'], blob)
+        return blob
+
+    def ba_import(self, blob, commit=False):
+        """
+        Import an exported blob. Nothing is saved unless commit is True.
+        Returns the processed blob.
+        """
+        if commit:
+            blob = dict(blob, commit=True)
+        body = self.request(
+            'post', BA_IMPORT_URL,
+            data=blob if isinstance(blob, basestring) else json.dumps(blob),
+            headers=BA_HEADERS
+        )
+        if 'errors' in body:
+            raise InventoryError(200, body['errors'], body)
+        return body
+
+
+class ConcurrentClient(object):
+    """
+    InventoryClient's calls run on a WorkerPool. Every InventoryClient
+    method is here too but returns a Future instead of waiting for the
+    answer. concurrency bounds both the calls in flight and the connection
+    pool, so any number of calls can be submitted at once::
+
+        with ConcurrentClient(concurrency=32) as client:
+            futures = [client.detail('A', pk) for pk in pks]
+            for future in as_completed(futures):
+                record = future.result()
+
+    list() and iter_pages() are generators: they yield objects as their
+    pages arrive.
+    """
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, client=None):
+        self.client = client or InventoryClient(concurrency=concurrency)
+        self.pool = WorkerPool(concurrency)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        def submit(*args, **kwargs):
+            return self.pool.submit(method, *args, **kwargs)
+        submit.__name__ = name
+        return submit
+
+    def iter_pages(self, path, params=None, page_size=LIST_PAGE_SIZE):
+        """
+        Like InventoryClient.iter_pages, with the pages after the first
+        fetched by the pool and yielded in the order they finish.
+        """
+        params = dict(params or {}, format='json', limit=page_size, offset=0)
+        body = self.client.get(path, params)
+        for obj in body.get('objects', []):
+            yield obj
+        total = body.get('meta', {}).get('total_count', 0)
+        pages = [
+            self.pool.submit(self.client.get, path, dict(params, offset=n))
+            for n in range(page_size, total, page_size)
+        ]
+        for page in as_completed(pages):
+            for obj in page.result().get('objects', []):
+                yield obj
+
+    def list(self, dtype, **filters):
+        return self.iter_pages(self.client.list_path(dtype), filters)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+
+_client = None
+
+
+def inventory_client():
+    global _client
+    if _client is None:
+        _client = InventoryClient()
+    return _client
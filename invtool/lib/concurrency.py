@@ -0,0 +1,245 @@
+import sys
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import requests
+
+from invtool.lib.config import auth
+from invtool.lib.explain import record_latency
+
+DEFAULT_CONCURRENCY = 8
+
+_session = None
+_session_size = 0
+_session_lock = threading.Lock()
+
+_FED = object()
+_STOP = object()
+
+
+def session(pool_size=DEFAULT_CONCURRENCY):
+    """
+    Return a process wide requests.Session. Connections are kept alive and
+    shared between threads so bulk actions don't pay for a new TCP (and TLS)
+    handshake on every request.
+    """
+    global _session, _session_size
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.auth = auth()
+            _session.hooks['response'].append(record_latency)
+        if pool_size > _session_size:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_size = pool_size
+        return _session
+
+
+def pmap(func, items, concurrency=DEFAULT_CONCURRENCY, ordered=True):
+    """
+    Apply func to every element of items using a bounded number of worker
+    threads and yield (item, result) tuples.
+
+    items may be a generator (e.g. rows streamed from stdin); it is consumed
+    lazily so only a couple of items per worker are in flight at once. If
+    ordered is True results come back in input order, otherwise they come
+    back as soon as they are ready. An exception raised by func (or by the
+    items generator) is re-raised in the caller.
+    """
+    concurrency = max(1, concurrency)
+    in_q = queue.Queue(maxsize=concurrency * 2)
+    out_q = queue.Queue()
+    stop = threading.Event()
+
+    def worker():
+        while True:
+            job = in_q.get()
+            if job is _STOP:
+                return
+            if stop.is_set():
+                continue
+            i, item = job
+            try:
+                out_q.put((i, item, func(item), None))
+            except Exception:
+                out_q.put((i, item, None, sys.exc_info()))
+
+    def feeder():
+        n = 0
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                in_q.put((n, item))
+                n += 1
+            out_q.put((_FED, n, None, None))
+        except Exception:
+            out_q.put((_FED, n, None, sys.exc_info()))
+        finally:
+            for _ in range(concurrency):
+                in_q.put(_STOP)
+
+    threads = [threading.Thread(target=feeder)]
+    threads += [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    total = None
+    received = 0
+    pending = {}
+    next_i = 0
+    try:
+        while total is None or received < total:
+            i, item, result, exc_info = out_q.get()
+            if i is _FED:
+                total = item
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                continue
+            received += 1
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if not ordered:
+                yield item, result
+                continue
+            pending[i] = (item, result)
+            while next_i in pending:
+                yield pending.pop(next_i)
+                next_i += 1
+        # Everything was fed, so every thread is about to see _STOP. Wait for
+        # them instead of letting the interpreter tear them down mid-call.
+        for t in threads:
+            t.join()
+    finally:
+        stop.set()
+
+
+def chunked(items, size):
+    """
+    Group an iterable into lists of at most size elements.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Future(object):
+    """
+    The outcome of a call submitted to a WorkerPool.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        """
+        Wait for the call and return what it returned, or re-raise what it
+        raised.
+        """
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        self._done.wait()
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, func):
+        """
+        Call func(future) once the call has finished (right away if it
+        already has).
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _finish(self, result, exc_info):
+        with self._lock:
+            self._result, self._exc_info = result, exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+
+class WorkerPool(object):
+    """
+    concurrency threads running submitted calls, so no more than that many
+    are ever in flight however many are submitted. Calls wait their turn in
+    an unbounded queue.
+    """
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self._queue = queue.Queue()
+        self._threads = []
+        for _ in range(self.concurrency):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            future, func, args, kwargs = job
+            try:
+                future._finish(func(*args, **kwargs), None)
+            except Exception:
+                future._finish(None, sys.exc_info())
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stop the workers once the calls already submitted have run.
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+
+def as_completed(futures):
+    """
+    Yield futures as they finish, whatever order they were submitted in.
+    """
+    futures = list(futures)
+    finished = queue.Queue()
+    for future in futures:
+        future.add_done_callback(finished.put)
+    for _ in futures:
+        yield finished.get()
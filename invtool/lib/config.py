@@ -34,6 +34,62 @@ REMOTE = "http{0}://{1}{2}".format(
     '' if port == '80' else ':' + port
 )
 
+# Where invtool keeps things it has learned about the server (natural key
+# index, ...). Everything in here can be thrown away at any time.
+if config.has_option('cache', 'dir'):
+    CACHE_DIR = os.path.expanduser(config.get('cache', 'dir'))
+else:
+    CACHE_DIR = os.path.expanduser('~/.invtool')
+
+# How long (seconds) a remembered natural key -> pk mapping is trusted
+if config.has_option('cache', 'natural_key_ttl'):
+    NATURAL_KEY_TTL = config.getint('cache', 'natural_key_ttl')
+else:
+    NATURAL_KEY_TTL = 3600
+
+# The local copy of Inventory made by `invtool mirror sync`, and how old
+# (seconds) its last complete pass may get before sync does another one.
+# Complete passes notice objects that were deleted in Inventory.
+if config.has_option('mirror', 'path'):
+    MIRROR_PATH = os.path.expanduser(config.get('mirror', 'path'))
+else:
+    MIRROR_PATH = os.path.join(CACHE_DIR, 'mirror.sqlite3')
+
+if config.has_option('mirror', 'full_sync_interval'):
+    MIRROR_FULL_SYNC_INTERVAL = config.getint('mirror', 'full_sync_interval')
+else:
+    MIRROR_FULL_SYNC_INTERVAL = 86400
+
+# The ledger of free addresses handed out to runs that haven't saved them in
+# Inventory yet, and how long (seconds) a reservation is held. Point path at
+# a shared directory to share reservations between machines.
+if config.has_option('reservations', 'path'):
+    RESERVATION_PATH = os.path.expanduser(config.get('reservations', 'path'))
+else:
+    RESERVATION_PATH = os.path.join(CACHE_DIR, 'reservations.json')
+
+if config.has_option('reservations', 'ttl'):
+    RESERVATION_TTL = config.getint('reservations', 'ttl')
+else:
+    RESERVATION_TTL = 3600
+
+# How long (seconds) the free ranges of a vlan or range are reused by the
+# CSV tools. Set it to 0 to always ask Inventory.
+if config.has_option('cache', 'pool_ttl'):
+    POOL_CACHE_TTL = config.getint('cache', 'pool_ttl')
+else:
+    POOL_CACHE_TTL = 300
+
+POOL_CACHE_PATH = os.path.join(CACHE_DIR, 'pools.json')
+
+# How long (seconds) the network index used by `NET lookup` is trusted
+if config.has_option('cache', 'network_index_ttl'):
+    NETWORK_INDEX_TTL = config.getint('cache', 'network_index_ttl')
+else:
+    NETWORK_INDEX_TTL = 3600
+
+NETWORK_INDEX_PATH = os.path.join(CACHE_DIR, 'network_index.json')
+
 try:
     import keyring
     KEYRING_PRESENT = True
@@ -2,10 +2,15 @@ from invtool.lib.options import build_extractor, write_num_argument
 from invtool.tests.test_data import TEST_NAME, TEST_PORT, TEST_NETWORK
 
 
-def name_argument(field_name, required=False):
+def name_argument(field_name, required=False, option=None):
+    # option is the name of the command line option if it isn't field_name
+    # (SITE's --name sets full_name). --<field_name> is still accepted.
     def add_name_arg(parser, required=required, **kwargs):
+        options = ['--{0}'.format(field_name)]
+        if option:
+            options.insert(0, '--{0}'.format(option))
         parser.add_argument(
-            '--{0}'.format(field_name), type=str,
+            *options, type=str,
             dest=field_name, help="A name.",
             required=required
         )
@@ -0,0 +1,185 @@
+import atexit
+import os
+import re
+import threading
+import urllib
+import urlparse
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.config import CACHE_DIR, REMOTE
+from invtool.lib.lockfile import locked_json, read_json
+
+# How much a new latency sample moves the remembered average
+LATENCY_WEIGHT = 0.3
+
+
+def endpoint(method, url):
+    """
+    Name the endpoint a request goes to: 'PATCH /.../addressrecord/{pk}/'.
+    Primary keys are replaced so every request to the same kind of URL
+    shares one latency figure.
+    """
+    path = urlparse.urlsplit(url).path
+    path = re.sub(r'/set/[^/]*', '/set/{pks}', path)
+    path = re.sub(r'/\d+(?=/|$)', '/{pk}', path)
+    return '{0} {1}'.format(method.upper(), path)
+
+
+class LatencyLog(object):
+    """
+    A running average of how long each endpoint took to answer. Kept in the
+    cache dir so --explain can estimate how long a job will take.
+    """
+    def __init__(self, path, remote=REMOTE):
+        self.path = path
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._latencies = None
+        self._observed = {}
+
+    def _average(self, old, seconds):
+        if old is None:
+            return seconds
+        return old + LATENCY_WEIGHT * (seconds - old)
+
+    def record(self, method, url, seconds):
+        name = endpoint(method, url)
+        with self._lock:
+            self._observed[name] = self._average(
+                self._observed.get(name), seconds
+            )
+
+    def latency(self, method, url):
+        name = endpoint(method, url)
+        with self._lock:
+            if name in self._observed:
+                return self._observed[name]
+            if self._latencies is None:
+                self._latencies = read_json(self.path).get(self.remote, {})
+            return self._latencies.get(name)
+
+    def save(self):
+        with self._lock:
+            if not self._observed:
+                return
+            try:
+                with locked_json(self.path) as data:
+                    latencies = data.setdefault(self.remote, {})
+                    for name, seconds in self._observed.items():
+                        latencies[name] = self._average(
+                            latencies.get(name), seconds
+                        )
+            except (IOError, OSError):
+                pass  # It's only a cache
+            self._observed = {}
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def latency_log():
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = LatencyLog(os.path.join(CACHE_DIR, 'latency.json'))
+            atexit.register(_log.save)
+        return _log
+
+
+def record_latency(resp, *args, **kwargs):
+    """
+    A requests response hook that feeds the latency log.
+    """
+    latency_log().record(
+        resp.request.method, resp.request.url, resp.elapsed.total_seconds()
+    )
+
+
+class RequestPlan(object):
+    """
+    The requests a command would have sent. Filled in instead of talking to
+    Inventory when --explain is given.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.order = []
+
+    def add(self, method, url, body=None, params=None):
+        if params:
+            url = '{0}?{1}'.format(url, urllib.urlencode(params))
+        if body is not None and not isinstance(body, basestring):
+            body = json.dumps(body)
+        name = endpoint(method, url)
+        with self._lock:
+            if name not in self.endpoints:
+                self.endpoints[name] = {
+                    'method': method.upper(), 'url': url, 'requests': 0,
+                    'bytes': 0
+                }
+                self.order.append(name)
+            self.endpoints[name]['requests'] += 1
+            self.endpoints[name]['bytes'] += len(body or '')
+
+    def as_dict(self, concurrency=1):
+        steps = []
+        requests = size = 0
+        busy = 0.0
+        unknown = False
+        for name in self.order:
+            step = dict(self.endpoints[name])
+            step['endpoint'] = name.split(' ', 1)[1]
+            if step['requests'] > 1:
+                del step['url']  # Only the first one, which would mislead
+            latency = latency_log().latency(step['method'], name.split()[1])
+            step['latency'] = latency
+            if latency is None:
+                unknown = True
+            else:
+                busy += latency * step['requests']
+            requests += step['requests']
+            size += step['bytes']
+            steps.append(step)
+        concurrency = max(1, min(concurrency, requests))
+        return {
+            'plan': steps, 'requests': requests, 'bytes': size,
+            'concurrency': concurrency,
+            'estimated_seconds': (
+                None if unknown or not requests else
+                round(busy / concurrency, 3)
+            )
+        }
+
+    def report(self, concurrency=1):
+        summary = self.as_dict(concurrency)
+        lines = ["Nothing was sent. invtool would have made these requests:"]
+        for step in summary['plan']:
+            latency = step['latency']
+            lines.append("  {0} {1}  x{2}  {3}  {4}".format(
+                step['method'], step.get('url', step['endpoint']),
+                step['requests'], human_size(step['bytes']),
+                "~{0:.0f}ms each".format(latency * 1000)
+                if latency is not None else "no latency observed yet"
+            ))
+        total = "{0} requests, {1}".format(
+            summary['requests'], human_size(summary['bytes'])
+        )
+        if summary['estimated_seconds'] is not None:
+            total += ", about {0:.2f}s at concurrency {1}".format(
+                summary['estimated_seconds'], summary['concurrency']
+            )
+        lines.append(total)
+        return lines
+
+
+def human_size(size):
+    if size < 1024:
+        return "{0} B".format(size)
+    if size < 1024 * 1024:
+        return "{0:.1f} KB".format(size / 1024.0)
+    return "{0:.1f} MB".format(size / 1024.0 / 1024.0)
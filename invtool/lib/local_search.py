@@ -0,0 +1,490 @@
+"""
+Run search queries against the local mirror (see invtool.lib.mirror).
+
+A query is parsed into a tree and compiled into one SQL statement. Each
+term narrows the candidates with an index before anything is compared:
+
+    word        trigram index on names and targets, then a substring match
+    /regex      the name index for a literal '^prefix', otherwise the
+                trigram index for the longest literal run, then the regex
+    type=:      the dtype index
+    ip=:, range=:, network=:, site=:, vlan=:
+                range scans on the sortable ip index
+
+``zone=:`` and ``view=:`` are checked on the rows that are left.
+"""
+import re
+import socket
+import struct
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.mirror import ip_key, network_keys, ref_pk, trigrams
+
+# Only these are in the text Inventory's search answers with
+SEARCH_DTYPES = ('A', 'AAAA', 'CNAME', 'MX', 'PTR', 'SRV', 'TXT', 'SYS')
+
+REGEX_META = set('.^$*+?()[]{}|\\')
+
+GRAM_COUNT_LIMIT = 1000
+
+# Compiled REGEXP patterns kept between queries; cleared when full, the way
+# re's own cache is
+REGEX_CACHE_SIZE = 100
+
+
+class QueryError(Exception):
+    pass
+
+
+def tokenize(query):
+    """
+    Split a query into words, '!', '(' and ')'. A regex runs to the next
+    space, less any ')' it doesn't open itself.
+    """
+    tokens = []
+    for word in query.split():
+        while word[:1] in ('(', '!'):
+            tokens.append(word[0])
+            word = word[1:]
+        closing = len(word) - len(word.rstrip(')'))
+        if word.startswith('/'):
+            unbalanced = word.count(')') - word.count('(')
+            closing = min(closing, max(0, unbalanced))
+        if closing:
+            word, parens = word[:-closing], word[-closing:]
+        else:
+            parens = ''
+        if word:
+            tokens.append(word)
+        tokens.extend(parens)
+    return tokens
+
+
+class Parser(object):
+    """
+    expr   := and ('OR' and)*
+    and    := unary (['AND'] unary)*
+    unary  := '!' unary | '(' expr ')' | term
+    """
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Empty query")
+        tree = self.expr()
+        if self.peek() is not None:
+            raise QueryError("Unexpected '{0}'".format(self.peek()))
+        return tree
+
+    def expr(self):
+        node = self.and_expr()
+        while self.peek() == 'OR':
+            self.take()
+            node = ('or', node, self.and_expr())
+        return node
+
+    def and_expr(self):
+        node = self.unary()
+        while self.peek() not in (None, ')', 'OR'):
+            if self.peek() == 'AND':
+                self.take()
+            node = ('and', node, self.unary())
+        return node
+
+    def unary(self):
+        token = self.take()
+        if token is None:
+            raise QueryError("The query ends too early")
+        if token == '!':
+            return ('not', self.unary())
+        if token == '(':
+            node = self.expr()
+            if self.take() != ')':
+                raise QueryError("Missing ')'")
+            return node
+        if token in (')', 'AND', 'OR'):
+            raise QueryError("Unexpected '{0}'".format(token))
+        if token.startswith('/'):
+            return ('regex', token[1:])
+        if '=:' in token:
+            directive, value = token.split('=:', 1)
+            return ('directive', directive.lower(), value)
+        return ('word', token)
+
+
+def literal_prefix(pattern):
+    """
+    The literal text every match of pattern (without its '^') starts with.
+    """
+    prefix, i = '', 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern) and \
+                pattern[i + 1] in REGEX_META:
+            char, step = pattern[i + 1], 2
+        elif char in REGEX_META:
+            break
+        else:
+            step = 1
+        if pattern[i + step:i + step + 1] in ('*', '?', '{'):
+            break  # This character is optional
+        prefix += char
+        i += step
+    return prefix
+
+
+def skip_group(pattern, i):
+    """
+    The index just past the [...] class, {m,n} count or (...) group that
+    starts at pattern[i].
+    """
+    if pattern[i] == '{':
+        end = pattern.find('}', i)
+        return len(pattern) if end == -1 else end + 1
+    if pattern[i] == '[':
+        j = i + 1
+        if pattern[j:j + 1] == '^':
+            j += 1
+        if pattern[j:j + 1] == ']':  # A leading ']' is a literal
+            j += 1
+        while j < len(pattern) and pattern[j] != ']':
+            j += 2 if pattern[j] == '\\' else 1
+        return j + 1
+    depth, j = 0, i
+    while j < len(pattern):
+        char = pattern[j]
+        if char == '\\':
+            j += 2
+            continue
+        if char == '[':
+            j = skip_group(pattern, j)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return j + 1
+        j += 1
+    return len(pattern)
+
+
+def literal_runs(pattern):
+    """
+    Strings that must appear in anything pattern matches. Classes, counts
+    and groups end a run and what is inside them is skipped; anything with
+    alternation gives nothing.
+    """
+    if '|' in pattern:
+        return []
+    runs, run, i = [], '', 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            if pattern[i + 1] in REGEX_META:
+                run += pattern[i + 1]
+            else:  # A class like \d
+                runs.append(run)
+                run = ''
+            i += 2
+            continue
+        if char in '*?{':
+            run = run[:-1]  # The previous character is optional
+        if char in REGEX_META:
+            runs.append(run)
+            run = ''
+            if char in '[({':
+                i = skip_group(pattern, i)
+                continue
+        else:
+            run += char
+        i += 1
+    runs.append(run)
+    return [r for r in runs if r]
+
+
+class Compiler(object):
+    """
+    Turn a parsed query into an SQL condition on the objects table.
+    """
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.db = mirror.db
+
+    def compile(self, node):
+        kind = node[0]
+        if kind == 'or':
+            a, pa = self.compile(node[1])
+            b, pb = self.compile(node[2])
+            return '({0} OR {1})'.format(a, b), pa + pb
+        if kind == 'and':
+            a, pa = self.compile(node[1])
+            b, pb = self.compile(node[2])
+            return '({0} AND {1})'.format(a, b), pa + pb
+        if kind == 'not':
+            a, pa = self.compile(node[1])
+            return '(NOT {0})'.format(a), pa
+        return getattr(self, 'compile_' + kind)(*node[1:])
+
+    def rarest_grams(self, text, count=2):
+        # Counting stops at GRAM_COUNT_LIMIT; past that a gram is common
+        # enough not to be worth telling apart
+        grams = sorted(
+            (self.db.execute(
+                'SELECT COUNT(*) FROM (SELECT 1 FROM grams WHERE gram = ? '
+                'LIMIT ?)', (gram, GRAM_COUNT_LIMIT)
+            ).fetchone()[0], gram) for gram in trigrams(text)
+        )
+        return [gram for n, gram in grams[:count]]
+
+    def gram_filter(self, text):
+        grams = self.rarest_grams(text)
+        if not grams:
+            return None, []
+        return 'id IN ({0})'.format(' INTERSECT '.join(
+            ['SELECT obj FROM grams WHERE gram = ?'] * len(grams)
+        )), grams
+
+    def compile_word(self, word):
+        word = word.lower()
+        like = '%{0}%'.format(
+            word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        )
+        sql = ("(name_lc LIKE ? ESCAPE '\\' OR target LIKE ? ESCAPE '\\')")
+        params = [like, like]
+        narrow, grams = self.gram_filter(word)
+        if narrow:
+            sql = '({0} AND {1})'.format(narrow, sql)
+            params = grams + params
+        if re.match(r'^[0-9a-f.:]+$', word):  # Could be (part of) an ip
+            sql = '({0} OR ip_str LIKE ?)'.format(sql)
+            params.append(word + '%')
+        return sql, params
+
+    def compile_regex(self, pattern):
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise QueryError("Bad regex '{0}': {1}".format(pattern, e))
+        sql, params = 'name_lc REGEXP ?', [pattern]
+        prefix = None
+        if pattern.startswith('^') and '|' not in pattern:
+            prefix = literal_prefix(pattern[1:]).lower()
+        if prefix:
+            sql = '(name_lc >= ? AND name_lc < ? AND {0})'.format(sql)
+            params = [prefix, prefix + u'\uffff'] + params
+        else:
+            runs = [r for r in literal_runs(pattern) if len(r) >= 3]
+            if runs:
+                narrow, grams = self.gram_filter(max(runs, key=len).lower())
+                if narrow:
+                    sql = '({0} AND {1})'.format(narrow, sql)
+                    params = grams + params
+        return sql, params
+
+    def compile_directive(self, directive, value):
+        method = getattr(self, 'directive_' + directive, None)
+        if method is None:
+            raise QueryError("Unknown directive '{0}'".format(directive))
+        return method(value)
+
+    def directive_type(self, value):
+        return 'dtype = ?', [value.upper()]
+
+    def directive_view(self, value):
+        return 'views LIKE ?', ['%,{0},%'.format(value)]
+
+    def directive_zone(self, value):
+        value = value.lower().rstrip('.')
+        return '(name_lc = ? OR name_lc LIKE ?)', [value, '%.' + value]
+
+    def directive_ip(self, value):
+        key = ip_key(value)
+        if key is None:
+            raise QueryError("'{0}' isn't an ip address".format(value))
+        return 'ip_key = ?', [key]
+
+    def directive_range(self, value):
+        try:
+            start, end = value.split(',')
+        except ValueError:
+            raise QueryError("range=: needs '<start>,<end>'")
+        start, end = ip_key(start), ip_key(end)
+        if start is None or end is None or start[0] != end[0]:
+            raise QueryError("'{0}' isn't an ip range".format(value))
+        return 'ip_key BETWEEN ? AND ?', [start, end]
+
+    def directive_network(self, value):
+        try:
+            return 'ip_key BETWEEN ? AND ?', list(network_keys(value))
+        except ValueError as e:
+            raise QueryError(str(e))
+
+    def networks_where(self, match):
+        """
+        An ip_key condition covering every mirrored network match() likes.
+        """
+        ranges, params = [], []
+        for obj in self.mirror.objects('NET'):
+            if not match(obj):
+                continue
+            try:
+                first, last = network_keys(obj['network_str'])
+            except (KeyError, ValueError):
+                continue
+            ranges.append('ip_key BETWEEN ? AND ?')
+            params += [first, last]
+        if not ranges:
+            return '0', []
+        return '({0})'.format(' OR '.join(ranges)), params
+
+    def related(self, ref, dtype):
+        """
+        The mirrored object a network's site or vlan field refers to. It may
+        be a nested object or a resource uri.
+        """
+        if isinstance(ref, dict):
+            return ref
+        pk = ref_pk(ref)
+        if pk is None:
+            return None
+        row = self.db.execute(
+            'SELECT data FROM objects WHERE dtype = ? AND pk = ?',
+            (dtype, pk)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def directive_site(self, value):
+        return self.networks_where(lambda network: site_matches(
+            self.related(network.get('site'), 'SITE'), value
+        ))
+
+    def directive_vlan(self, value):
+        return self.networks_where(lambda network: vlan_matches(
+            self.related(network.get('vlan'), 'VLAN'), value
+        ))
+
+
+def site_matches(site, value):
+    """
+    Whether a site object is the one site=:value means: its full name or
+    name, in any case.
+    """
+    site = site or {}
+    return value.lower() in (
+        (site.get('full_name') or '').lower(),
+        (site.get('name') or '').lower()
+    )
+
+
+def vlan_matches(vlan, value):
+    """
+    Whether a vlan object is the one vlan=:value means. value is a name, a
+    number or 'name,number'.
+    """
+    if not vlan:
+        return False
+    name, _, number = value.partition(',')
+    if name.isdigit() and not number:
+        name, number = '', name
+    if name and (vlan.get('name') or '').lower() != name.lower():
+        return False
+    if number and str(vlan.get('number')) != number:
+        return False
+    return True
+
+
+def reverse_name(ip_str):
+    if ':' in ip_str:
+        high, low = struct.unpack(
+            '!QQ', socket.inet_pton(socket.AF_INET6, ip_str)
+        )
+        nibbles = '{0:016x}{1:016x}'.format(high, low)
+        return '.'.join(reversed(nibbles)) + '.ip6.arpa.'
+    return '.'.join(reversed(ip_str.split('.'))) + '.in-addr.arpa.'
+
+
+def render_line(dtype, obj):
+    """
+    A line in the format Inventory's search_dns_text uses.
+    """
+    if dtype == 'SYS':
+        return u'{0} {1} INV SYS {2} {3}'.format(
+            obj.get('hostname'), obj.get('oob_ip') or '',
+            obj.get('asset_tag') or '', obj.get('serial') or ''
+        )
+    name = obj.get('fqdn')
+    if dtype in ('A', 'AAAA'):
+        rdata = obj.get('ip_str')
+    elif dtype == 'CNAME':
+        rdata = obj.get('target') + '.'
+    elif dtype == 'MX':
+        rdata = u'{0} {1}.'.format(obj.get('priority'), obj.get('server'))
+    elif dtype == 'SRV':
+        rdata = u'{0} {1} {2} {3}.'.format(
+            obj.get('priority'), obj.get('weight'), obj.get('port'),
+            obj.get('target')
+        )
+    elif dtype == 'TXT':
+        rdata = u'"{0}"'.format(obj.get('txt_data'))
+    elif dtype == 'PTR':
+        name = reverse_name(obj.get('ip_str')).rstrip('.')
+        rdata = obj.get('name') + '.'
+    else:
+        rdata = ''
+    return u'{0} {1}. {2} IN {3} {4}'.format(
+        obj.get('pk'), name, obj.get('ttl') or 3600, dtype, rdata
+    )
+
+
+_regex_cache = {}
+
+
+def _regexp(pattern, value):
+    if value is None:
+        return False
+    regex = _regex_cache.get(pattern)
+    if regex is None:
+        if len(_regex_cache) >= REGEX_CACHE_SIZE:
+            _regex_cache.clear()
+        regex = _regex_cache[pattern] = re.compile(pattern, re.I)
+    return regex.search(value) is not None
+
+
+def compile_query(mirror, query):
+    """
+    (sql, params) selecting the dtype and data of every match.
+    """
+    where, params = Compiler(mirror).compile(Parser(query).parse())
+    # '+dtype' keeps SQLite from picking the dtype index over the ones the
+    # query's own terms can use
+    sql = ('SELECT dtype, data FROM objects WHERE +dtype IN ({0}) AND {1} '
+           'ORDER BY dtype, name_lc').format(
+               ', '.join('?' * len(SEARCH_DTYPES)), where)
+    return sql, list(SEARCH_DTYPES) + params
+
+
+def search(mirror, query):
+    """
+    Yield the lines Inventory would have answered query with.
+    """
+    mirror.db.create_function('REGEXP', 2, _regexp)
+    sql, params = compile_query(mirror, query)
+    for dtype, data in mirror.db.execute(sql, params):
+        yield render_line(dtype, json.loads(data))
@@ -0,0 +1,45 @@
+"""
+JSON files that several invtool processes read and change at once.
+"""
+import contextlib
+import fcntl
+import os
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+def read_json(path):
+    """
+    The dict in path, or an empty one. Files are replaced atomically so
+    reading doesn't need the lock.
+    """
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (IOError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@contextlib.contextmanager
+def locked_json(path):
+    """
+    Hold an exclusive lock on path (through path.lock) and yield the dict
+    in it. The dict is written back if the block ends without an exception.
+    """
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            data = read_json(path)
+            yield data
+            tmp = '{0}.{1}'.format(path, os.getpid())
+            with open(tmp, 'w') as fd:
+                json.dump(data, fd)
+            os.rename(tmp, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
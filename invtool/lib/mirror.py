@@ -0,0 +1,389 @@
+"""
+A local SQLite copy of the objects in Inventory.
+
+``invtool mirror sync`` fills it; read heavy tools (audits, reports) can
+then work on the copy instead of sending the same large queries to
+Inventory again and again. Everything in the mirror can be thrown away and
+rebuilt at any time.
+"""
+import hashlib
+import os
+import re
+import socket
+import sqlite3
+import struct
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.config import MIRROR_PATH, REMOTE
+
+SCHEMA_VERSION = 2
+
+# The field an object is known by, in order of preference
+NAME_FIELDS = ('fqdn', 'hostname', 'network_str', 'full_name', 'name')
+# The field holding the name a record points at
+TARGET_FIELDS = ('target', 'server', 'name')
+
+TABLES = ('meta', 'objects', 'grams', 'kvs', 'sync_state')
+
+# objects.name_lc and objects.target are what plain search words match; they
+# are indexed by trigram in grams. ip_key makes addresses sortable (see
+# ip_key()) so ranges and networks are index range scans.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY,
+    dtype TEXT NOT NULL,
+    pk INTEGER NOT NULL,
+    resource TEXT NOT NULL,
+    name TEXT,
+    name_lc TEXT,
+    target TEXT,
+    views TEXT,
+    ip_str TEXT,
+    ip_key TEXT,
+    modified TEXT,
+    hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (resource, pk)
+);
+CREATE INDEX IF NOT EXISTS objects_dtype ON objects (dtype);
+CREATE INDEX IF NOT EXISTS objects_name_lc ON objects (name_lc);
+CREATE INDEX IF NOT EXISTS objects_ip_key ON objects (ip_key);
+CREATE TABLE IF NOT EXISTS grams (
+    gram TEXT NOT NULL,
+    obj INTEGER NOT NULL,
+    PRIMARY KEY (gram, obj)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kvs (
+    dtype TEXT NOT NULL,
+    obj_pk INTEGER NOT NULL,
+    kv_pk INTEGER,
+    key TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS kvs_obj ON kvs (dtype, obj_pk);
+CREATE INDEX IF NOT EXISTS kvs_key ON kvs (key, value);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource TEXT PRIMARY KEY,
+    since TEXT,
+    modified_filter INTEGER,
+    last_full REAL,
+    last_sync REAL
+);
+"""
+
+
+def ip_key(ip_str):
+    """
+    A string that sorts like the address: '4' and 8 hex digits for IPv4,
+    '6' and 32 for IPv6. None if ip_str isn't an address.
+    """
+    if not ip_str:
+        return None
+    try:
+        if ':' in ip_str:
+            high, low = struct.unpack(
+                '!QQ', socket.inet_pton(socket.AF_INET6, ip_str)
+            )
+            return '6{0:016x}{1:016x}'.format(high, low)
+        return '4{0:08x}'.format(
+            struct.unpack('!I', socket.inet_aton(ip_str))[0]
+        )
+    except (socket.error, ValueError):
+        return None
+
+
+def network_keys(network_str):
+    """
+    The first and last ip_key() of a network like '10.0.0.0/24'.
+    """
+    ip_str, prefix = network_str.split('/')
+    start = ip_key(ip_str)
+    if start is None:
+        raise ValueError("'{0}' isn't a network".format(network_str))
+    bits = 32 if start[0] == '4' else 128
+    prefix = int(prefix)
+    if not 0 <= prefix <= bits:
+        raise ValueError("'{0}' isn't a network".format(network_str))
+    first = int(start[1:], 16) >> (bits - prefix) << (bits - prefix)
+    last = first | ((1 << (bits - prefix)) - 1)
+    width = bits / 4
+    return (
+        '{0}{1:0{2}x}'.format(start[0], first, width),
+        '{0}{1:0{2}x}'.format(start[0], last, width)
+    )
+
+
+def trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def object_hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True)).hexdigest()
+
+
+def object_name(obj):
+    for field in NAME_FIELDS:
+        if obj.get(field):
+            return obj[field]
+    return None
+
+
+def object_pk(obj):
+    return int(obj.get('pk', obj.get('id')))
+
+
+def ref_pk(ref):
+    """
+    The pk an object's reference to another one (a resource uri like
+    '/en-US/core/api/v1_core/site/3/' or a nested object) points at.
+    """
+    if isinstance(ref, dict):
+        return ref.get('pk', ref.get('id'))
+    match = re.search(r'(\d+)/?$', str(ref or ''))
+    return int(match.group(1)) if match else None
+
+
+def object_target(obj):
+    for field in TARGET_FIELDS:
+        if obj.get(field) and obj.get(field) != object_name(obj):
+            return obj[field]
+    return None
+
+
+def object_views(obj):
+    views = obj.get('views') or []
+    names = [v.get('name') if isinstance(v, dict) else v for v in views]
+    return ',{0},'.format(','.join(names)) if names else None
+
+
+class Mirror(object):
+    """
+    The SQLite file behind the mirror. Only one thread should use a Mirror;
+    sync fetches concurrently but writes from the calling thread.
+    """
+    def __init__(self, path, remote=REMOTE):
+        self.path = path
+        self.remote = remote
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self._check_meta()
+
+    def _check_meta(self):
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        if meta and (meta.get('remote') != self.remote or
+                     meta.get('schema') != str(SCHEMA_VERSION)):
+            # A copy of another server (or an old layout) is of no use
+            with self.db:
+                for table in TABLES:
+                    self.db.execute('DROP TABLE IF EXISTS {0}'.format(table))
+            self.db.executescript(SCHEMA)
+            meta = {}
+        if not meta:
+            self.set_meta(remote=self.remote, schema=SCHEMA_VERSION)
+
+    def set_meta(self, **items):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [(k, str(v)) for k, v in items.items()]
+            )
+
+    def clear(self):
+        with self.db:
+            for table in TABLES:
+                self.db.execute('DELETE FROM {0}'.format(table))
+
+    def is_empty(self):
+        return self.db.execute(
+            'SELECT 1 FROM sync_state LIMIT 1'
+        ).fetchone() is None
+
+    # Sync state
+
+    def sync_state(self, resource):
+        row = self.db.execute(
+            'SELECT * FROM sync_state WHERE resource = ?', (resource,)
+        ).fetchone()
+        return dict(row) if row else {}
+
+    def save_sync_state(self, resource, **state):
+        current = self.sync_state(resource)
+        current.update(state, resource=resource)
+        columns = sorted(current)
+        self.db.execute(
+            'INSERT OR REPLACE INTO sync_state ({0}) VALUES ({1})'.format(
+                ', '.join(columns), ', '.join('?' * len(columns))
+            ), [current[c] for c in columns]
+        )
+
+    # Objects
+
+    def _ids(self, resource, pks):
+        """
+        {pk: (id, hash)} of the given objects that are in the mirror.
+        """
+        ret = {}
+        pks = list(pks)
+        for i in range(0, len(pks), 500):  # SQLite caps bound variables
+            chunk = pks[i:i + 500]
+            for pk, obj_id, digest in self.db.execute(
+                    'SELECT pk, id, hash FROM objects WHERE resource = ? AND '
+                    'pk IN ({0})'.format(', '.join('?' * len(chunk))),
+                    [resource] + chunk):
+                ret[pk] = (obj_id, digest)
+        return ret
+
+    def store_objects(self, resource, dtype_of, objects):
+        """
+        Insert or update objects whose content changed. Returns the pks of
+        the objects that were written.
+        """
+        by_pk = dict((object_pk(obj), obj) for obj in objects)
+        known = self._ids(resource, by_pk)
+        written = []
+        for pk, obj in by_pk.iteritems():
+            digest = object_hash(obj)
+            obj_id, known_digest = known.get(pk, (None, None))
+            if known_digest == digest:
+                continue
+            name = object_name(obj)
+            target = object_target(obj)
+            row = (
+                dtype_of(obj), name, name.lower() if name else None,
+                target.lower() if target else None, object_views(obj),
+                obj.get('ip_str'), ip_key(obj.get('ip_str')),
+                obj.get('modified'), digest, json.dumps(obj)
+            )
+            if obj_id is None:
+                obj_id = self.db.execute(
+                    'INSERT INTO objects (dtype, name, name_lc, target, '
+                    'views, ip_str, ip_key, modified, hash, data, resource, '
+                    'pk) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    row + (resource, pk)
+                ).lastrowid
+            else:
+                self.db.execute(
+                    'UPDATE objects SET dtype = ?, name = ?, name_lc = ?, '
+                    'target = ?, views = ?, ip_str = ?, ip_key = ?, '
+                    'modified = ?, hash = ?, data = ? WHERE id = ?',
+                    row + (obj_id,)
+                )
+                self.db.execute('DELETE FROM grams WHERE obj = ?', (obj_id,))
+            self.db.executemany(
+                'INSERT INTO grams (gram, obj) VALUES (?, ?)', [
+                    (gram, obj_id) for gram in
+                    trigrams(' '.join(filter(None, (row[2], row[3]))))
+                ]
+            )
+            written.append(pk)
+        return written
+
+    def remove_missing(self, resource, seen_pks):
+        """
+        Delete objects of resource that weren't seen in a full pass.
+        Returns their pks.
+        """
+        stored = dict(self.db.execute(
+            'SELECT pk, id FROM objects WHERE resource = ?', (resource,)
+        ))
+        gone = list(set(stored) - set(seen_pks))
+        self.db.executemany(
+            'DELETE FROM grams WHERE obj = ?', [(stored[pk],) for pk in gone]
+        )
+        self.db.executemany(
+            'DELETE FROM objects WHERE id = ?', [(stored[pk],) for pk in gone]
+        )
+        return gone
+
+    def pks(self, resource):
+        return [pk for (pk,) in self.db.execute(
+            'SELECT pk FROM objects WHERE resource = ?', (resource,)
+        )]
+
+    def max_modified(self, resource):
+        return self.db.execute(
+            'SELECT MAX(modified) FROM objects WHERE resource = ?',
+            (resource,)
+        ).fetchone()[0]
+
+    def objects(self, dtype=None):
+        """
+        Decoded objects, optionally only those of one dtype.
+        """
+        if dtype:
+            rows = self.db.execute(
+                'SELECT data FROM objects WHERE dtype = ?', (dtype,)
+            )
+        else:
+            rows = self.db.execute('SELECT data FROM objects')
+        for (data,) in rows:
+            yield json.loads(data)
+
+    # KV pairs
+
+    def store_kvs(self, dtype, obj_pk, kvs):
+        self.db.execute(
+            'DELETE FROM kvs WHERE dtype = ? AND obj_pk = ?', (dtype, obj_pk)
+        )
+        self.db.executemany(
+            'INSERT INTO kvs (dtype, obj_pk, kv_pk, key, value) '
+            'VALUES (?, ?, ?, ?, ?)', [
+                (dtype, obj_pk, kv.get('kv_pk', kv.get('pk')),
+                 kv.get('key'), kv.get('value'))
+                for kv in kvs
+            ]
+        )
+
+    def remove_kvs(self, dtype, obj_pks):
+        self.db.executemany(
+            'DELETE FROM kvs WHERE dtype = ? AND obj_pk = ?',
+            [(dtype, pk) for pk in obj_pks]
+        )
+
+    def kvs(self, dtype, obj_pk):
+        return [dict(row) for row in self.db.execute(
+            'SELECT kv_pk, key, value FROM kvs WHERE dtype = ? AND '
+            'obj_pk = ? ORDER BY key', (dtype, obj_pk)
+        )]
+
+    def counts(self):
+        """
+        {dtype: number of objects} plus KV pair counts.
+        """
+        counts = dict(self.db.execute(
+            'SELECT dtype, COUNT(*) FROM objects GROUP BY dtype'
+        ))
+        counts.update(self.db.execute(
+            'SELECT dtype, COUNT(*) FROM kvs GROUP BY dtype'
+        ))
+        return counts
+
+    def analyze(self):
+        """
+        Refresh the statistics SQLite picks indexes with, so a query like
+        '/^host (type=:A OR type=:CNAME)' uses the name index.
+        """
+        self.db.execute('ANALYZE')
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def open_mirror(path=MIRROR_PATH):
+    return Mirror(path)
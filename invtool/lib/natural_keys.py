@@ -0,0 +1,104 @@
+import atexit
+import os
+import threading
+import time
+
+from invtool.lib.config import CACHE_DIR, NATURAL_KEY_TTL, REMOTE
+from invtool.lib.lockfile import locked_json, read_json
+
+
+class NaturalKeyIndex(object):
+    """
+    Remember which pk a natural key (an fqdn, a network string, a site name)
+    resolved to so that addressing an object by name usually costs no extra
+    request at all.
+
+    The index lives in a JSON file shared by every invtool process. Changes
+    are kept as a list of operations and replayed, under the file's lock,
+    onto whatever is on disk when the index is saved, so an invalidation
+    made by one process isn't undone by another one that loaded the file
+    earlier.
+    """
+    def __init__(self, path, remote=REMOTE, ttl=NATURAL_KEY_TTL):
+        self.path = path
+        self.remote = remote
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._changes = []
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = read_json(self.path).get(self.remote, {})
+        return self._entries
+
+    def _apply(self, entries, change):
+        op, dtype, arg = change[:3]
+        keys = entries.setdefault(dtype, {})
+        if op == 'set':
+            keys[arg] = change[3]
+        elif op == 'forget':
+            keys.pop(arg, None)
+        elif op == 'forget_pk':
+            for value, (pk, stamp) in keys.items():
+                if str(pk) == str(arg):
+                    del keys[value]
+
+    def _change(self, *change):
+        with self._lock:
+            self._apply(self._load(), change)
+            self._changes.append(change)
+
+    def get(self, dtype, value):
+        with self._lock:
+            entry = self._load().get(dtype, {}).get(value)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def remember(self, dtype, value, pk):
+        self._change('set', dtype, value, [pk, time.time()])
+
+    def forget(self, dtype, value):
+        self._change('forget', dtype, value)
+
+    def forget_pk(self, dtype, pk):
+        self._change('forget_pk', dtype, pk)
+
+    def save(self):
+        with self._lock:
+            if not self._changes:
+                return
+            try:
+                with locked_json(self.path) as data:
+                    entries = data.setdefault(self.remote, {})
+                    for change in self._changes:
+                        self._apply(entries, change)
+                    now = time.time()
+                    for dtype, keys in entries.items():
+                        for value, (pk, stamp) in keys.items():
+                            if now - stamp > self.ttl:
+                                del keys[value]
+                        if not keys:
+                            del entries[dtype]
+            except (IOError, OSError):
+                pass  # It's only a cache
+            self._changes = []
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def natural_key_index():
+    """
+    The process wide NaturalKeyIndex. It is written back when invtool exits.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NaturalKeyIndex(
+                os.path.join(CACHE_DIR, 'natural_keys.json')
+            )
+            atexit.register(_index.save)
+        return _index
@@ -0,0 +1,146 @@
+"""
+Find the network (and so the vlan and site) an address is in.
+
+Networks are indexed by prefix length: one dict per length, keyed by the
+network's address shifted right past its host bits. A lookup shifts the
+address the same way for each length the index has, longest first, and
+the first hit is the longest prefix match. Inventories have a handful of
+distinct prefix lengths, so an address costs a few dict probes instead of
+walking up to 32 (or 128) levels of a bit trie in Python.
+
+An index built from Inventory's API is kept in network_index.json in the
+cache directory for NETWORK_INDEX_TTL seconds.
+"""
+import socket
+import struct
+import time
+
+from invtool.lib.config import NETWORK_INDEX_PATH, NETWORK_INDEX_TTL, REMOTE
+from invtool.lib.local_search import site_matches, vlan_matches
+from invtool.lib.lockfile import locked_json, read_json
+from invtool.lib.mirror import object_pk, ref_pk
+from invtool.lib.utilization import network_range
+
+BITS = {'4': 32, '6': 128}
+
+
+def network_entries(networks, sites, vlans):
+    """
+    {'pk', 'network', 'site', 'vlan'} of every network with a usable
+    network_str, with its site and vlan as names.
+    """
+    sites = dict((object_pk(obj), obj) for obj in sites)
+    vlans = dict((object_pk(obj), obj) for obj in vlans)
+    for network in networks:
+        site = sites.get(ref_pk(network.get('site'))) or {}
+        vlan = vlans.get(ref_pk(network.get('vlan')))
+        yield {
+            'pk': object_pk(network),
+            'network': network.get('network_str'),
+            'site': site.get('full_name') or site.get('name', ''),
+            'vlan': "{0},{1}".format(
+                vlan['name'], vlan['number']
+            ) if vlan else ''
+        }
+
+
+def match_scope(sites, vlans, site=None, vlan=None):
+    """
+    (sites, vlans) limited to the ones site=:site and vlan=:vlan mean.
+    """
+    if site:
+        sites = [obj for obj in sites if site_matches(obj, site)]
+    if vlan:
+        vlans = [obj for obj in vlans if vlan_matches(obj, vlan)]
+    return sites, vlans
+
+
+def in_scope(networks, sites, vlans, site=None, vlan=None):
+    """
+    The networks in one of the sites (with site) and one of the vlans
+    (with vlan) that match_scope() kept.
+    """
+    site_pks = set(object_pk(obj) for obj in sites)
+    vlan_pks = set(object_pk(obj) for obj in vlans)
+    return [
+        network for network in networks
+        if (not site or ref_pk(network.get('site')) in site_pks) and
+        (not vlan or ref_pk(network.get('vlan')) in vlan_pks)
+    ]
+
+
+class NetworkIndex(object):
+    def __init__(self, entries=()):
+        self.entries = []
+        # ip_type -> {prefix length: {address >> host bits: entry}}
+        self.tables = {'4': {}, '6': {}}
+        # ip_type -> [(host bits, table)], longest prefix first
+        self.levels = {'4': [], '6': []}
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        """
+        Index an entry of network_entries(). Entries whose network can't be
+        parsed are skipped; returns whether it was indexed.
+        """
+        try:
+            first, last, ip_type = network_range(entry['network'] or '')
+        except ValueError:
+            return False
+        host_bits = (last - first).bit_length()
+        tables = self.tables[ip_type]
+        prefix = BITS[ip_type] - host_bits
+        if prefix not in tables:
+            tables[prefix] = {}
+            self.levels[ip_type] = [
+                (BITS[ip_type] - p, tables[p])
+                for p in sorted(tables, reverse=True)
+            ]
+        tables[prefix][first >> host_bits] = entry
+        self.entries.append(entry)
+        return True
+
+    def lookup(self, ip):
+        """
+        The entry of the most specific network ip is in, or None. Raises
+        ValueError if ip isn't an address.
+        """
+        try:
+            if ':' in ip:
+                high, low = struct.unpack(
+                    '!QQ', socket.inet_pton(socket.AF_INET6, ip)
+                )
+                n, levels = high << 64 | low, self.levels['6']
+            else:
+                n = struct.unpack('!I', socket.inet_aton(ip))[0]
+                levels = self.levels['4']
+                if ip.count('.') != 3:
+                    # inet_aton takes '10.1' too
+                    raise socket.error
+        except (socket.error, TypeError):
+            raise ValueError("'{0}' isn't an ip address".format(ip))
+        for shift, table in levels:
+            entry = table.get(n >> shift)
+            if entry is not None:
+                return entry
+        return None
+
+
+def load_network_index(path=NETWORK_INDEX_PATH, remote=REMOTE,
+                       ttl=NETWORK_INDEX_TTL):
+    """
+    The NetworkIndex cached for remote, or None if there isn't a fresh one.
+    """
+    cached = read_json(path).get(remote)
+    if not cached or cached.get('stamp', 0) + ttl < time.time():
+        return None
+    return NetworkIndex(cached['entries'])
+
+
+def save_network_index(index, path=NETWORK_INDEX_PATH, remote=REMOTE):
+    with locked_json(path) as data:
+        data[remote] = {'stamp': time.time(), 'entries': index.entries}
@@ -3,6 +3,8 @@ from invtool.tests.test_data import TEST_DESCRIPTION, TEST_STR
 import argparse
 from datetime import datetime
 
+from invtool.lib.parser import add_concurrency_argument
+
 
 def build_extractor(field_name, nas_name):
     def extractor(nas):
@@ -29,12 +31,29 @@ def _extract_pk(nas, field_name):
     return {field_name: nas.pk}
 
 
-def update_pk_argument(field_name, rdtype):
+def _add_natural_key_argument(group, natural_key, rdtype, verb):
+    option, dest = natural_key
+    group.add_argument(
+        '--{0}'.format(option), default=None, type=str, dest=dest,
+        help="The {0} of the {1} you are {2}. It is looked up once and "
+        "remembered so later commands don't have to.".format(
+            option, rdtype, verb
+        )
+    )
+
+
+def update_pk_argument(field_name, rdtype, natural_key=None):
+    # natural_key is the (option, dest) of an update field that can identify
+    # the object when --pk isn't given.
     def add_update_pk_argument(parser, **kwargs):
+        help = ("The database integer primary key (id) of the {0} you are "
+                "updating.".format(rdtype))
+        if natural_key:
+            help += (" Leave it out to find the {0} by its --{1} "
+                     "instead.".format(rdtype, natural_key[0]))
         parser.add_argument(
-            '--pk', required=True, default=None, type=int,
-            dest='pk', help="The database integer primary key (id) of the "
-            "{0} you are updating.".format(rdtype)
+            '--pk', required=not natural_key, default=None, type=int,
+            dest='pk', help=help
         )
         return parser
 
@@ -44,13 +63,25 @@ def update_pk_argument(field_name, rdtype):
     return add_update_pk_argument, extract_pk, lambda: None
 
 
-def detail_pk_argument(field_name, rdtype):
+def detail_pk_argument(field_name, rdtype, natural_key=None):
     def add_detail_pk_argument(parser, **kwargs):
-        parser.add_argument(
-            '--pk', required=True, default=None, type=int,
+        pk_group = parser.add_mutually_exclusive_group(required=True)
+        pk_group.add_argument(
+            '--pk', default=None, type=int, action='append',
             dest='pk', help="The database integer primary key (id) of the "
-            "{0} you are getting detail about.".format(rdtype)
+            "{0} you are getting detail about. Repeat it to detail several "
+            "objects at once.".format(rdtype)
+        )
+        pk_group.add_argument(
+            '--pk-file', default=None, type=argparse.FileType('r'),
+            dest='pk_file', help="Read primary keys of {0}s to detail from a "
+            "file, one per line ('-' for stdin)".format(rdtype)
         )
+        if natural_key:
+            _add_natural_key_argument(
+                pk_group, natural_key, rdtype, 'getting detail about'
+            )
+        add_concurrency_argument(parser)
         return parser
 
     def extract_pk(nas):
@@ -59,14 +90,19 @@ def detail_pk_argument(field_name, rdtype):
     return add_detail_pk_argument, extract_pk, lambda: None
 
 
-def delete_pk_argument(field_name, rdtype):
+def delete_pk_argument(field_name, rdtype, natural_key=None):
     # Required has no affect.
     def add_delete_pk_argument(parser, **kwargs):
-        parser.add_argument(
+        pk_group = parser.add_mutually_exclusive_group(required=True)
+        pk_group.add_argument(
             '--pk', default=None, type=int, dest='pk',
             help="Delete the {0} record with the database primary key of "
-            "'pk'".format(rdtype), required=True
+            "'pk'".format(rdtype)
         )
+        if natural_key:
+            _add_natural_key_argument(
+                pk_group, natural_key, rdtype, 'deleting'
+            )
         return parser
 
     def extract_pk(nas):
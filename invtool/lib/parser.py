@@ -1,3 +1,6 @@
+from invtool.lib.concurrency import DEFAULT_CONCURRENCY
+
+
 def build_create_parser(dispatch, action_parser, help=''):
     if not help:
         help = "Create a(n) {0} record".format(dispatch.dtype)
@@ -12,6 +15,15 @@ def build_update_parser(dispatch, action_parser, help=''):
     update_parser = action_parser.add_parser('update', help=help)
     for add_arg, extract_arg, test_method in dispatch.update_args:
         add_arg(update_parser, required=False)
+    return update_parser
+
+
+def add_skip_unchanged_argument(parser):
+    parser.add_argument(
+        '--skip-unchanged', default=False, action='store_true',
+        dest='skip_unchanged', help="Fetch the object first and only send "
+        "the fields that would change it (nothing at all if none would)"
+    )
 
 
 def build_delete_parser(dispatch, action_parser, help=''):
@@ -28,3 +40,99 @@ def build_detail_parser(dispatch, action_parser, help=''):
     detail_parser = action_parser.add_parser('detail', help=help)
     for add_arg, extract_arg, test_method in dispatch.detail_args:
         add_arg(detail_parser)
+
+
+def build_upsert_parser(dispatch, action_parser, help=''):
+    if not help:
+        help = ("Create a(n) {0}, or if one with the same {1} already exists "
+                "update only the fields that differ".format(
+                    dispatch.dtype, '/'.join(dispatch.upsert_key)
+                ))
+    upsert_parser = action_parser.add_parser('upsert', help=help)
+    for add_arg, extract_arg, test_method in dispatch.create_args:
+        add_arg(upsert_parser)
+
+
+def add_concurrency_argument(parser):
+    parser.add_argument(
+        '--concurrency', '-j', type=int, default=DEFAULT_CONCURRENCY,
+        dest='concurrency', help="How many requests to have in flight at "
+        "once (default {0})".format(DEFAULT_CONCURRENCY)
+    )
+
+
+def build_bulk_create_parser(dispatch, action_parser, help=''):
+    if not help:
+        help = ("Create many {0} records from NDJSON or CSV read from stdin. "
+                "Field names are the options of '{0} create' without the "
+                "leading '--'".format(dispatch.dtype))
+    bulk_parser = action_parser.add_parser('bulk-create', help=help)
+    add_concurrency_argument(bulk_parser)
+    bulk_parser.add_argument(
+        '--chunk-size', type=int, default=50, dest='chunk_size',
+        help="How many objects to send in one bulk PATCH (default 50)"
+    )
+    bulk_parser.add_argument(
+        '--no-patch', default=False, action='store_true', dest='no_patch',
+        help="Don't use the bulk PATCH endpoint; POST every object on its "
+        "own. A failed chunk is reported against every row in it, so use "
+        "this if you need exact per-row errors."
+    )
+
+
+def build_bulk_delete_parser(dispatch, action_parser, help=''):
+    if not help:
+        help = ("Delete many objects. Reads '<dtype> <pk>' (or just '<pk>' "
+                "for a(n) {0}) lines from stdin".format(dispatch.dtype))
+    bulk_parser = action_parser.add_parser('bulk-delete', help=help)
+    add_concurrency_argument(bulk_parser)
+    bulk_parser.add_argument(
+        '--verify', default=False, action='store_true', dest='verify',
+        help="Look every object up again after deleting it and make sure "
+        "it is really gone (expects a 404)"
+    )
+
+
+def build_bulk_update_parser(dispatch, action_parser, help=''):
+    if not help:
+        help = ("Update many {0}s from NDJSON or CSV read from stdin. Field "
+                "names are the options of '{0} update'; rows for the same "
+                "object are merged into one request".format(dispatch.dtype))
+    bulk_parser = action_parser.add_parser('bulk-update', help=help)
+    add_concurrency_argument(bulk_parser)
+    bulk_parser.add_argument(
+        '--no-skip-unchanged', default=True, action='store_false',
+        dest='skip_unchanged', help="PATCH every object with every field "
+        "given instead of fetching the objects first and only sending what "
+        "changed"
+    )
+
+
+def build_lookup_parser(dispatch, action_parser, help=''):
+    if not help:
+        help = ("Find the network, vlan and site of addresses. Reads one "
+                "address per line from stdin unless --ip is given")
+    lookup_parser = action_parser.add_parser('lookup', help=help)
+    lookup_parser.add_argument(
+        '--ip', dest='ips', default=[], action='append',
+        help="An address to look up. Can be given many times"
+    )
+    lookup_parser.add_argument(
+        '--local', dest='local', default=False, action='store_true',
+        help="Build the network index from the local mirror (see `invtool "
+        "mirror sync`) instead of asking Inventory"
+    )
+    lookup_parser.add_argument(
+        '--refresh', dest='refresh', default=False, action='store_true',
+        help="Rebuild the cached network index from Inventory first"
+    )
+    lookup_parser.add_argument(
+        '--site', dest='site', default=None, help="Only look in the networks "
+        "of this site (name or full name). Only those networks are fetched "
+        "and the index isn't cached"
+    )
+    lookup_parser.add_argument(
+        '--vlan', dest='vlan', default=None, help="Only look in the networks "
+        "of this vlan: a name, a number or '<name>,<number>'"
+    )
+    add_concurrency_argument(lookup_parser)
@@ -0,0 +1,98 @@
+"""
+A short lived cache of the free ranges Inventory reports for vlans and
+ranges.
+
+Making a CSV asks Inventory for the free space of the same vlans run after
+run. Answers are kept in a JSON file in the cache directory for
+POOL_CACHE_TTL seconds. An address handed out through the reservation
+ledger is never offered twice whatever the cache says, and once addresses
+are saved in Inventory (a Reservation commits, ba_import commits) the
+pools holding them are dropped so the next run asks again.
+"""
+import time
+
+from invtool.lib.allocator import ip_to_int
+from invtool.lib.config import POOL_CACHE_PATH, POOL_CACHE_TTL, REMOTE
+from invtool.lib.lockfile import locked_json, read_json
+
+
+def vlan_pool_key(site, vlan_name, vlan_number, ip_type='4'):
+    return 'vlan:{0}:{1}:{2}:{3}'.format(
+        site, vlan_name or '', vlan_number or '', ip_type
+    )
+
+
+def range_pool_key(ip_range):
+    return 'range:{0}'.format(ip_range.replace(' ', ''))
+
+
+def as_integer(ip):
+    return ip if isinstance(ip, (int, long)) else ip_to_int(ip)
+
+
+def as_integers(free_ranges):
+    return [[as_integer(a), as_integer(b)] for a, b in free_ranges]
+
+
+class PoolCache(object):
+    """
+    {key: free ranges} per server, shared by every invtool process. A ttl
+    of 0 turns the cache off.
+    """
+    def __init__(self, path=POOL_CACHE_PATH, remote=REMOTE,
+                 ttl=POOL_CACHE_TTL):
+        self.path = path
+        self.remote = remote
+        self.ttl = ttl
+
+    def get(self, key):
+        """
+        The free ranges cached under key, or None.
+        """
+        if self.ttl <= 0:
+            return None
+        entry = read_json(self.path).get(self.remote, {}).get(key)
+        if not entry or entry.get('stamp', 0) + self.ttl < time.time():
+            return None
+        return entry['free_ranges']
+
+    def put(self, key, free_ranges):
+        if self.ttl <= 0:
+            return
+        with locked_json(self.path) as data:
+            pools = data.setdefault(self.remote, {})
+            now = time.time()
+            for old_key, entry in pools.items():
+                if entry.get('stamp', 0) + self.ttl < now:
+                    del pools[old_key]
+            pools[key] = {
+                'free_ranges': as_integers(free_ranges), 'stamp': now
+            }
+
+    def invalidate(self, ips=None):
+        """
+        Drop the pools that have one of ips free, or every pool.
+        """
+        if ips is not None:
+            ips = [as_integer(ip) for ip in ips]
+            if not ips:
+                return
+        if not read_json(self.path).get(self.remote):
+            return
+        with locked_json(self.path) as data:
+            pools = data.setdefault(self.remote, {})
+            for key, entry in pools.items():
+                if ips is None or any(
+                        a <= n <= b for a, b in entry['free_ranges']
+                        for n in ips):
+                    del pools[key]
+
+
+_cache = None
+
+
+def pool_cache():
+    global _cache
+    if _cache is None:
+        _cache = PoolCache()
+    return _cache
@@ -0,0 +1,311 @@
+"""
+Compact, typed records for the objects invtool knows about.
+
+Large result sets (search results, KV lists, ba_export blobs) are full of
+the same strings over and over: domain suffixes, view names, KV key
+prefixes like ``nic.0.``. Records use ``__slots__`` instead of a per object
+``__dict__`` and the strings decoded for them are interned so each distinct
+value is stored once. The intern table only lives for one decode; nothing
+is kept between calls.
+"""
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# Only intern strings up to this length. Long strings (notes, descriptions)
+# are rarely repeated and would just bloat the table.
+INTERN_MAX_LEN = 128
+
+
+def intern_value(value, table):
+    """
+    Return the copy of value in table if it is a (short) string, adding it
+    if needed. Lists become tuples of interned values. Works on unicode,
+    which the builtin intern() doesn't.
+    """
+    if isinstance(value, basestring):
+        if len(value) <= INTERN_MAX_LEN:
+            return table.setdefault(value, value)
+        return value
+    if isinstance(value, (list, tuple)):
+        value = tuple(intern_value(v, table) for v in value)
+        try:
+            return table.setdefault(value, value)
+        except TypeError:  # Not hashable (e.g. a list of dicts)
+            return value
+    return value
+
+
+def intern_pairs(table):
+    """
+    An object_pairs_hook that interns keys and (short) string values in
+    table.
+    """
+    setdefault = table.setdefault
+
+    def hook(pairs):
+        # Called by the decoder for every JSON object, so keep it tight
+        obj = {}
+        for key, value in pairs:
+            if isinstance(value, basestring):
+                if len(value) <= INTERN_MAX_LEN:
+                    value = setdefault(value, value)
+            elif isinstance(value, list):
+                # Keep JSON's shape: lists stay lists, only their strings
+                # are shared
+                value = [
+                    setdefault(v, v) if isinstance(v, basestring) and
+                    len(v) <= INTERN_MAX_LEN else v for v in value
+                ]
+            obj[setdefault(key, key)] = value
+        return obj
+    return hook
+
+
+def loads(raw, object_hook=None, table=None):
+    """
+    Decode JSON, interning every (short) string as it is decoded. The result
+    has the same shape as json.loads() would give you unless object_hook
+    turns some objects into something else. Strings are shared through
+    table, a new one for this call unless given.
+    """
+    pairs_hook = intern_pairs({} if table is None else table)
+    if object_hook is None:
+        return json.loads(raw, object_pairs_hook=pairs_hook)
+    return json.loads(
+        raw, object_pairs_hook=lambda pairs: object_hook(pairs_hook(pairs))
+    )
+
+
+class Record(object):
+    """
+    Base class for records. Subclasses list the fields they know about in
+    ``__slots__``; anything else the server sends ends up in ``extra``.
+    """
+    __slots__ = ('extra',)
+    dtypes = ()
+
+    def __init__(self, _table=None, **kwargs):
+        table = {} if _table is None else _table
+        extra = None
+        for name in self.all_fields():
+            setattr(self, name, intern_value(kwargs.pop(name, None), table))
+        if kwargs:
+            extra = dict(
+                (intern_value(k, table), intern_value(v, table))
+                for k, v in kwargs.iteritems()
+            )
+        self.extra = extra
+
+    @classmethod
+    def all_fields(cls):
+        fields = cls.__dict__.get('_all_fields')
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                fields += [
+                    f for f in klass.__dict__.get('__slots__', ())
+                    if f != 'extra'
+                ]
+            cls._all_fields = fields = tuple(fields)
+        return fields
+
+    @classmethod
+    def from_dict(cls, data, table=None):
+        """
+        A record of a decoded object. Records built with the same table
+        share their strings.
+        """
+        return cls(_table=table, **dict(
+            (str(k), v) for k, v in data.iteritems()
+        ))
+
+    def as_dict(self):
+        ret = dict(self.extra or {})
+        for name in self.all_fields():
+            value = getattr(self, name)
+            if value is not None:
+                ret[name] = value
+        for name, value in ret.iteritems():
+            if isinstance(value, tuple):
+                ret[name] = list(value)
+        return ret
+
+    # Enough of the dict interface for code that used to get plain dicts.
+    def __getitem__(self, key):
+        if key in self.all_fields():
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.pk)
+
+
+class DNSRecord(Record):
+    __slots__ = (
+        'pk', 'fqdn', 'label', 'domain', 'ttl', 'views', 'description',
+        'resource_uri'
+    )
+
+
+class AddressRecord(DNSRecord):
+    __slots__ = ('ip_str', 'ip_type')
+    dtypes = ('A', 'AAAA')
+
+
+class PTRRecord(Record):
+    __slots__ = (
+        'pk', 'name', 'ip_str', 'ip_type', 'ttl', 'views', 'description',
+        'resource_uri'
+    )
+    dtypes = ('PTR',)
+
+
+class CNAMERecord(DNSRecord):
+    __slots__ = ('target',)
+    dtypes = ('CNAME',)
+
+
+class MXRecord(DNSRecord):
+    __slots__ = ('server', 'priority')
+    dtypes = ('MX',)
+
+
+class SRVRecord(DNSRecord):
+    __slots__ = ('target', 'port', 'weight', 'priority')
+    dtypes = ('SRV',)
+
+
+class TXTRecord(DNSRecord):
+    __slots__ = ('txt_data',)
+    dtypes = ('TXT',)
+
+
+class SystemRecord(Record):
+    __slots__ = (
+        'pk', 'hostname', 'serial', 'asset_tag', 'oob_ip', 'notes',
+        'rack_order', 'switch_ports', 'patch_panel_port', 'oob_switch_port',
+        'purchase_date', 'purchase_price', 'change_password',
+        'warranty_start', 'warranty_end', 'operating_system', 'server_model',
+        'allocation', 'system_rack', 'system_type', 'system_status',
+        'staticreg_set', 'keyvalue_set', 'created', 'modified',
+        'resource_uri'
+    )
+    dtypes = ('SYS',)
+
+
+class NetworkRecord(Record):
+    __slots__ = (
+        'pk', 'network_str', 'ip_type', 'site', 'vlan', 'description',
+        'resource_uri'
+    )
+    dtypes = ('NET',)
+
+
+class SiteRecord(Record):
+    __slots__ = ('pk', 'name', 'full_name', 'description', 'resource_uri')
+    dtypes = ('SITE',)
+
+
+class VlanRecord(Record):
+    __slots__ = ('pk', 'name', 'number', 'description', 'resource_uri')
+    dtypes = ('VLAN',)
+
+
+class KVRecord(Record):
+    __slots__ = ('pk', 'key', 'value')
+    dtypes = ('KV',)
+
+    @classmethod
+    def from_dict(cls, data, table=None):
+        # The KV api calls the primary key kv_pk
+        data = dict(data)
+        if 'kv_pk' in data:
+            data['pk'] = data.pop('kv_pk')
+        return super(KVRecord, cls).from_dict(data, table)
+
+
+RECORD_CLASSES = {}
+for _klass in (AddressRecord, PTRRecord, CNAMERecord, MXRecord, SRVRecord,
+               TXTRecord, SystemRecord, NetworkRecord, SiteRecord, VlanRecord,
+               KVRecord):
+    for _dtype in _klass.dtypes:
+        RECORD_CLASSES[_dtype] = _klass
+
+
+def record_class(dtype):
+    """
+    The record class for a dtype ('A', 'SYS', 'NET_kv', ...).
+    """
+    if dtype.endswith('_kv'):
+        return KVRecord
+    return RECORD_CLASSES[dtype.upper()]
+
+
+def to_records(dtype, objects, table=None):
+    klass = record_class(dtype)
+    table = {} if table is None else table
+    return [klass.from_dict(obj, table) for obj in objects]
+
+
+def loads_records(dtype, raw):
+    """
+    Decode a tastypie list response (``{"objects": [...]}``), a KV list
+    (``{"kvs": [...]}``) or a single object straight into records.
+    """
+    table = {}
+    data = loads(raw, table=table)
+    if isinstance(data, dict) and 'objects' in data:
+        return to_records(dtype, data['objects'], table)
+    if isinstance(data, dict) and 'kvs' in data:
+        return to_records(dtype, data['kvs'], table)
+    return to_records(dtype, [data], table)
+
+
+def loads_export(raw, as_records=False):
+    """
+    Decode a ba_export blob. By default this is plain json.loads(); with
+    as_records strings are interned and the systems become SystemRecords
+    as soon as they are decoded, so the whole export never exists as dicts.
+    """
+    if not as_records:
+        return json.loads(raw)
+    table = {}
+
+    def system_hook(obj):
+        if 'hostname' in obj and 'staticreg_set' in obj:
+            return SystemRecord.from_dict(obj, table)
+        return obj
+    return loads(raw, object_hook=system_hook, table=table)
+
+
+def snapshot_export(blob):
+    """
+    A copy of a decoded ba_export blob to compare edits against, e.g. with
+    invtool.lib.ba.ba_diff. Nothing is shared with blob, the systems are
+    SystemRecords and all their strings are interned, so it takes far less
+    memory than a deepcopy.
+    """
+    return loads_export(json.dumps(blob), as_records=True)
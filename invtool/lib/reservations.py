@@ -0,0 +1,171 @@
+"""
+A ledger of free addresses that runs have handed out but that Inventory
+doesn't know are used yet.
+
+Free ranges are a snapshot: two people running scripts/ba_import_csv with
+{{ FREE_IP }} against the same vlan would both be given its lowest free
+address. Addresses allocated through a Reservation are written to a JSON
+file under an exclusive fcntl lock, and every allocation skips addresses
+held by another run. A run releases what it holds when it commits or
+fails; anything left behind expires after RESERVATION_TTL seconds.
+"""
+import contextlib
+import os
+import socket
+import time
+import uuid
+from collections import deque
+
+from invtool.lib.allocator import PoolExhausted, ip_type_of
+from invtool.lib.config import REMOTE, RESERVATION_PATH, RESERVATION_TTL
+from invtool.lib.lockfile import locked_json
+from invtool.lib.pools import pool_cache
+
+
+class ReservationLedger(object):
+    """
+    The reservations file. It is only read and written while its lock file
+    is held, so any number of processes can use it at once.
+    """
+    def __init__(self, path=RESERVATION_PATH, remote=REMOTE,
+                 ttl=RESERVATION_TTL):
+        self.path = path
+        self.remote = remote
+        self.ttl = ttl
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Hold the lock and yield {ip: entry} of the live reservations on this
+        server. Changes made to it are saved when the block ends without an
+        exception.
+        """
+        with locked_json(self.path) as data:
+            entries = data.setdefault(self.remote, {})
+            now = time.time()
+            for ip, entry in entries.items():
+                if entry.get('expires', 0) < now:
+                    del entries[ip]
+            yield entries
+
+    def held(self):
+        """
+        {ip: entry} of every live reservation.
+        """
+        with self.locked() as entries:
+            return dict(entries)
+
+    def reservation(self, label=None):
+        return Reservation(self, label)
+
+
+class Reservation(object):
+    """
+    The addresses one run holds. Use it as a context manager to have them
+    released if the run fails.
+    """
+    def __init__(self, ledger, label=None):
+        self.ledger = ledger
+        self.label = label
+        self.token = '{0}:{1}:{2}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self.ips = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.release()
+
+    def allocate(self, allocator, count=1, block=False):
+        """
+        allocator.allocate(count) (or allocate_block) with every address
+        another run holds taken out first. The addresses are held until
+        this reservation is released or they expire.
+        """
+        with self.ledger.locked() as entries:
+            for ip, entry in entries.iteritems():
+                if (entry.get('owner') != self.token and
+                        ip_type_of(ip) == allocator.ip_type):
+                    allocator.take(ip)
+            if block:
+                ips = allocator.allocate_block(count)
+            else:
+                ips = allocator.allocate(count)
+            entry = {
+                'owner': self.token, 'label': self.label,
+                'expires': time.time() + self.ledger.ttl
+            }
+            for ip in ips:
+                entries[ip] = entry
+        self.ips.update(ips)
+        return ips
+
+    def release(self):
+        """
+        Give back every address this run holds.
+        """
+        if not self.ips:
+            return
+        with self.ledger.locked() as entries:
+            for ip in self.ips:
+                if entries.get(ip, {}).get('owner') == self.token:
+                    del entries[ip]
+        self.ips = set()
+
+    def commit(self):
+        """
+        The addresses were saved in Inventory, which reports them as used
+        from now on; the ledger doesn't need to hold them anymore. Cached
+        pools that still have them free are dropped.
+        """
+        if self.ips:
+            pool_cache().invalidate(self.ips)
+        self.release()
+
+
+class ReservedPool(object):
+    """
+    An IPAllocator whose addresses are reserved as they are handed out, so
+    other runs using the ledger never get the same ones. It can be used
+    wherever the allocator's next() was.
+    """
+    def __init__(self, allocator, reservation):
+        self.allocator = allocator
+        self.reservation = reservation
+        self._ready = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def prefetch(self, count):
+        """
+        Reserve count addresses with one trip to the ledger instead of one
+        per next(). Does nothing if there aren't that many left.
+        """
+        try:
+            self._ready.extend(
+                self.reservation.allocate(self.allocator, count)
+            )
+        except PoolExhausted:
+            pass
+
+    def next(self):
+        if self._ready:
+            return self._ready.popleft()
+        return self.reservation.allocate(self.allocator, 1)[0]
+
+
+_ledger = None
+
+
+def reservation_ledger():
+    global _ledger
+    if _ledger is None:
+        _ledger = ReservationLedger()
+    return _ledger
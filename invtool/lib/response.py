@@ -0,0 +1,85 @@
+import re
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.records import loads_records
+
+# A "pk" key. Only trusted when it occurs exactly once in a document with
+# no nested objects, so it must be the top level one; anything more
+# complicated is decoded properly.
+PK_RE = re.compile(r'"pk"\s*:\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+
+NO_MESSAGE = 'No message from server'
+
+
+class RawJSON(object):
+    """
+    A JSON document returned by Inventory, kept as the bytes we received.
+    It is only decoded when something actually looks inside it, so
+    ``--json`` can hand the server's own bytes to stdout and ``--pk-only``
+    can pull out the pk without building the whole document.
+    """
+    def __init__(self, raw, http_status=None):
+        self.raw = raw or ''
+        self.http_status = http_status
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.raw.strip():
+                # Tasty pie returns json that is unicode. Thats ok.
+                self._data = json.loads(self.raw, 'unicode')
+            else:
+                self._data = {'message': NO_MESSAGE}
+            if self.http_status is not None and isinstance(self._data, dict):
+                self._data['http_status'] = self.http_status
+        return self._data
+
+    def records(self, dtype):
+        """
+        Decode straight into compact records (see invtool.lib.records)
+        without building the intermediate dicts for the whole response.
+        """
+        return loads_records(dtype, self.raw)
+
+    def has_key(self, key):
+        """
+        Check for a top level key. If the key's name doesn't appear anywhere
+        in the raw bytes we know the answer without decoding.
+        """
+        if self._data is None and '"{0}"'.format(key) not in self.raw:
+            return False
+        return isinstance(self.data, dict) and key in self.data
+
+    def is_empty(self):
+        return self.raw.strip() in ('', '{}', '[]')
+
+    def pk(self):
+        if self._data is None:
+            matches = PK_RE.findall(self.raw)
+            if not matches:
+                return None
+            if len(matches) == 1 and self.raw.count('{') == 1:
+                return json.loads(matches[0])
+        return self.data.get('pk') if isinstance(self.data, dict) else None
+
+    def __str__(self):
+        raw = self.raw.strip()
+        if raw and not raw.startswith('{'):
+            # Not a JSON object (an html error page, plain text, a list);
+            # there is nowhere to put http_status
+            return raw
+        if self._data is not None or not raw:
+            return json.dumps(self.data, indent=2)
+        if self.http_status is None:
+            return raw
+        # Splice http_status into the server's bytes instead of decoding
+        # and re-encoding the whole document.
+        body = raw[1:].lstrip()
+        return '{{"http_status": {0}{1}{2}'.format(
+            self.http_status, '' if body.startswith('}') else ', ', body
+        )
@@ -0,0 +1,196 @@
+"""
+Turn the text Inventory's search sends back into records.
+
+``search_dns_text`` answers with zone file style lines::
+
+    <pk> <fqdn>. <ttl> IN <type> <rdata>
+    <hostname> <oob_ip> INV SYS <asset_tag> <serial>
+
+Scripts used to pick these apart with awk column positions. The parser
+here does it once, lazily, so a large response is never held as more than
+the text itself plus the hit being looked at.
+"""
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+FIELDS = ('pk', 'type', 'fqdn', 'ttl', 'target', 'ip', 'views', 'rdata')
+
+# Share one copy of each record type name between hits
+_types = {}
+
+
+class SearchHit(object):
+    """
+    One object from a search. ``target`` is the name a CNAME, MX, SRV or PTR
+    points at and ``ip`` is the address of an A/AAAA record, a PTR's
+    reverse name or a system's oob ip. The text format doesn't say which
+    views a record is in, so ``views`` is only set by callers that know.
+    Systems have no pk in the text; their hostname is used as the key.
+    """
+    __slots__ = FIELDS + ('line',)
+
+    def __init__(self, pk, type, fqdn, ttl=None, target=None, ip=None,
+                 views=None, rdata=None, line=None):
+        self.pk = pk
+        self.type = type
+        self.fqdn = fqdn
+        self.ttl = ttl
+        self.target = target
+        self.ip = ip
+        self.views = views
+        self.rdata = rdata
+        self.line = line
+
+    def key(self):
+        """
+        What identifies the object: (type, pk), or (type, hostname) for a
+        system.
+        """
+        return self.type, self.pk if self.pk is not None else self.fqdn
+
+    def as_dict(self):
+        return {
+            'pk': self.pk, 'type': self.type, 'fqdn': self.fqdn,
+            'ttl': self.ttl, 'target': self.target, 'ip': self.ip,
+            'views': self.views, 'rdata': self.rdata
+        }
+
+    def as_json(self, **extra):
+        data = self.as_dict()
+        data.update(extra)
+        return json.dumps(data)
+
+    def as_tsv(self):
+        return '\t'.join([
+            _tsv_value(self.pk), self.type, self.fqdn, _tsv_value(self.ttl),
+            _tsv_value(self.target), _tsv_value(self.ip),
+            _tsv_value(self.views), _tsv_value(self.rdata)
+        ])
+
+    def __repr__(self):
+        return '<SearchHit {0} {1} {2}>'.format(self.type, self.pk, self.fqdn)
+
+
+def _tsv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, basestring):
+        return value.replace('\t', ' ') if '\t' in value else value
+    if isinstance(value, (list, tuple)):
+        return ','.join(value)
+    return str(value)
+
+
+def tsv_header():
+    return '#' + '\t'.join(FIELDS)
+
+
+def reverse_name_to_ip(name):
+    """
+    '4.3.2.10.in-addr.arpa' -> '10.2.3.4'. ip6.arpa names give the full,
+    uncompressed IPv6 address. Anything else is returned as is.
+    """
+    name = name.rstrip('.').lower()
+    if name.endswith('.in-addr.arpa'):
+        return '.'.join(reversed(name[:-len('.in-addr.arpa')].split('.')))
+    if name.endswith('.ip6.arpa'):
+        nibbles = ''.join(reversed(name[:-len('.ip6.arpa')].split('.')))
+        return ':'.join(nibbles[i:i + 4] for i in range(0, len(nibbles), 4))
+    return name
+
+
+def parse_line(line):
+    """
+    Parse one line of search output. Returns None for blank lines, comments
+    and anything that doesn't look like a record.
+    """
+    tokens = line.split(None, 5)
+    if len(tokens) < 4 or tokens[0].startswith((';', '#')):
+        return None
+    if tokens[2] == 'INV':  # A system
+        rdtype = _types.setdefault(tokens[3], tokens[3])
+        return SearchHit(
+            None, rdtype, tokens[0], ip=tokens[1] or None,
+            rdata=' '.join(tokens[4:]) or None, line=line.rstrip('\r\n')
+        )
+    if len(tokens) < 5 or tokens[3] != 'IN':
+        return None
+    pk, name, ttl, _, rdtype = tokens[:5]
+    rdata = tokens[5].strip() if len(tokens) > 5 else ''
+    rdtype = _types.setdefault(rdtype, rdtype)
+    hit = SearchHit(
+        int(pk) if pk.isdigit() else pk, rdtype, name.rstrip('.'),
+        ttl=int(ttl) if ttl.isdigit() else None, rdata=rdata,
+        line=line.rstrip('\r\n')
+    )
+    if rdtype in ('A', 'AAAA'):
+        hit.ip = rdata
+    elif rdtype == 'PTR':
+        hit.ip = reverse_name_to_ip(name)
+        hit.target = rdata.rstrip('.')
+    elif rdtype == 'CNAME':
+        hit.target = rdata.rstrip('.')
+    elif rdtype in ('MX', 'SRV'):
+        # MX: <priority> <server>, SRV: <priority> <weight> <port> <target>
+        hit.target = rdata.rsplit(None, 1)[-1].rstrip('.') if rdata else None
+    return hit
+
+
+def iter_lines(text):
+    """
+    Lines of text without building a list of them first.
+    """
+    start = 0
+    end = text.find('\n')
+    while end != -1:
+        yield text[start:end]
+        start = end + 1
+        end = text.find('\n', start)
+    if start < len(text):
+        yield text[start:]
+
+
+def iter_hits(text):
+    """
+    Yield a SearchHit for every record in a search response. text may be the
+    whole text_response or any iterable of lines (a file, stdin).
+    """
+    lines = iter_lines(text) if isinstance(text, basestring) else text
+    for line in lines:
+        hit = parse_line(line)
+        if hit is not None:
+            yield hit
+
+
+def parse_ndjson_hit(line):
+    """
+    Read back a line of `search --format ndjson` output.
+    """
+    data = json.loads(line)
+    return SearchHit(**dict(
+        (str(k), v) for k, v in data.iteritems() if k in FIELDS
+    ))
+
+
+def parse_output_line(line):
+    """
+    Parse a line of search output in any format `invtool search` prints:
+    text, ndjson or tsv. Returns None if the line isn't a search result.
+    """
+    line = line.strip(' \r\n')
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        try:
+            return parse_ndjson_hit(line)
+        except (TypeError, ValueError):
+            return None
+    fields = line.split('\t')
+    if len(fields) >= len(FIELDS):  # tsv, maybe with a query column
+        pk, rdtype, fqdn = fields[:3]
+        return SearchHit(
+            int(pk) if pk.isdigit() else (pk or None), rdtype, fqdn
+        )
+    return parse_line(line)
@@ -0,0 +1,239 @@
+"""
+Work out which addresses of a range are used, locally.
+
+``search --range`` asks Inventory's usage_text endpoint about one range at a
+time. Here the used addresses come from the mirror instead: those of A,
+AAAA and PTR records and, when the SREG dispatch is enabled and so
+mirrored, static registrations, the objects Inventory counts. They are
+marked in a bitmap per range, which is counted and scanned with C level
+string operations. IPv6 ranges too large for a bitmap are kept as a sorted
+list of the used addresses.
+"""
+import bisect
+import re
+
+from invtool.lib.allocator import int_to_ip, ip_to_int, ip_type_of
+from invtool.lib.mirror import network_keys
+
+# The objects whose addresses count as used
+USED_DTYPES = ('A', 'AAAA', 'PTR', 'SREG')
+
+# Ranges with more addresses than this (2 MB of bits) are kept sparse
+MAX_BITMAP_ADDRESSES = 1 << 24
+
+_used_bytes = re.compile(r'[^\x00]+')
+
+
+def popcount(buf):
+    """
+    The number of set bits in buf.
+    """
+    if not buf:
+        return 0
+    return bin(int(str(buf).encode('hex'), 16)).count('1')
+
+
+class UsageBitmap(object):
+    """
+    One bit per address of [first, last]; a set bit is a used address.
+    """
+    def __init__(self, first, last, used=(), ip_type='4'):
+        self.first = first
+        self.last = last
+        self.ip_type = ip_type
+        self.bits = bytearray((last - first) / 8 + 1)
+        for n in used:
+            self.mark(n)
+
+    def mark(self, n):
+        if self.first <= n <= self.last:
+            k = n - self.first
+            self.bits[k >> 3] |= 1 << (k & 7)
+
+    def __contains__(self, n):
+        if not self.first <= n <= self.last:
+            return False
+        k = n - self.first
+        return bool(self.bits[k >> 3] & (1 << (k & 7)))
+
+    def _clip(self, first, last):
+        first = self.first if first is None else max(first, self.first)
+        last = self.last if last is None else min(last, self.last)
+        return first - self.first, last - self.first
+
+    def used(self, first=None, last=None):
+        """
+        How many addresses of [first, last] are used.
+        """
+        lo, hi = self._clip(first, last)
+        if lo > hi:
+            return 0
+        lo_byte, hi_byte = lo >> 3, hi >> 3
+        if lo_byte == hi_byte:
+            mask = ((1 << ((hi & 7) + 1)) - 1) & ~((1 << (lo & 7)) - 1)
+            return popcount(chr(self.bits[lo_byte] & mask))
+        head = self.bits[lo_byte] & (0xff << (lo & 7)) & 0xff
+        tail = self.bits[hi_byte] & ((1 << ((hi & 7) + 1)) - 1)
+        return (popcount(chr(head) + chr(tail)) +
+                popcount(self.bits[lo_byte + 1:hi_byte]))
+
+    def used_addresses(self, first=None, last=None):
+        """
+        Yield the used addresses of [first, last] as integers. Runs of
+        unused bytes are skipped by the regex engine, not in Python.
+        """
+        lo, hi = self._clip(first, last)
+        if lo > hi:
+            return
+        for match in _used_bytes.finditer(self.bits, lo >> 3,
+                                          (hi >> 3) + 1):
+            for i in xrange(match.start(), match.end()):
+                byte = self.bits[i]
+                for bit in xrange(8):
+                    k = (i << 3) | bit
+                    if byte & (1 << bit) and lo <= k <= hi:
+                        yield self.first + k
+
+
+class SparseUsage(object):
+    """
+    The used addresses of [first, last] as a sorted list, for ranges too
+    big for a bitmap.
+    """
+    def __init__(self, first, last, used=(), ip_type='6'):
+        self.first = first
+        self.last = last
+        self.ip_type = ip_type
+        self.addresses = sorted(set(n for n in used if first <= n <= last))
+
+    def mark(self, n):
+        if self.first <= n <= self.last and n not in self:
+            bisect.insort(self.addresses, n)
+
+    def __contains__(self, n):
+        i = bisect.bisect_left(self.addresses, n)
+        return i < len(self.addresses) and self.addresses[i] == n
+
+    def _slice(self, first, last):
+        first = self.first if first is None else first
+        last = self.last if last is None else last
+        return (bisect.bisect_left(self.addresses, first),
+                bisect.bisect_right(self.addresses, last))
+
+    def used(self, first=None, last=None):
+        lo, hi = self._slice(first, last)
+        return hi - lo
+
+    def used_addresses(self, first=None, last=None):
+        lo, hi = self._slice(first, last)
+        return iter(self.addresses[lo:hi])
+
+
+def usage_map(first, last, used=(), ip_type='4'):
+    """
+    A UsageBitmap of [first, last], or a SparseUsage if the range is too
+    big for one.
+    """
+    if last - first + 1 > MAX_BITMAP_ADDRESSES:
+        return SparseUsage(first, last, used, ip_type)
+    return UsageBitmap(first, last, used, ip_type)
+
+
+def usage(umap, first=None, last=None, integers=False):
+    """
+    The usage of [first, last] in umap, shaped like Inventory's usage_text
+    answer: {'used': .., 'unused': .., 'free_ranges': [[start, end], ..]}.
+    """
+    first = umap.first if first is None else max(first, umap.first)
+    last = umap.last if last is None else min(last, umap.last)
+    free_ranges = []
+    start = first
+    for n in umap.used_addresses(first, last):
+        if n > start:
+            free_ranges.append([start, n - 1])
+        start = n + 1
+    if start <= last:
+        free_ranges.append([start, last])
+    used = umap.used(first, last)
+    if not integers:
+        free_ranges = [
+            [int_to_ip(a, umap.ip_type), int_to_ip(b, umap.ip_type)]
+            for a, b in free_ranges
+        ]
+    return {
+        'used': used, 'unused': last - first + 1 - used,
+        'free_ranges': free_ranges
+    }
+
+
+def network_range(network_str):
+    """
+    (first, last, ip_type) of a network like '10.0.0.0/24', as integers.
+    """
+    first_key, last_key = network_keys(network_str)
+    return int(first_key[1:], 16), int(last_key[1:], 16), first_key[0]
+
+
+def largest_free_block(free_ranges):
+    """
+    The size of the biggest of a list of integer free_ranges.
+    """
+    return max([b - a + 1 for a, b in free_ranges] or [0])
+
+
+class Utilization(object):
+    """
+    Range usage answered from the mirror. Each range's used addresses are
+    read with one indexed query; maps are kept so asking about a range
+    inside one already loaded (a network, then its parts) costs nothing
+    more.
+    """
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.maps = []
+
+    def used_in(self, first_key, last_key):
+        """
+        Used addresses (as integers) between two mirror ip_keys.
+        """
+        rows = self.mirror.db.execute(
+            'SELECT DISTINCT ip_key FROM objects WHERE ip_key BETWEEN ? AND ? '
+            'AND +dtype IN ({0})'.format(', '.join('?' * len(USED_DTYPES))),
+            [first_key, last_key] + list(USED_DTYPES)
+        )
+        return [int(key[1:], 16) for (key,) in rows]
+
+    def load(self, first, last, ip_type):
+        for umap in self.maps:
+            if (umap.ip_type == ip_type and umap.first <= first and
+                    last <= umap.last):
+                return umap
+        width = 8 if ip_type == '4' else 32
+        umap = usage_map(first, last, self.used_in(
+            '{0}{1:0{2}x}'.format(ip_type, first, width),
+            '{0}{1:0{2}x}'.format(ip_type, last, width)
+        ), ip_type)
+        self.maps.append(umap)
+        return umap
+
+    def range_usage(self, start_ip, end_ip, integers=False):
+        """
+        usage() of the range between two addresses.
+        """
+        ip_type = ip_type_of(start_ip)
+        if ip_type_of(end_ip) != ip_type:
+            raise ValueError("'{0}' and '{1}' aren't the same kind of "
+                             "address".format(start_ip, end_ip))
+        first, last = ip_to_int(start_ip), ip_to_int(end_ip)
+        if first > last:
+            raise ValueError("'{0}' comes after '{1}'".format(
+                start_ip, end_ip
+            ))
+        return usage(self.load(first, last, ip_type), first, last, integers)
+
+    def network_usage(self, network_str, integers=False):
+        """
+        usage() of every address in a network like '10.0.0.0/24'.
+        """
+        first, last, ip_type = network_range(network_str)
+        return usage(self.load(first, last, ip_type), first, last, integers)
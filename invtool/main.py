@@ -13,6 +13,8 @@ enabled_dispatches = [
     'invtool.system_dispatch',
     'invtool.csv_dispatch',
     'invtool.ba_dispatch',
+    'invtool.mirror_dispatch',
+    'invtool.report_dispatch',
     #'invtool.sreg_dispatch'
 ]
 
@@ -21,9 +23,11 @@ for d in enabled_dispatches:
 
 from invtool.lib.registrar import registrar
 from invtool.dispatch import dispatch
+from invtool.lib.response import RawJSON
+from invtool.lib.explain import RequestPlan
 
 
-def do_dispatch(args, IN=sys.stdin):
+def do_dispatch(args, IN=sys.stdin, OUT=sys.stdout):
     inv_parser = argparse.ArgumentParser(prog='invtool')
     format_group = inv_parser.add_mutually_exclusive_group()
     format_group.add_argument(
@@ -43,6 +47,11 @@ def do_dispatch(args, IN=sys.stdin):
         help="If an object was just update/created print the primary key"
         "of that object otherwise print nothing. No new line is printed."
     )
+    inv_parser.add_argument(
+        '--explain', default=False, dest='explain', action='store_true',
+        help="Don't send anything. Print the requests that would have been "
+        "made and how long they should take."
+    )
     base_parser = inv_parser.add_subparsers(dest='dtype')
 
     # Build parsers. Parses should register arguments.
@@ -51,6 +60,8 @@ def do_dispatch(args, IN=sys.stdin):
 
     nas = inv_parser.parse_args(args)
     nas.IN = IN  # Where invtool reads its input from
+    nas.OUT = OUT  # Where streamed (bulk) results are written to
+    nas.plan = RequestPlan() if nas.explain else None
     if nas.p_pk_only:
         nas.p_json = True
     return nas, dispatch(nas)
@@ -58,11 +69,23 @@ def do_dispatch(args, IN=sys.stdin):
 
 def main(args):
     nas, (resp_code, resp_list) = do_dispatch(args[1:])
+    if nas.explain:
+        concurrency = getattr(nas, 'concurrency', 1)
+        if nas.p_json:
+            resp_list = list(resp_list) + [
+                json.dumps(nas.plan.as_dict(concurrency), indent=2)
+            ]
+        else:
+            resp_list = list(resp_list) + nas.plan.report(concurrency)
+        nas.p_pk_only = False
     if not nas.p_silent and resp_list:
         if nas.p_pk_only:
-            ret_json = json.loads('\n'.join(resp_list))
-            if 'pk' in ret_json:
-                print(ret_json['pk']),
+            if len(resp_list) == 1 and isinstance(resp_list[0], RawJSON):
+                pk = resp_list[0].pk()
+            else:
+                pk = json.loads('\n'.join(map(str, resp_list))).get('pk')
+            if pk is not None:
+                print(pk),
         else:
-            print('\n'.join(resp_list).strip())
+            print('\n'.join(map(str, resp_list)).strip())
     return resp_code
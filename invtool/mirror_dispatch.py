@@ -0,0 +1,303 @@
+import argparse
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.dispatch import Dispatch, ObjectDispatch
+from invtool.kv.kv_dispatch import DispatchKV
+from invtool.lib.registrar import registrar
+from invtool.lib.config import (
+    REMOTE, API_MAJOR_VERSION, MIRROR_FULL_SYNC_INTERVAL
+)
+from invtool.lib.concurrency import pmap
+from invtool.lib.parser import add_concurrency_argument
+from invtool.lib.mirror import open_mirror, object_pk
+
+# Objects per list request when paging through a resource
+MIRROR_PAGE_SIZE = 500
+
+
+class MirrorDispatch(Dispatch):
+    dgroup = dtype = 'mirror'
+
+    def route(self, nas):
+        return getattr(self, 'mirror_' + nas.action)(nas)
+
+    def build_parser(self, base_parser):
+        # Mirror is a top level command.
+        mirror = base_parser.add_parser(
+            'mirror', help="Keep a local copy of Inventory for searches and "
+            "reports.", add_help=True
+        )
+        action_parser = mirror.add_subparsers(
+            help="mirror actions", dest='action'
+        )
+        sync = action_parser.add_parser(
+            'sync', help="Bring the local copy up to date"
+        )
+        sync.add_argument(
+            '--full', default=False, action='store_true', dest='full',
+            help="Fetch everything instead of only what changed. This is "
+            "how objects deleted in Inventory leave the mirror; sync does it "
+            "on its own once a day"
+        )
+        sync.add_argument(
+            '--page-size', default=MIRROR_PAGE_SIZE, type=int,
+            dest='page_size', help="Objects per request (default {0})".format(
+                MIRROR_PAGE_SIZE
+            )
+        )
+        add_concurrency_argument(sync)
+        action_parser.add_parser(
+            'status', help="Show what is in the local copy"
+        )
+
+    def resources(self):
+        """
+        The ObjectDispatches whose objects are mirrored, one per resource.
+        """
+        seen = set()
+        for dispatch in registrar.dispatches:
+            if (not isinstance(dispatch, ObjectDispatch) or
+                    not dispatch.object_list_url or
+                    dispatch.resource_name in seen):
+                continue
+            seen.add(dispatch.resource_name)
+            yield dispatch
+
+    def kv_dispatches(self, resources):
+        """
+        (kv dispatch, resource of the objects it belongs to) pairs.
+        """
+        by_dtype = dict((d.dtype, d.resource_name) for d in resources)
+        for dispatch in registrar.dispatches:
+            if isinstance(dispatch, DispatchKV):
+                parent = by_dtype.get(dispatch.dtype[:-len('_kv')])
+                if parent:
+                    yield dispatch, parent
+
+    def list_url(self, dispatch):
+        return "{0}{1}".format(REMOTE, dispatch.object_list_url.format(
+            API_MAJOR_VERSION, dispatch.resource_name
+        ))
+
+    def sync_resource(self, nas, mirror, dispatch, full=False,
+                      ordered=True, modified_refused=False):
+        """
+        Bring one resource up to date. After a first complete pass only
+        objects modified since the newest one in the mirror are asked for.
+        If the server can't filter on modified every object is fetched and
+        compared page by page against the content hashes in the mirror;
+        only objects whose hash changed are written.
+
+        Pages are fetched concurrently by offset, ordered by pk so they
+        don't overlap. Objects missing from a full pass are only removed if
+        the pass saw as many objects as the server said there are; objects
+        created or deleted while paging shift the offsets.
+        """
+        resource = dispatch.resource_name
+        state = mirror.sync_state(resource)
+        full = full or nas.full or not state.get('last_full') or (
+            time.time() - state['last_full'] > MIRROR_FULL_SYNC_INTERVAL
+        )
+        params = {'format': 'json'}
+        if ordered:
+            params['order_by'] = 'pk'
+        if (not full and state.get('since') and
+                state.get('modified_filter') != 0):
+            params['modified__gte'] = state['since']
+        elif not full:
+            full = True  # Nothing to filter on; compare everything
+        url = self.list_url(dispatch)
+        started = time.time()
+        result = {
+            'resource': resource, 'fetched': 0, 'written': [], 'removed': [],
+            'mode': 'full' if full else 'incremental'
+        }
+        seen = []
+        meta = {}
+        for status, objects, error in self.fetch_pages(nas, url, params,
+                                                       nas.page_size, meta):
+            if error and status == 400 and 'modified__gte' in params:
+                # Either the modified filter or the ordering was refused.
+                # Drop the filter first so the pages stay ordered
+                return self.sync_resource(nas, mirror, dispatch, full=True,
+                                          ordered=ordered,
+                                          modified_refused=True)
+            if error and status == 400 and ordered:
+                # The server won't order by pk; page without it and rely on
+                # the count check below. Whether it filters on modified is
+                # still unknown.
+                return self.sync_resource(nas, mirror, dispatch, full=full,
+                                          ordered=False)
+            if error:
+                result['error'] = error
+                return result
+            result['fetched'] += len(objects)
+            seen += [object_pk(obj) for obj in objects]
+            result['written'] += mirror.store_objects(
+                resource, dispatch.mirror_dtype, objects
+            )
+        complete = len(set(seen)) == meta.get('total_count')
+        if full and complete:
+            result['removed'] = mirror.remove_missing(resource, seen)
+        elif full:
+            # Some objects were missed or seen twice; removing what wasn't
+            # seen could drop objects that still exist
+            result['incomplete'] = "saw {0} of {1} objects".format(
+                len(set(seen)), meta.get('total_count')
+            )
+        state = {
+            'since': mirror.max_modified(resource), 'last_sync': started
+        }
+        if full and complete:
+            state['last_full'] = started
+        if 'modified__gte' in params:
+            state['modified_filter'] = 1
+        elif modified_refused:
+            # The same pass went through without the filter; remember that
+            # the server won't filter on modified and compare hashes instead
+            state['modified_filter'] = 0
+        mirror.save_sync_state(resource, **state)
+        mirror.commit()
+        return result
+
+    def sync_kvs(self, nas, mirror, kv_dispatch, parent, result):
+        """
+        Refresh the KV pairs of the objects that were written (or of every
+        object after a full pass).
+        """
+        if result['mode'] == 'full':
+            obj_pks = mirror.pks(parent)
+        else:
+            obj_pks = result['written']
+        mirror.remove_kvs(kv_dispatch.dtype, result['removed'])
+
+        def fetch(obj_pk):
+            url = "{0}{1}".format(REMOTE, kv_dispatch.kvlist_url(
+                argparse.Namespace(obj_pk=obj_pk)
+            ))
+            return self.get_json(nas, url, {'format': 'json'})
+
+        stats = {'resource': kv_dispatch.dtype, 'objects': 0, 'errors': 0}
+        for obj_pk, (status, body) in pmap(fetch, obj_pks, nas.concurrency,
+                                           ordered=False):
+            if status != 200:
+                stats['errors'] += 1
+                stats.setdefault('error', body)
+                continue
+            kvs = body.get('kvs', []) if isinstance(body, dict) else body
+            mirror.store_kvs(kv_dispatch.dtype, obj_pk, kvs)
+            stats['objects'] += 1
+        mirror.commit()
+        return stats
+
+    def explain_sync(self, nas):
+        for dispatch in self.resources():
+            self.explain(nas, 'get', self.list_url(dispatch), params={
+                'format': 'json', 'order_by': 'pk', 'limit': nas.page_size,
+                'offset': 0
+            })
+        for kv_dispatch, parent in self.kv_dispatches(self.resources()):
+            self.explain(nas, 'get', "{0}{1}".format(
+                REMOTE, kv_dispatch.kvlist_url(
+                    argparse.Namespace(obj_pk='{pk}')
+                )
+            ), params={'format': 'json'})
+        return 0, ["How many pages and KV lists follow depends on what "
+                   "changed since the last sync."]
+
+    def mirror_sync(self, nas):
+        if nas.explain:
+            return self.explain_sync(nas)
+        mirror = open_mirror()
+        resources = list(self.resources())
+        results, errors = {}, 0
+        for dispatch in resources:
+            result = self.sync_resource(nas, mirror, dispatch)
+            results[dispatch.resource_name] = result
+            errors += 'error' in result
+            if nas.p_json:
+                continue
+            if 'error' in result:
+                self.emit(nas, "{0}: error: {1}".format(
+                    dispatch.resource_name, result['error']
+                ))
+                continue
+            self.emit(nas, "{0}: {1} fetched, {2} written, {3} removed "
+                      "({4})".format(
+                          dispatch.resource_name, result['fetched'],
+                          len(result['written']), len(result['removed']),
+                          result['mode']
+                      ))
+            if 'incomplete' in result:
+                self.emit(nas, "{0}: nothing removed, the objects changed "
+                          "while syncing ({1}); the next sync tries a full "
+                          "pass again".format(
+                              dispatch.resource_name, result['incomplete']
+                          ))
+        kv_results = []
+        for kv_dispatch, parent in self.kv_dispatches(resources):
+            if 'error' in results[parent]:
+                continue
+            stats = self.sync_kvs(nas, mirror, kv_dispatch, parent,
+                                  results[parent])
+            kv_results.append(stats)
+            errors += bool(stats['errors'])
+            if not nas.p_json:
+                self.emit(nas, "{0}: KV pairs of {1} objects refreshed "
+                          "({2} errors)".format(
+                              stats['resource'], stats['objects'],
+                              stats['errors']
+                          ))
+        mirror.analyze()
+        mirror.close()
+        if nas.p_json:
+            for result in results.values():
+                result['written'] = len(result['written'])
+                result['removed'] = len(result['removed'])
+            return (1 if errors else 0), [json.dumps({
+                'objects': [results[d.resource_name] for d in resources],
+                'kvs': kv_results
+            }, indent=2)]
+        return (1 if errors else 0), []
+
+    def mirror_status(self, nas):
+        mirror = open_mirror()
+        counts = mirror.counts()
+        states = dict(
+            (row['resource'], dict(row))
+            for row in mirror.db.execute('SELECT * FROM sync_state')
+        )
+        mirror.close()
+        if nas.p_json:
+            return 0, [json.dumps({
+                'path': mirror.path, 'remote': mirror.remote,
+                'counts': counts, 'sync_state': states
+            }, indent=2)]
+        resp_list = [
+            "path: {0}".format(mirror.path),
+            "remote: {0}".format(mirror.remote)
+        ]
+        for dtype, count in sorted(counts.items()):
+            resp_list.append("{0}: {1}".format(dtype, count))
+        for resource, state in sorted(states.items()):
+            resp_list.append("{0}: last synced {1}, last full sync {2}".format(
+                resource, format_time(state['last_sync']),
+                format_time(state['last_full'])
+            ))
+        if not states:
+            resp_list.append("Never synced. Run `invtool mirror sync`.")
+        return 0, resp_list
+
+
+def format_time(stamp):
+    if not stamp:
+        return 'never'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp))
+
+
+registrar.register(MirrorDispatch())
@@ -0,0 +1,303 @@
+import argparse
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.dispatch import Dispatch
+from invtool.core_dispatch import CoreDispatch, DispatchNetwork
+from invtool.lib.registrar import registrar
+from invtool.lib.config import REMOTE, API_MAJOR_VERSION
+from invtool.lib.concurrency import pmap
+from invtool.lib.parser import add_concurrency_argument
+from invtool.lib.bulk import Throughput
+from invtool.lib.allocator import int_to_ip, ip_to_int, ip_type_of
+from invtool.lib.mirror import object_pk, open_mirror, ref_pk
+from invtool.lib.local_search import site_matches, vlan_matches
+from invtool.lib.utilization import (
+    Utilization, largest_free_block, network_range
+)
+
+USAGE_URL = "/core/range/usage_text/"
+
+# Networks, sites and vlans per list request
+REPORT_PAGE_SIZE = 500
+
+COLUMNS = "{0:<34} {1:<8} {2:<12} {3:>8} {4:>8} {5:>8} {6:>7} {7:>8}"
+
+
+class RangeReportDispatch(Dispatch):
+    dgroup = dtype = 'range-report'
+
+    def route(self, nas):
+        return self.report(nas)
+
+    def build_parser(self, base_parser):
+        # range-report is a top level command.
+        report = base_parser.add_parser(
+            'range-report', help="Show how full the networks of a site or "
+            "vlan (or a list of ranges) are.", add_help=True
+        )
+        report.add_argument(
+            '--site', dest='site', default=None, help="Report on every "
+            "network in this site (name or full name)"
+        )
+        report.add_argument(
+            '--vlan', dest='vlan', default=None, help="Report on every "
+            "network in this vlan: a name, a number or '<name>,<number>'. "
+            "Can be combined with --site"
+        )
+        report.add_argument(
+            '--range', '-r', dest='ranges', default=[], action='append',
+            help="A range to report on, as '<ip-start>,<ip-end>' or a "
+            "network like 10.0.0.0/24. Can be given many times"
+        )
+        report.add_argument(
+            '--range-file', dest='range_file', default=None,
+            type=argparse.FileType('r'), help="Read ranges, one per line, "
+            "from a file ('-' for stdin)"
+        )
+        report.add_argument(
+            '--local', dest='local', default=False, action='store_true',
+            help="Work everything out from the local mirror (see `invtool "
+            "mirror sync`) instead of asking Inventory"
+        )
+        add_concurrency_argument(report)
+
+    def report(self, nas):
+        if not (nas.site or nas.vlan or nas.ranges or nas.range_file):
+            return 1, ["Give --site, --vlan, --range or --range-file"]
+        if nas.explain and not nas.local:
+            return self.explain_report(nas)
+        mirror = open_mirror() if nas.local else None
+        try:
+            targets, error = self.targets(nas, mirror)
+            if error:
+                return 1, [json.dumps({'errors': error}) if nas.p_json
+                           else error]
+            if not targets:
+                return 1, ["No networks matched"]
+            return self.run(nas, mirror, targets)
+        finally:
+            if mirror:
+                mirror.close()
+
+    def list_url(self, resource):
+        return "{0}{1}".format(REMOTE, CoreDispatch.object_list_url.format(
+            API_MAJOR_VERSION, resource
+        ))
+
+    def explain_report(self, nas):
+        if nas.site or nas.vlan:
+            for resource in ('site', 'vlan', 'network'):
+                self.explain(nas, 'get', self.list_url(resource), params={
+                    'format': 'json', 'limit': REPORT_PAGE_SIZE, 'offset': 0
+                })
+        targets, error = self.range_targets(nas)
+        if error:
+            return 1, [error]
+        for target in targets:
+            self.explain(nas, 'get', REMOTE + USAGE_URL, params={
+                'start': target['start'], 'end': target['end'],
+                'format': 'integers'
+            })
+        if nas.site or nas.vlan:
+            return 0, ["One usage request follows for each network that "
+                       "matches."]
+        return 0, []
+
+    def targets(self, nas, mirror):
+        """
+        The ranges to report on: the networks matching --site/--vlan and
+        any --range or --range-file ranges. Returns (targets, error).
+        """
+        targets, error = self.range_targets(nas)
+        if error or not (nas.site or nas.vlan):
+            return targets, error
+        if mirror:
+            if mirror.is_empty():
+                return None, ("The local mirror is empty. Run `invtool "
+                              "mirror sync` first.")
+            networks = list(mirror.objects('NET'))
+            sites = list(mirror.objects('SITE'))
+            vlans = list(mirror.objects('VLAN'))
+        else:
+            # Only the networks of the site or vlan are fetched
+            networks, sites, vlans, error = DispatchNetwork().fetch_networks(
+                nas, nas.site, nas.vlan, REPORT_PAGE_SIZE
+            )
+            if error:
+                return None, error
+        sites = dict((object_pk(obj), obj) for obj in sites)
+        vlans = dict((object_pk(obj), obj) for obj in vlans)
+        for network in sorted(networks, key=network_sort_key):
+            site = sites.get(ref_pk(network.get('site'))) or {}
+            vlan = vlans.get(ref_pk(network.get('vlan')))
+            if nas.site and not site_matches(site, nas.site):
+                continue
+            if nas.vlan and not vlan_matches(vlan, nas.vlan):
+                continue
+            try:
+                target = range_target(network['network_str'])
+            except (KeyError, ValueError):
+                continue
+            target['site'] = site.get('full_name') or site.get('name', '')
+            target['vlan'] = "{0},{1}".format(
+                vlan['name'], vlan['number']
+            ) if vlan else ''
+            targets.append(target)
+        return targets, None
+
+    def range_targets(self, nas):
+        lines = list(nas.ranges)
+        if nas.range_file:
+            lines += [
+                line.strip() for line in nas.range_file
+                if line.strip() and not line.startswith('#')
+            ]
+        targets = []
+        for line in lines:
+            try:
+                targets.append(range_target(line))
+            except ValueError as e:
+                return None, "Bad range '{0}': {1}".format(line, e)
+        return targets, None
+
+    def range_usage(self, nas, utilization, target):
+        """
+        Returns (usage with integer free ranges, error).
+        """
+        if utilization:
+            try:
+                return utilization.range_usage(
+                    target['start'], target['end'], integers=True
+                ), None
+            except ValueError as e:
+                return None, str(e)
+        status, body = self.get_json(nas, REMOTE + USAGE_URL, {
+            'start': target['start'], 'end': target['end'],
+            'format': 'integers'
+        })
+        if status != 200:
+            return None, body
+        if not isinstance(body, dict) or 'free_ranges' not in body:
+            return None, "Couldn't understand the server's response"
+        return body, None
+
+    def run(self, nas, mirror, targets):
+        """
+        Fetch the usage of every target concurrently and print a row for
+        each as it arrives, then the totals.
+        """
+        if mirror:
+            # Local answers take microseconds and SQLite connections can't
+            # be shared between threads, so there's nothing to overlap
+            utilization = Utilization(mirror)
+            results = (
+                (target, self.range_usage(nas, utilization, target))
+                for target in targets
+            )
+        else:
+            results = pmap(
+                lambda target: self.range_usage(nas, None, target), targets,
+                nas.concurrency, ordered=False
+            )
+        stats = Throughput(unit='ranges')
+        totals = {'size': 0, 'used': 0, 'free': 0, 'largest_free_block': 0}
+        if not nas.p_json:
+            self.emit(nas, COLUMNS.format(
+                'range', 'site', 'vlan', 'size', 'used', 'free', 'used%',
+                'largest'
+            ))
+        for target, (result, error) in results:
+            if error:
+                stats.add('error')
+                if nas.p_json:
+                    self.emit(nas, json.dumps(
+                        {'range': target['label'], 'error': error}
+                    ))
+                else:
+                    self.emit(nas, "{0} error: {1}".format(
+                        target['label'], error
+                    ))
+                continue
+            stats.add('ok')
+            row = report_row(target, result)
+            for key in ('size', 'used', 'free'):
+                totals[key] += row[key]
+            totals['largest_free_block'] = max(
+                totals['largest_free_block'], row['largest_free_block']
+            )
+            if nas.p_json:
+                self.emit(nas, json.dumps(row))
+            else:
+                self.emit(nas, format_row(row))
+        totals['percent_used'] = percent(totals['used'], totals['size'])
+        ret_code = 1 if stats.counts.get('error') else 0
+        if nas.p_json:
+            summary = stats.as_dict()
+            summary.update(totals)
+            return ret_code, [json.dumps({'summary': summary})]
+        totals.update(range='TOTAL', site='', vlan='')
+        return ret_code, [format_row(totals), "# {0}".format(stats)]
+
+
+def range_target(text):
+    """
+    {'label', 'start', 'end'} of '<ip-start>,<ip-end>' or a network.
+    """
+    text = text.strip()
+    if '/' in text:
+        first, last, ip_type = network_range(text)
+        return {
+            'label': text, 'start': int_to_ip(first, ip_type),
+            'end': int_to_ip(last, ip_type), 'site': '', 'vlan': ''
+        }
+    try:
+        start, end = [part.strip() for part in text.split(',')]
+    except ValueError:
+        raise ValueError("use '<ip-start>,<ip-end>' or a network")
+    if ip_type_of(start) != ip_type_of(end):
+        raise ValueError("'{0}' and '{1}' aren't the same kind of "
+                         "address".format(start, end))
+    if ip_to_int(start) > ip_to_int(end):
+        raise ValueError("'{0}' comes after '{1}'".format(start, end))
+    return {
+        'label': '{0},{1}'.format(start, end), 'start': start, 'end': end,
+        'site': '', 'vlan': ''
+    }
+
+
+def network_sort_key(network):
+    try:
+        first, last, ip_type = network_range(network.get('network_str', ''))
+    except ValueError:
+        return ('', 0)
+    return (ip_type, first)
+
+
+def percent(used, size):
+    return round(100.0 * used / size, 1) if size else 0.0
+
+
+def report_row(target, result):
+    size = result['used'] + result['unused']
+    return {
+        'range': target['label'], 'site': target['site'],
+        'vlan': target['vlan'], 'size': size, 'used': result['used'],
+        'free': result['unused'],
+        'percent_used': percent(result['used'], size),
+        'largest_free_block': largest_free_block(result['free_ranges'])
+    }
+
+
+def format_row(row):
+    return COLUMNS.format(
+        row['range'], row['site'], row['vlan'], row['size'], row['used'],
+        row['free'], '{0:.1f}'.format(row['percent_used']),
+        row['largest_free_block']
+    )
+
+
+registrar.register(RangeReportDispatch())
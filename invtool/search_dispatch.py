@@ -1,4 +1,4 @@
-import requests
+import argparse
 import sys
 
 try:
@@ -8,7 +8,17 @@ except ImportError:
 
 from invtool.dispatch import Dispatch
 from invtool.lib.registrar import registrar
-from invtool.lib.config import REMOTE, auth
+from invtool.lib.config import REMOTE
+from invtool.lib.client import inventory_client
+from invtool.lib.concurrency import session, pmap
+from invtool.lib.parser import add_concurrency_argument
+from invtool.lib.bulk import Throughput
+from invtool.lib.search_results import iter_hits, parse_line, tsv_header
+from invtool.lib.mirror import open_mirror
+from invtool.lib.local_search import QueryError, search as local_search
+from invtool.lib.utilization import Utilization
+
+MIRROR_EMPTY = "The local mirror is empty. Run `invtool mirror sync` first."
 
 
 class SearchDispatch(Dispatch):
@@ -21,9 +31,28 @@ class SearchDispatch(Dispatch):
         )
         search.add_argument(
             '--query', '-q', dest='query', type=str, help="A query string "
-            "surrounded by quotes. I.E `search -q 'foo.bar.mozilla.com'`",
-            default=None, required=False
+            "surrounded by quotes. I.E `search -q 'foo.bar.mozilla.com'`. "
+            "Repeat it to run several searches at once",
+            default=None, required=False, action='append'
+        )
+
+        search.add_argument(
+            '--query-file', dest='query_file', type=argparse.FileType('r'),
+            help="Read query strings from a file, one per line ('-' for "
+            "stdin)", default=None, required=False
+        )
+        search.add_argument(
+            '--format', dest='search_format', default='text',
+            choices=('text', 'ndjson', 'tsv'), help="Print results the way "
+            "Inventory sends them (text, the default) or one parsed record "
+            "per line as JSON (ndjson) or tab separated fields (tsv)"
+        )
+        search.add_argument(
+            '--local', dest='local', default=False, action='store_true',
+            help="Answer queries and --range from the local mirror (see "
+            "`invtool mirror sync`) instead of asking Inventory"
         )
+        add_concurrency_argument(search)
 
         search.add_argument(
             '--range', '-r', dest='irange', type=str, help="Get information "
@@ -46,22 +75,34 @@ class SearchDispatch(Dispatch):
         This is the fast display minimal information search. Use the
         object_search to get a more detailed view of a specific type of object.
         """
-        if nas.query:
+        queries = list(nas.query or [])
+        if nas.query_file:
+            queries += [
+                line.strip() for line in nas.query_file
+                if line.strip() and not line.startswith('#')
+            ]
+        if len(queries) == 1 and not nas.query_file:
+            nas.query = queries[0]
             return self.query(nas)
+        elif queries:
+            return self.multi_query(nas, queries)
         elif nas.irange:
             return self.irange(nas)
         else:
             return (0, ['What do you want?'])
 
     def irange(self, nas):
+        if nas.local:
+            return self.local_irange(nas)
         tmp_url = "/core/range/usage_text/"
         url = "{0}{1}".format(REMOTE, tmp_url)
-        headers = {'content-type': 'application/json'}
         start, end = nas.irange.split(',')
         search = {'start': start, 'end': end}
         if nas.d_integers:
             search['format'] = 'integers'
-        resp = requests.get(url, params=search, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'get', url, params=search)
+        resp = inventory_client().send('get', url, params=search)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, search
@@ -72,30 +113,87 @@ class SearchDispatch(Dispatch):
         if ret_code:
             return (ret_code, raw_results)  # repack and go home
 
-        def display_ranges(free_ranges):
-            ret_list = []
-            for fstart, fend in free_ranges:
-                ret_list.append("{0} to {1}".format(fstart, fend))
-            return ret_list
-
-        results = json.loads(raw_results[0])
-        if not results:
+        if raw_results[0].is_empty():
             return 1, []
         else:
             if was_json:
                 return 0, raw_results
-            resp_list = ["# of Used IPs: {0}".format(results['used']),
-                         "# of Unused IPs: {0}".format(results['unused']),
-                         "------ Vacant IP ranges ------"]
-            resp_list += display_ranges(results['free_ranges'])
-            return 0, resp_list
+            return 0, self.display_usage(raw_results[0].data)
+
+    def display_usage(self, results):
+        resp_list = ["# of Used IPs: {0}".format(results['used']),
+                     "# of Unused IPs: {0}".format(results['unused']),
+                     "------ Vacant IP ranges ------"]
+        for fstart, fend in results['free_ranges']:
+            resp_list.append("{0} to {1}".format(fstart, fend))
+        return resp_list
+
+    def local_irange(self, nas):
+        """
+        Work out the usage of a range from the addresses in the local mirror
+        (see invtool.lib.utilization).
+        """
+        mirror = open_mirror()
+        try:
+            if mirror.is_empty():
+                error = MIRROR_EMPTY
+            else:
+                start, end = nas.irange.split(',')
+                results = Utilization(mirror).range_usage(
+                    start, end, integers=nas.d_integers
+                )
+                error = None
+        except ValueError as e:
+            error = "Bad range '{0}': {1}".format(nas.irange, e)
+        finally:
+            mirror.close()
+        if error:
+            if nas.p_json:
+                return 1, [json.dumps({'errors': error})]
+            return 1, [error]
+        if nas.p_json:
+            return 0, [json.dumps(results, indent=2)]
+        return 0, self.display_usage(results)
+
+    def local_text(self, query):
+        """
+        Run query against the local mirror. Returns (text, error).
+        """
+        mirror = open_mirror()
+        try:
+            if mirror.is_empty():
+                return None, MIRROR_EMPTY
+            return ''.join(
+                line + '\n' for line in local_search(mirror, query)
+            ), None
+        except QueryError as e:
+            return None, "Bad query: {0}".format(e)
+        finally:
+            mirror.close()
+
+    def local_query(self, nas):
+        text, error = self.local_text(nas.query)
+        if error:
+            if nas.p_json:
+                return 1, [json.dumps({'errors': error})]
+            return 1, [error]
+        if not text:
+            return 1, []
+        if nas.search_format != 'text':
+            return self.format_hits(nas, iter_hits(text))
+        if nas.p_json:
+            return 0, [json.dumps({'text_response': text}, indent=2)]
+        return 0, [text]
 
     def query(self, nas):
+        if nas.local:
+            return self.local_query(nas)
         tmp_url = "/core/search/search_dns_text/"
         url = "{0}{1}".format(REMOTE, tmp_url)
-        headers = {'content-type': 'application/json'}
         search = {'search': nas.query}
-        resp = requests.get(url, params=search, headers=headers, auth=auth())
+        if nas.explain:
+            return self.explain(nas, 'get', url, params=search)
+        resp = inventory_client().send('get', url, params=search)
         if nas.DEBUG:
             sys.stderr.write('method: {0}\nurl: {1}\nparams:{2}\n'.format(
                 'get', url, search
@@ -105,13 +203,114 @@ class SearchDispatch(Dispatch):
         ret_code, raw_results = self.handle_resp(nas, search, resp)
         if ret_code:
             return (ret_code, raw_results)  # repack and go home
-        results = json.loads(raw_results[0])
-        if 'text_response' not in results:
+        if not raw_results[0].has_key('text_response'):
             return 1, []
         else:
+            text = raw_results[0].data['text_response']
+            if nas.search_format != 'text':
+                return self.format_hits(nas, iter_hits(text))
             if was_json:
                 return 0, raw_results
-            return 0, [results['text_response']]
+            return 0, [text]
+
+    def format_hits(self, nas, hits):
+        found = False
+        if nas.search_format == 'tsv':
+            self.emit(nas, tsv_header())
+        for hit in hits:
+            found = True
+            if nas.search_format == 'tsv':
+                self.emit(nas, hit.as_tsv())
+            else:
+                self.emit(nas, hit.as_json())
+        return (0 if found else 1), []
+
+    def multi_query(self, nas, queries):
+        """
+        Run many searches at once. Results are printed as each search
+        finishes, under a '# query: ...' line; an object found by an earlier
+        search isn't printed again.
+        """
+        url = "{0}{1}".format(REMOTE, "/core/search/search_dns_text/")
+        if nas.explain and not nas.local:
+            for query in queries:
+                self.explain(nas, 'get', url, params={'search': query})
+            return 0, []
+
+        def search(query):
+            if nas.local:
+                return self.local_text(query)
+            resp = session(nas.concurrency).get(
+                url, params={'search': query},
+                headers={'content-type': 'application/json'}
+            )
+            if resp.status_code != 200:
+                return None, self.error_summary(resp)
+            try:
+                results = self.get_resp_dict(resp)
+            except json.decoder.JSONDecodeError:
+                return None, "Couldn't understand the server's response"
+            if 'text_response' not in results:
+                return None, results.get('error_messages', 'no results')
+            return results['text_response'], None
+
+        if nas.search_format == 'tsv':
+            self.emit(nas, tsv_header() + '\tquery')
+        seen = {}
+        duplicates = 0
+        stats = Throughput(unit='queries')
+        for query, (text, error) in pmap(search, queries, nas.concurrency,
+                                         ordered=False):
+            if error:
+                stats.add('error')
+                self.emit_query(nas, query, [], error=error)
+                continue
+            stats.add('ok')
+            hits = []
+            for line in text.splitlines():
+                hit = parse_line(line)
+                if hit is None:
+                    continue
+                if hit.key() in seen:
+                    duplicates += 1
+                    continue
+                seen[hit.key()] = query
+                hits.append(hit)
+            self.emit_query(nas, query, hits)
+
+        ret_code = 1 if stats.counts.get('error') or not seen else 0
+        if nas.search_format == 'ndjson' or (
+                nas.p_json and nas.search_format == 'text'):
+            summary = stats.as_dict()
+            summary['results'] = len(seen)
+            summary['duplicates'] = duplicates
+            return ret_code, [json.dumps({'summary': summary})]
+        return ret_code, ["# {0}, {1} results ({2} duplicates)".format(
+            stats, len(seen), duplicates
+        )]
+
+    def emit_query(self, nas, query, hits, error=None):
+        as_json = nas.search_format == 'ndjson' or (
+            nas.p_json and nas.search_format == 'text'
+        )
+        if as_json:
+            if error:
+                self.emit(nas, json.dumps({'query': query, 'error': error}))
+            for hit in hits:
+                self.emit(nas, hit.as_json(query=query, line=hit.line))
+        elif error:
+            self.emit(nas, "# query: {0} (error: {1})".format(query, error))
+        elif nas.search_format == 'tsv':
+            for hit in hits:
+                self.emit(nas, '\t'.join(
+                    [hit.as_tsv().encode('utf-8'), query]
+                ))
+        else:
+            self.emit(nas, "# query: {0} ({1} new results)".format(
+                query, len(hits)
+            ))
+            for hit in hits:
+                self.emit(nas, hit.line)
 
 
 registrar.register(SearchDispatch())
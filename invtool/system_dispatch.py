@@ -24,6 +24,9 @@ class DispatchSystem(CoreDispatch):
     resource_name = 'system'
     dtype = 'SYS'
     dgroup = 'core'
+    update_key_fields = ('pk', 'hostname')
+    upsert_key = ('hostname',)
+    named_pks = True
 
     create_args = [
         foreign_key_argument(
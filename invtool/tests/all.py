@@ -1,3 +1,21 @@
 from search_tests import *  # noqa
+from bulk_tests import *  # noqa
+from explain_tests import *  # noqa
+from multi_search_tests import *  # noqa
 from cli_tests import *  # noqa
 from kv_tests import *  # noqa
+from allocator_tests import *  # noqa
+from utilization_tests import *  # noqa
+from reservations_tests import *  # noqa
+from pools_tests import *  # noqa
+from netindex_tests import *  # noqa
+from client_tests import *  # noqa
+from concurrency_tests import *  # noqa
+from ba_tests import *  # noqa
+from response_tests import *  # noqa
+from records_tests import *  # noqa
+from dispatch_tests import *  # noqa
+from search_results_tests import *  # noqa
+from mirror_tests import *  # noqa
+from local_search_tests import *  # noqa
+from report_tests import *  # noqa
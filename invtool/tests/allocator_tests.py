@@ -0,0 +1,89 @@
+import unittest
+
+from invtool.lib.allocator import (
+    IPAllocator, PoolExhausted, allocator_for_range, int_to_ip, ip_to_int
+)
+
+
+class IPAllocatorTestCase(unittest.TestCase):
+    def test_int_conversion(self):
+        self.assertEqual(ip_to_int('10.0.0.1'), 167772161)
+        self.assertEqual(int_to_ip(167772161), '10.0.0.1')
+        self.assertEqual(int_to_ip(ip_to_int('255.255.255.255')),
+                         '255.255.255.255')
+        self.assertEqual(int_to_ip(ip_to_int('2620:101:8000::1'), '6'),
+                         '2620:101:8000::1')
+        self.assertRaises(ValueError, ip_to_int, 'foo')
+        self.assertRaises(ValueError, int_to_ip, 1 << 32, '4')
+
+    def test_next_lowest_first(self):
+        pool = IPAllocator([['10.0.0.5', '10.0.0.6'],
+                            ['10.0.0.1', '10.0.0.1']])
+        self.assertEqual(pool.free, 3)
+        self.assertEqual(list(pool), ['10.0.0.1', '10.0.0.5', '10.0.0.6'])
+        self.assertRaises(PoolExhausted, pool.next)
+
+    def test_merges_ranges(self):
+        a = ip_to_int('10.0.0.0')
+        pool = IPAllocator([[a, a + 9], [a + 10, a + 19], [a + 5, a + 12]])
+        self.assertEqual(pool.ranges(), [('10.0.0.0', '10.0.0.19')])
+        self.assertEqual(pool.free, 20)
+
+    def test_allocate(self):
+        pool = allocator_for_range(
+            '10.0.0.0,10.0.255.255', [['10.0.0.1', '10.0.0.2'],
+                                      ['10.0.1.0', '10.0.255.255']]
+        )
+        ips = pool.allocate(3000)
+        self.assertEqual(len(ips), 3000)
+        self.assertEqual(len(set(ips)), 3000)
+        self.assertEqual(ips[:3], ['10.0.0.1', '10.0.0.2', '10.0.1.0'])
+        self.assertEqual(pool.free, 65280 + 2 - 3000)
+        self.assertRaises(PoolExhausted, pool.allocate, pool.free + 1)
+        self.assertEqual(pool.free, 65280 + 2 - 3000)
+
+    def test_allocate_block(self):
+        pool = IPAllocator([['10.0.0.1', '10.0.0.2'],
+                            ['10.0.0.10', '10.0.0.20']])
+        self.assertEqual(pool.allocate_block(4),
+                         ['10.0.0.10', '10.0.0.11', '10.0.0.12', '10.0.0.13'])
+        self.assertEqual(pool.next(), '10.0.0.1')
+        self.assertRaises(PoolExhausted, pool.allocate_block, 8)
+
+    def test_take_and_release(self):
+        pool = IPAllocator([['10.0.0.1', '10.0.0.10']])
+        self.assertTrue(pool.take('10.0.0.5'))
+        self.assertFalse(pool.take('10.0.0.5'))
+        self.assertFalse('10.0.0.5' in pool)
+        self.assertEqual(pool.ranges(), [('10.0.0.1', '10.0.0.4'),
+                                         ('10.0.0.6', '10.0.0.10')])
+        pool.release('10.0.0.5')
+        self.assertEqual(pool.ranges(), [('10.0.0.1', '10.0.0.10')])
+        self.assertEqual(pool.free, 10)
+
+    def test_ipv6(self):
+        pool = allocator_for_range(
+            '2620:101:8000::,2620:101:8000::ffff:ffff:ffff:ffff',
+            [['2620:101:8000::ffff:ffff:ffff:fffe',
+              '2620:101:8000::ffff:ffff:ffff:ffff']]
+        )
+        self.assertEqual(pool.ip_type, '6')
+        self.assertEqual(pool.allocate(2), [
+            '2620:101:8000:0:ffff:ffff:ffff:fffe',
+            '2620:101:8000:0:ffff:ffff:ffff:ffff'
+        ])
+        big = IPAllocator([[0, (1 << 128) - 1]], '6')
+        self.assertEqual(big.free, 1 << 128)
+        self.assertEqual(big.allocate_block(2), ['::', '::1'])
+
+    def test_many_ranges(self):
+        # Used up intervals are compacted away without losing any
+        pool = IPAllocator([[i * 4, i * 4 + 1] for i in range(1000)])
+        ips = [pool.next() for i in range(1500)]
+        self.assertEqual(len(set(ips)), 1500)
+        self.assertEqual(pool.free, 500)
+        self.assertEqual(len(pool.allocate(500)), 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
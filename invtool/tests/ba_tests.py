@@ -0,0 +1,169 @@
+import threading
+import unittest
+
+from copy import deepcopy
+
+import invtool.ba_dispatch
+from invtool.main import do_dispatch
+from invtool.lib.ba import (
+    ba_diff, ba_import_chunked, change_summary, split_blob
+)
+from invtool.lib.client import InventoryError
+from invtool.lib.records import SystemRecord, snapshot_export
+
+
+class ImportClient(object):
+    """
+    Rejects any blob with a system named bad*, like Inventory would.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.saved = {}
+
+    def ba_import(self, blob, commit=False):
+        bad = sorted(name for name in blob['systems']
+                     if name.startswith('bad'))
+        if bad:
+            raise InventoryError(200, 'rejected {0}'.format(bad), blob)
+        if commit or blob.get('commit'):
+            with self.lock:
+                self.saved.update(blob['systems'])
+        return dict(blob, http_status=200)
+
+
+def blob_of(names):
+    return {'systems': dict((name, {'hostname': name}) for name in names)}
+
+
+class BATestCase(unittest.TestCase):
+    def test_split_blob(self):
+        blob = blob_of(['c', 'a', 'b'])
+        blob['other'] = 1
+        chunks = list(split_blob(blob, 2))
+        self.assertEqual([sorted(c['systems']) for c in chunks],
+                         [['a', 'b'], ['c']])
+        self.assertTrue(all(c['other'] == 1 for c in chunks))
+        self.assertEqual(list(split_blob({'systems': {}}, 2)), [])
+
+    def test_validate_never_commits(self):
+        client = ImportClient()
+        blob = blob_of(['a', 'b', 'c'])
+        blob['commit'] = True
+        self.assertTrue(all('commit' not in c for c in split_blob(blob, 2)))
+        result, errors, report = ba_import_chunked(
+            blob, chunk_size=2, client=client
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(client.saved, {})
+
+    def test_import_chunked(self):
+        client = ImportClient()
+        names = ['host{0:02}'.format(i) for i in range(25)]
+        blob, errors, report = ba_import_chunked(
+            blob_of(names), commit=True, chunk_size=10, concurrency=4,
+            client=client
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(blob['systems']), names)
+        self.assertEqual(sorted(client.saved), names)
+        self.assertEqual(report['stats'].counts, {'committed': 25})
+        self.assertEqual(
+            sorted(t['phase'] for t in report['chunks']),
+            ['commit'] * 3 + ['validate'] * 3
+        )
+
+    def test_import_chunked_finds_bad_systems(self):
+        client = ImportClient()
+        names = ['host{0:02}'.format(i) for i in range(25)] + ['bad1', 'bad2']
+        blob, errors, report = ba_import_chunked(
+            blob_of(names), commit=True, chunk_size=10, client=client
+        )
+        self.assertEqual(blob, None)
+        self.assertEqual(client.saved, {})
+        self.assertEqual(sorted(e['systems'] for e in errors),
+                         [['bad1'], ['bad2']])
+        self.assertEqual(report['stats'].counts, {'error': 2, 'valid': 25})
+
+    def test_diff(self):
+        system = {
+            'pk': 1, 'hostname': 'web1',
+            'staticreg_set': {
+                'nic0': {'pk': 10, 'ip_str': '10.0.0.1', 'cname': [
+                    {'pk': 20, 'fqdn': 'a.web1'}, {'pk': 21, 'fqdn': 'b.web1'}
+                ], 'hwadapter_set': {'hw0': {'pk': 30, 'mac': 'aa'}}},
+                'nic1': {'pk': 11, 'ip_str': '10.0.0.2'},
+            },
+            'keyvalue_set': {'owner': {'pk': 40, 'value': 'me'}}
+        }
+        original = {'systems': {
+            'web1': system, 'web2': dict(deepcopy(system), pk=2)
+        }}
+        modified = deepcopy(original)
+        web1 = modified['systems']['web1']
+        web1['staticreg_set']['nic0']['cname'][1]['fqdn'] = 'c.web1'
+        web1['keyvalue_set']['rack'] = {'key': 'rack', 'value': '4'}
+        modified['systems']['web3'] = {'hostname': 'web3'}
+
+        blob, changes = ba_diff(original, modified)
+        self.assertEqual(sorted(blob['systems']), ['web1', 'web3'])
+        self.assertEqual(blob['systems']['web1'], {
+            'pk': 1, 'hostname': 'web1',
+            'staticreg_set': {'nic0': {
+                'pk': 10, 'ip_str': '10.0.0.1',
+                'cname': [{'pk': 21, 'fqdn': 'c.web1'}]
+            }},
+            'keyvalue_set': {'rack': {'key': 'rack', 'value': '4'}}
+        })
+        self.assertEqual(sorted(changes['web1']), [
+            'keyvalue_set.rack (new)', 'staticreg_set.nic0.cname.fqdn'
+        ])
+        self.assertEqual(change_summary(changes, 3), [
+            "2 of 3 systems changed",
+            "~ web1: " + ', '.join(changes['web1']), "+ web3"
+        ])
+        self.assertEqual(ba_diff(original, original)[0], {'systems': {}})
+
+        # ba_import_csv keeps the export as records to diff against
+        snapshot = snapshot_export(original)
+        self.assertTrue(
+            isinstance(snapshot['systems']['web1'], SystemRecord)
+        )
+        self.assertEqual(ba_diff(snapshot, modified), (blob, changes))
+        self.assertEqual(ba_diff(snapshot, original)[0], {'systems': {}})
+
+
+class Response(object):
+    status_code = 200
+    content = '{"systems": {"b": {}, "a": {}}}'
+
+
+class ExportClient(object):
+    def send(self, method, url, **kwargs):
+        return Response()
+
+
+class BAExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = invtool.ba_dispatch.inventory_client
+        invtool.ba_dispatch.inventory_client = lambda: ExportClient()
+
+    def tearDown(self):
+        invtool.ba_dispatch.inventory_client = self.client
+
+    def test_pretty_unless_json(self):
+        nas, (ret_code, resp_list) = do_dispatch(['ba_export', '-q', 'a'])
+        self.assertEqual(resp_list[0], (
+            '{\n    "http_status": 200,\n    "systems": {\n'
+            '        "a": {},\n        "b": {}\n    }\n}'
+        ))
+        nas, (ret_code, resp_list) = do_dispatch(
+            ['--json', 'ba_export', '-q', 'a']
+        )
+        self.assertEqual(
+            str(resp_list[0]),
+            '{"http_status": 200, "systems": {"b": {}, "a": {}}}'
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
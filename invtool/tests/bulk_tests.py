@@ -0,0 +1,299 @@
+import unittest
+from StringIO import StringIO
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import invtool.dispatch
+from invtool.dns_dispatch import DispatchA
+from invtool.main import do_dispatch
+
+
+class Response(object):
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.text = self.content = json.dumps(body) if body else ''
+
+
+class FakeSession(object):
+    """
+    Records every request and answers it with respond(method, url, data).
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def request(self, method, url, data=None):
+        self.requests.append((method, url, data and json.loads(data)))
+        return self.respond(method, url, data and json.loads(data))
+
+    def get(self, url, params=None, headers=None):
+        return self.request('get', url)
+
+    def delete(self, url, params=None, headers=None):
+        return self.request('delete', url)
+
+    def patch(self, url, data=None, headers=None):
+        return self.request('patch', url, data)
+
+    def post(self, url, data=None, headers=None):
+        return self.request('post', url, data)
+
+
+class BulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = invtool.dispatch.session
+
+    def tearDown(self):
+        invtool.dispatch.session = self.session
+
+    def serve(self, respond):
+        fake = FakeSession(respond)
+        invtool.dispatch.session = lambda *args: fake
+        return fake
+
+    def run_bulk(self, args, stdin):
+        out = StringIO()
+        nas, (ret_code, resp_list) = do_dispatch(
+            ['--json'] + args, IN=StringIO(stdin), OUT=out
+        )
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        return ret_code, lines
+
+
+def created(method, url, data):
+    if method == 'patch':
+        return Response(202, {'objects': [
+            dict(obj, pk=i) for i, obj in enumerate(data['objects'], 1)
+        ]})
+    return Response(201, dict(data, pk=9))
+
+
+class BulkCreateTestCase(BulkTestCase):
+    rows = (
+        '{"fqdn": "a.mozilla.com", "ip": "10.0.0.1"}\n'
+        '{"fqdn": "b.mozilla.com", "ip": "10.0.0.2"}\n'
+        '{"fqdn": "c.mozilla.com", "ip": "10.0.0.3"}\n'
+    )
+
+    def test_rows_are_patched_in_chunks(self):
+        fake = self.serve(created)
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-create', '--chunk-size', '2', '-j', '1'], self.rows
+        )
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(
+            [(method, len(data['objects'])) for method, url, data
+             in fake.requests], [('patch', 2), ('patch', 1)]
+        )
+        self.assertEqual(
+            [(line['line'], line['status'], line['pk']) for line in lines],
+            [(1, 'created', 1), (2, 'created', 2), (3, 'created', 1)]
+        )
+
+    def test_post_every_row_when_patch_isnt_allowed(self):
+        def respond(method, url, data):
+            if method == 'patch':
+                return Response(405)
+            return created(method, url, data)
+        fake = self.serve(respond)
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-create', '--chunk-size', '2', '-j', '1'], self.rows
+        )
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(
+            [method for method, url, data in fake.requests],
+            ['patch', 'post', 'post', 'post']
+        )
+        self.assertEqual(
+            [line['status'] for line in lines], ['created'] * 3
+        )
+
+    def test_errors_are_reported_against_their_line(self):
+        def respond(method, url, data):
+            if data['fqdn'] == 'c.mozilla.com':
+                return Response(400, {
+                    'error_messages': json.dumps({'fqdn': ['Already exists']})
+                })
+            return created(method, url, data)
+        fake = self.serve(respond)
+        rows = 'fqdn,ip\na.mozilla.com,10.0.0.1\nb.mozilla.com\n' \
+            'c.mozilla.com,10.0.0.3\n'
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-create', '--no-patch'], rows
+        )
+        self.assertEqual(ret_code, 1)
+        # The row without an ip never reaches the server
+        self.assertEqual(len(fake.requests), 2)
+        self.assertEqual(
+            [(line['line'], line['status']) for line in lines],
+            [(2, 'created'), (3, 'error'), (4, 'error')]
+        )
+        self.assertTrue('Already exists' in lines[2]['errors'])
+
+    def test_true_csv_cells_set_flags(self):
+        fake = self.serve(created)
+        rows = 'fqdn,ip,private\na.mozilla.com,10.0.0.1,true\n' \
+            'b.mozilla.com,10.0.0.2,\n'
+        self.run_bulk(['A', 'bulk-create', '--no-patch'], rows)
+        views = dict(
+            (data['fqdn'], data['views']) for method, url, data
+            in fake.requests
+        )
+        self.assertEqual(
+            views, {'a.mozilla.com': ['private'], 'b.mozilla.com': []}
+        )
+
+
+class MultiDetailTestCase(BulkTestCase):
+    def setUp(self):
+        super(MultiDetailTestCase, self).setUp()
+        DispatchA.detail_set_size = 2
+
+    def tearDown(self):
+        super(MultiDetailTestCase, self).tearDown()
+        del DispatchA.detail_set_size
+
+    def test_pks_are_fetched_in_sets(self):
+        def respond(method, url, data):
+            pks = url.rstrip('/').split('/')[-1].split(';')
+            return Response(200, {'objects': [
+                {'pk': int(pk)} for pk in pks if pk != '2'
+            ]})
+        fake = self.serve(respond)
+        ret_code, lines = self.run_bulk(
+            ['A', 'detail', '--pk', '3', '--pk', '2', '--pk', '1'], ''
+        )
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(
+            [url.split('/addressrecord/')[1] for method, url, data
+             in fake.requests], ['set/3;2/', 'set/1/']
+        )
+        self.assertEqual(
+            [(line['pk'], line['http_status']) for line in lines],
+            [(3, 200), ('2', 404), (1, 200)]
+        )
+
+    def test_fetch_every_pk_without_set_support(self):
+        def respond(method, url, data):
+            if '/set/' in url:
+                return Response(404)
+            return Response(200, {'pk': int(url.split('/')[-2])})
+        fake = self.serve(respond)
+        ret_code, lines = self.run_bulk(
+            ['A', 'detail', '--pk', '3', '--pk', '2', '--pk', '1'], ''
+        )
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(
+            [url.split('/addressrecord/')[1] for method, url, data
+             in fake.requests], ['set/3;2/', '3/', '2/', '1/']
+        )
+        self.assertEqual([line['pk'] for line in lines], [3, 2, 1])
+
+
+class BulkDeleteTestCase(BulkTestCase):
+    def test_delete_mixed_dtypes(self):
+        def respond(method, url, data):
+            return Response(404 if url.endswith('/ptr/5/') else 204)
+        fake = self.serve(respond)
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-delete'], '1\nPTR 5\n# a comment\nA 2\nPTR x\n'
+        )
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(
+            sorted(url.split('/api/')[1] for method, url, data
+                   in fake.requests),
+            ['v1_dns/addressrecord/1/', 'v1_dns/addressrecord/2/',
+             'v1_dns/ptr/5/']
+        )
+        self.assertEqual(
+            [(line['line'], line['dtype'], line['status']) for line in lines],
+            [(1, 'A', 'deleted'), (2, 'PTR', 'error'), (4, 'A', 'deleted'),
+             (5, 'PTR', 'error')]
+        )
+        self.assertEqual(lines[3]['errors'], "pk must be an integer")
+
+    def test_verify_expects_a_404(self):
+        def respond(method, url, data):
+            if method == 'get' and url.endswith('/2/'):
+                return Response(200, {'pk': 2})
+            return Response(404 if method == 'get' else 204)
+        fake = self.serve(respond)
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-delete', '--verify'], '1\n2\n'
+        )
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(
+            sorted(method for method, url, data in fake.requests),
+            ['delete', 'delete', 'get', 'get']
+        )
+        self.assertEqual(
+            [line['status'] for line in lines], ['verified', 'error']
+        )
+        self.assertTrue(lines[1]['errors'].startswith("still there"))
+
+    def test_systems_are_deleted_by_hostname(self):
+        fake = self.serve(lambda method, url, data: Response(204))
+        ret_code, lines = self.run_bulk(
+            ['A', 'bulk-delete'],
+            'web1.scl3.mozilla.com 10.8.0.1 INV SYS 1234 SN1\n'
+        )
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(
+            [url.split('/api/')[1] for method, url, data in fake.requests],
+            ['v1_core/system/web1.scl3.mozilla.com/']
+        )
+        self.assertEqual(lines[0]['status'], 'deleted')
+
+
+class BulkUpdateTestCase(BulkTestCase):
+    def respond(self, method, url, data):
+        if method == 'get':  # The objects as they are now
+            pks = url.rstrip('/').split('/')[-1].split(';')
+            return Response(200, {'objects': [
+                {'pk': int(pk), 'ttl': 3600, 'description': ''}
+                for pk in pks
+            ]})
+        return Response(202)
+
+    def patches(self, fake):
+        return sorted(
+            (url.split('/addressrecord/')[1], data) for method, url, data
+            in fake.requests if method == 'patch'
+        )
+
+    def test_rows_for_one_object_are_coalesced(self):
+        fake = self.serve(self.respond)
+        rows = 'pk,ttl,description\n1,300,\n2,,two\n1,,one\n'
+        ret_code, lines = self.run_bulk(['A', 'bulk-update'], rows)
+        self.assertEqual(ret_code, 0)
+        patches = self.patches(fake)
+        self.assertEqual([url for url, data in patches], ['1/', '2/'])
+        self.assertEqual(
+            (patches[0][1]['ttl'], patches[0][1]['description']),
+            (300, 'one')
+        )
+        self.assertEqual(patches[1][1]['description'], 'two')
+        self.assertEqual(
+            [(line['line'], line['status']) for line in lines],
+            [('2,4', 'updated'), ('3', 'updated')]
+        )
+
+    def test_conflicting_rows_are_not_sent(self):
+        fake = self.serve(self.respond)
+        rows = '{"pk": 1, "ttl": 300}\n{"pk": 1, "ttl": 600}\n' \
+            '{"ttl": 600}\n'
+        ret_code, lines = self.run_bulk(['A', 'bulk-update'], rows)
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(self.patches(fake), [])
+        self.assertEqual(
+            [(line['line'], line['status']) for line in lines],
+            [(3, 'error'), ('1,2', 'error')]
+        )
+        self.assertTrue(lines[1]['errors'].startswith("conflicting values"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.client import (
+    ConcurrentClient, InventoryClient, InventoryError, error_summary,
+    format_errors
+)
+
+
+class Response(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = self.content = (
+            body if isinstance(body, basestring) else json.dumps(body)
+        )
+
+
+class PagedClient(object):
+    """
+    Answers list requests from a list of objects, like tastypie.
+    """
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get(self, path, params):
+        offset, limit = params['offset'], params['limit']
+        if path == '/fail/':
+            raise InventoryError(500, 'boom')
+        return {'meta': {'total_count': len(self.objects)},
+                'objects': self.objects[offset:offset + limit]}
+
+
+class ClientTestCase(unittest.TestCase):
+    def test_error_summary(self):
+        self.assertEqual(error_summary(Response(404, '')),
+                         "http_status: 404 (not found)")
+        self.assertEqual(error_summary(Response(500, '<html>')),
+                         "http_status: 500")
+        errors = json.dumps({'__all__': ['Duplicate'], 'fqdn': ['required']})
+        self.assertEqual(
+            sorted(format_errors(errors)),
+            ["Error: Object Error  Duplicate", "Error: fqdn  required"]
+        )
+        self.assertEqual(
+            error_summary(Response(400, {'error_messages': json.dumps(
+                {'fqdn': ['required']}
+            )})), "Error: fqdn  required"
+        )
+
+    def test_decode(self):
+        client = InventoryClient(remote='http://inventory')
+        self.assertEqual(client.decode(Response(201, {'pk': 3})), {'pk': 3})
+        self.assertEqual(client.decode(Response(204, '')), {})
+        try:
+            client.decode(Response(400, {'message': 'nope'}))
+        except InventoryError as e:
+            self.assertEqual((e.status, e.errors), (400, 'nope'))
+            self.assertEqual(json.loads(str(e)), {'message': 'nope'})
+        else:
+            self.fail("no InventoryError")
+        self.assertRaises(InventoryError, client.decode, Response(200, '{'))
+        self.assertEqual(client.url('/core/'), 'http://inventory/core/')
+
+    def test_concurrent_client(self):
+        with ConcurrentClient(4, client=PagedClient(range(1234))) as client:
+            objects = list(client.iter_pages('/objects/', page_size=100))
+            self.assertEqual(sorted(objects), range(1234))
+            self.assertEqual(objects[:100], range(100))
+            future = client.get('/fail/', {'offset': 0, 'limit': 1})
+            self.assertRaises(InventoryError, future.result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import time
+import unittest
+
+from invtool.lib.concurrency import WorkerPool, as_completed, chunked, pmap
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+    def test_pmap(self):
+        results = pmap(lambda n: n * 2, iter(range(50)), concurrency=4)
+        self.assertEqual(list(results), [(n, n * 2) for n in range(50)])
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_worker_pool_is_bounded(self):
+        lock = threading.Lock()
+        running = [0, 0]  # now, most at once
+
+        def call(n):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.002)
+            with lock:
+                running[0] -= 1
+            return n
+
+        with WorkerPool(concurrency=3) as pool:
+            futures = [pool.submit(call, n) for n in range(60)]
+            done = [future.result() for future in as_completed(futures)]
+        self.assertEqual(sorted(done), range(60))
+        self.assertTrue(1 < running[1] <= 3)
+
+    def test_future_errors_and_callbacks(self):
+        with WorkerPool(concurrency=2) as pool:
+            future = pool.submit(int, 'x')
+            self.assertRaises(ValueError, future.result)
+            self.assertTrue(isinstance(future.exception(), ValueError))
+            seen = []
+            future = pool.submit(lambda: 7)
+            future.result()
+            future.add_done_callback(lambda f: seen.append(f.result()))
+            self.assertEqual(seen, [7])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import invtool.dispatch
+from invtool.core_dispatch import DispatchSite
+from invtool.dns_dispatch import DispatchA, DispatchAAAA
+from invtool.lib.bulk import build_row_parser
+from invtool.lib.lockfile import read_json
+from invtool.lib.natural_keys import NaturalKeyIndex
+
+
+class Response(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = self.content = json.dumps(body)
+
+
+class ListSession(object):
+    """
+    Answers list requests like tastypie, filtering on the given fields
+    except the ignored ones.
+    """
+    def __init__(self, objects, ignored=()):
+        self.objects = objects
+        self.ignored = ignored
+        self.requests = []
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append(params)
+        filters = dict(
+            (k, v) for k, v in params.items()
+            if k not in ('format', 'limit', 'offset') + tuple(self.ignored)
+        )
+        objects = [
+            obj for obj in self.objects
+            if all(str(obj.get(k)) == str(v) for k, v in filters.items())
+        ]
+        return Response(200, {
+            'meta': {'total_count': len(objects)},
+            'objects': objects[:params.get('limit', 20)]
+        })
+
+
+class ListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = invtool.dispatch.session
+
+    def tearDown(self):
+        invtool.dispatch.session = self.session
+
+    def serve(self, objects, ignored=()):
+        fake = ListSession(objects, ignored)
+        invtool.dispatch.session = lambda *args: fake
+        return fake
+
+
+class NaturalKeyTestCase(ListTestCase):
+    def test_a_and_aaaa_with_the_same_fqdn(self):
+        fake = self.serve([
+            {'pk': 1, 'fqdn': 'web1.scl3', 'ip_type': '4'},
+            {'pk': 2, 'fqdn': 'web1.scl3', 'ip_type': '6'},
+        ])
+        self.assertEqual(DispatchA().lookup_pk('web1.scl3'), (1, None))
+        self.assertEqual(DispatchAAAA().lookup_pk('web1.scl3'), (2, None))
+        self.assertEqual(fake.requests[0]['ip_type'], '4')
+        self.assertEqual(fake.requests[1]['ip_type'], '6')
+
+    def test_a_lookup_never_finds_an_aaaa(self):
+        self.serve([{'pk': 2, 'fqdn': 'web1.scl3', 'ip_type': '6'}])
+        pk, error = DispatchA().lookup_pk('web1.scl3')
+        self.assertEqual(pk, None)
+        self.assertEqual(error, "No A with fqdn 'web1.scl3'")
+
+    def test_site_takes_name_everywhere(self):
+        for args in ('update_args', 'detail_args', 'delete_args'):
+            parser = build_row_parser(getattr(DispatchSite, args))
+            nas = parser.parse_args(['--name', 'phx1'])
+            self.assertEqual(nas.full_name, 'phx1')
+        # The old option still works for update
+        parser = build_row_parser(DispatchSite.update_args)
+        self.assertEqual(
+            parser.parse_args(['--full_name', 'phx1']).full_name, 'phx1'
+        )
+
+
+
+class UpsertTestCase(ListTestCase):
+    records = [
+        {'pk': 1, 'fqdn': 'web1.scl3', 'ip_type': '4', 'ip_str': '10.0.0.1'},
+        {'pk': 2, 'fqdn': 'web1.scl3', 'ip_type': '4', 'ip_str': '10.0.0.2'},
+        {'pk': 3, 'fqdn': 'web1.scl3', 'ip_type': '4', 'ip_str': '10.0.0.3'},
+    ]
+
+    def find(self, ip_str):
+        dispatch = DispatchA()
+        key = {'fqdn': 'web1.scl3', 'ip_type': '4', 'ip_str': ip_str}
+        url, params = dispatch.upsert_lookup_request(key)
+        return dispatch.find_existing(url, params, key)
+
+    def test_find_existing(self):
+        self.serve(self.records)
+        self.assertEqual(self.find('10.0.0.3'), (self.records[2], None))
+        self.assertEqual(self.find('10.0.0.9'), (None, None))
+
+    def test_unfiltered_rows_are_not_a_miss(self):
+        # The server ignores ip_str, so the match isn't in the first page
+        self.serve(self.records, ignored=['ip_str'])
+        existing, error = self.find('10.0.0.3')
+        self.assertEqual(existing, None)
+        self.assertTrue(error.startswith("The server found 3 A objects"))
+
+
+class NaturalKeyIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache', 'natural_keys.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_saves_merge(self):
+        first = NaturalKeyIndex(self.path, remote='inv')
+        second = NaturalKeyIndex(self.path, remote='inv')
+        first.remember('A', 'a.mozilla.com', 1)
+        second.get('A', 'a.mozilla.com')  # Loaded before first saves
+        second.remember('A', 'b.mozilla.com', 2)
+        first.save()
+        second.save()
+        self.assertEqual(
+            sorted(read_json(self.path)['inv']['A']),
+            ['a.mozilla.com', 'b.mozilla.com']
+        )
+        self.assertEqual(
+            NaturalKeyIndex(self.path, remote='inv').get('A', 'b.mozilla.com'),
+            2
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import invtool.dispatch
+from invtool.lib import explain
+from invtool.lib.explain import LatencyLog, RequestPlan, endpoint
+from invtool.main import do_dispatch
+
+
+class NoSession(object):
+    def __getattr__(self, name):
+        raise AssertionError("--explain sent a request")
+
+
+class ExplainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = explain._log
+        self.session = invtool.dispatch.session
+        explain._log = LatencyLog(os.path.join(self.tmp, 'latency.json'))
+        invtool.dispatch.session = lambda *args: NoSession()
+
+    def tearDown(self):
+        explain._log = self.log
+        invtool.dispatch.session = self.session
+        shutil.rmtree(self.tmp)
+
+    def plan(self, args, stdin=''):
+        nas, (ret_code, resp_list) = do_dispatch(
+            ['--explain'] + args, IN=StringIO(stdin), OUT=StringIO()
+        )
+        return ret_code, nas.plan.as_dict(getattr(nas, 'concurrency', 1))
+
+    def test_endpoint_names_hide_pks(self):
+        self.assertEqual(
+            endpoint('get', 'http://inv/api/v1_dns/ptr/set/1;2;3/?a=1'),
+            'GET /api/v1_dns/ptr/set/{pks}/'
+        )
+        self.assertEqual(
+            endpoint('delete', 'http://inv/api/v1_dns/ptr/12/'),
+            'DELETE /api/v1_dns/ptr/{pk}/'
+        )
+
+    def test_bulk_create_plan(self):
+        rows = 'fqdn,ip\na.mozilla.com,10.0.0.1\nb.mozilla.com,10.0.0.2\n' \
+            'c.mozilla.com,10.0.0.3\n'
+        ret_code, plan = self.plan(
+            ['A', 'bulk-create', '--chunk-size', '2'], rows
+        )
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(plan['requests'], 2)
+        self.assertEqual(
+            [(step['method'], step['requests']) for step in plan['plan']],
+            [('PATCH', 2)]
+        )
+        self.assertTrue(plan['bytes'] > 0)
+        self.assertEqual(plan['estimated_seconds'], None)
+
+    def test_estimate_from_observed_latency(self):
+        url = 'http://inv/en-US/mozdns/api/v1_dns/addressrecord/1/'
+        explain._log.record('delete', url, 0.2)
+        explain._log.record('get', url, 0.1)
+        explain._log.save()
+        explain._log = LatencyLog(explain._log.path)  # Read it back
+        ret_code, plan = self.plan(
+            ['A', 'bulk-delete', '--verify', '--concurrency', '2'],
+            '1\n2\n3\n4\n'
+        )
+        self.assertEqual(
+            [(step['method'], step['requests']) for step in plan['plan']],
+            [('DELETE', 4), ('GET', 4)]
+        )
+        self.assertEqual(plan['concurrency'], 2)
+        self.assertEqual(plan['estimated_seconds'], 0.6)
+
+    def test_report(self):
+        plan = RequestPlan()
+        plan.add('post', 'http://inv/api/v1_core/site/', body={'a': 1})
+        lines = plan.report()
+        self.assertTrue(lines[0].startswith("Nothing was sent"))
+        self.assertTrue('/api/v1_core/site/  x1  8 B' in lines[1])
+        self.assertEqual(lines[-1], "1 requests, 8 B")
+
+
+if __name__ == "__main__":
+    unittest.main()
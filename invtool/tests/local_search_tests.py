@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from invtool.lib import local_search
+from invtool.lib.local_search import (
+    Parser, QueryError, literal_prefix, literal_runs, search, tokenize
+)
+from invtool.lib.mirror import Mirror
+
+NAMES = [
+    ('ab.example.com', '10.0.0.1'), ('acx.example.com', '10.0.0.2'),
+    ('web01.scl3.example.com', '10.0.1.1'),
+    ('web123x.scl3.example.com', '10.0.1.2'),
+    ('db1.phx1.example.com', '10.1.0.1'),
+]
+
+
+class QueryCompilerTestCase(unittest.TestCase):
+    def test_literal_runs(self):
+        self.assertEqual(literal_runs('a[bcdef]'), ['a'])
+        self.assertEqual(literal_runs('web[0-9]{2,3}x'), ['web', 'x'])
+        self.assertEqual(literal_runs('abc(def)?ghi'), ['abc', 'ghi'])
+        self.assertEqual(literal_runs('abc?d+ef'), ['ab', 'd', 'ef'])
+        self.assertEqual(literal_runs(r'db\d\.phx'), ['db', '.phx'])
+        self.assertEqual(literal_runs('[]x]yz'), ['yz'])
+        self.assertEqual(literal_runs('web|db'), [])
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix('web[0-9]'), 'web')
+        self.assertEqual(literal_prefix(r'db1\.phx'), 'db1.phx')
+        self.assertEqual(literal_prefix('webs?'), 'web')
+
+    def test_parse(self):
+        self.assertEqual(tokenize('(/^a(b) OR !c)'),
+                         ['(', '/^a(b)', 'OR', '!', 'c', ')'])
+        self.assertEqual(Parser('a b OR type=:A').parse(), (
+            'or', ('and', ('word', 'a'), ('word', 'b')),
+            ('directive', 'type', 'A')
+        ))
+        for query in ('', '(a', 'a OR', ')'):
+            self.assertRaises(QueryError, Parser(query).parse)
+
+
+class LocalSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mirror = Mirror(os.path.join(self.dir, 'mirror.db'), 'test')
+        self.mirror.store_objects('addressrecord', lambda obj: 'A', [
+            {'pk': pk, 'fqdn': fqdn, 'ip_str': ip, 'ip_type': '4'}
+            for pk, (fqdn, ip) in enumerate(NAMES, 1)
+        ])
+        self.mirror.commit()
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.dir)
+
+    def names(self, query):
+        return sorted(line.split()[1].rstrip('.')
+                      for line in search(self.mirror, query))
+
+    def test_regex(self):
+        self.assertEqual(self.names('/a[bcdef]'),
+                         ['ab.example.com', 'acx.example.com'])
+        self.assertEqual(self.names('/web[0-9]{2,3}x'),
+                         ['web123x.scl3.example.com'])
+        self.assertEqual(self.names('/^web'), [
+            'web01.scl3.example.com', 'web123x.scl3.example.com'
+        ])
+        self.assertEqual(self.names('/^(ab|db1)\\.'),
+                         ['ab.example.com', 'db1.phx1.example.com'])
+
+    def test_regex_cache_is_bounded(self):
+        local_search._regex_cache.clear()
+        for i in range(local_search.REGEX_CACHE_SIZE + 5):
+            self.assertTrue(local_search._regexp('b{0}'.format(i),
+                                                 'AB{0}'.format(i)))
+        self.assertEqual(len(local_search._regex_cache), 5)
+        self.assertEqual(self.names('/^db1'), ['db1.phx1.example.com'])
+
+    def test_words_and_directives(self):
+        self.assertEqual(self.names('scl3 !web01'),
+                         ['web123x.scl3.example.com'])
+        self.assertEqual(self.names('network=:10.0.0.0/24'),
+                         ['ab.example.com', 'acx.example.com'])
+        self.assertEqual(self.names('range=:10.0.1.2,10.1.0.1 type=:A'),
+                         ['db1.phx1.example.com', 'web123x.scl3.example.com'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from invtool.lib.mirror import Mirror, ip_key, network_keys
+from invtool.mirror_dispatch import MirrorDispatch
+
+
+def record(pk, fqdn, ip_str='10.0.0.1', modified='2026-01-01'):
+    return {'pk': pk, 'fqdn': fqdn, 'ip_str': ip_str, 'ip_type': '4',
+            'views': ['public'], 'modified': modified}
+
+
+class Dispatch(object):
+    resource_name = 'addressrecord'
+
+    def mirror_dtype(self, obj):
+        return 'A'
+
+
+class PagedMirrorDispatch(MirrorDispatch):
+    """
+    Serves fixed pages instead of asking Inventory.
+    """
+    def __init__(self, pages, total_count, refused=()):
+        self.pages = pages
+        self.total_count = total_count
+        self.refused = refused
+        self.params = []
+
+    def list_url(self, dispatch):
+        return 'http://inventory/addressrecord/'
+
+    def fetch_pages(self, nas, url, params, page_size, meta=None):
+        self.params.append(params)
+        meta.update(total_count=self.total_count)
+        if set(self.refused) & set(params):
+            yield 400, None, 'Bad filter'
+            return
+        for objects in self.pages:
+            yield 200, objects, None
+
+
+class MirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mirror = Mirror(os.path.join(self.dir, 'mirror.db'), 'test')
+        self.nas = argparse.Namespace(full=True, page_size=2, concurrency=1)
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.dir)
+
+    def test_keys(self):
+        self.assertEqual(ip_key('10.0.0.1'), '40a000001')
+        self.assertEqual(ip_key('::1'), '6' + '0' * 31 + '1')
+        self.assertEqual(ip_key('nope'), None)
+        self.assertEqual(network_keys('10.0.0.0/24'),
+                         ('40a000000', '40a0000ff'))
+
+    def test_store_and_remove(self):
+        dtype_of = Dispatch().mirror_dtype
+        objects = [record(1, 'a.b'), record(2, 'c.d', '10.0.0.2')]
+        self.assertEqual(
+            sorted(self.mirror.store_objects('addressrecord', dtype_of,
+                                             objects)), [1, 2]
+        )
+        # Unchanged objects aren't written again
+        self.assertEqual(self.mirror.store_objects(
+            'addressrecord', dtype_of, [record(1, 'a.b'),
+                                        record(2, 'e.f', '10.0.0.2')]
+        ), [2])
+        self.assertEqual(
+            sorted(o['fqdn'] for o in self.mirror.objects('A')),
+            ['a.b', 'e.f']
+        )
+        self.assertEqual(self.mirror.db.execute(
+            "SELECT COUNT(*) FROM grams WHERE gram = 'c.d'"
+        ).fetchone()[0], 0)
+        self.assertEqual(self.mirror.remove_missing('addressrecord', [2]),
+                         [1])
+        self.assertEqual(self.mirror.pks('addressrecord'), [2])
+        self.assertEqual(self.mirror.counts(), {'A': 1})
+
+    def test_full_sync_removes_deleted_objects(self):
+        self.mirror.store_objects('addressrecord', Dispatch().mirror_dtype,
+                                  [record(1, 'a.b'), record(9, 'gone.b')])
+        dispatch = PagedMirrorDispatch([[record(1, 'a.b')]], 1)
+        result = dispatch.sync_resource(self.nas, self.mirror, Dispatch())
+        self.assertEqual(result['removed'], [9])
+        self.assertEqual(dispatch.params[0]['order_by'], 'pk')
+        self.assertTrue(self.mirror.sync_state('addressrecord')['last_full'])
+
+    def test_incomplete_full_sync_removes_nothing(self):
+        self.mirror.store_objects('addressrecord', Dispatch().mirror_dtype,
+                                  [record(1, 'a.b'), record(2, 'c.d')])
+        # An insert shifted the offsets: pk 1 is seen twice, pk 2 never
+        dispatch = PagedMirrorDispatch(
+            [[record(0, 'new.b'), record(1, 'a.b')], [record(1, 'a.b')]], 3
+        )
+        result = dispatch.sync_resource(self.nas, self.mirror, Dispatch())
+        self.assertEqual(result['removed'], [])
+        self.assertEqual(result['incomplete'], "saw 2 of 3 objects")
+        self.assertEqual(sorted(self.mirror.pks('addressrecord')), [0, 1, 2])
+        self.assertEqual(
+            self.mirror.sync_state('addressrecord').get('last_full'), None
+        )
+
+    def incremental_sync(self, refused):
+        self.mirror.save_sync_state('addressrecord', since='2026-01-01',
+                                    last_full=time.time())
+        self.nas.full = False
+        dispatch = PagedMirrorDispatch([[record(1, 'a.b')]], 1, refused)
+        dispatch.sync_resource(self.nas, self.mirror, Dispatch())
+        return dispatch.params
+
+    def test_refused_modified_filter_keeps_ordering(self):
+        params = self.incremental_sync(['modified__gte'])
+        self.assertEqual(params[0]['modified__gte'], '2026-01-01')
+        self.assertEqual(params[1], {'format': 'json', 'order_by': 'pk'})
+        self.assertEqual(
+            self.mirror.sync_state('addressrecord')['modified_filter'], 0
+        )
+
+    def test_refused_ordering_keeps_modified_filter(self):
+        params = self.incremental_sync(['order_by'])
+        self.assertEqual(params[-1], {'format': 'json'})
+        self.assertNotEqual(
+            self.mirror.sync_state('addressrecord').get('modified_filter'), 0
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
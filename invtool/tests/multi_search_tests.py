@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import unittest
+from io import BytesIO
+from StringIO import StringIO
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import invtool.search_dispatch
+from invtool.main import do_dispatch
+
+RESULTS = {
+    'web1': (
+        "12 web1.scl3.mozilla.com. 3600 IN A 10.0.0.1\n"
+        "web1.scl3.mozilla.com 10.8.0.1 INV SYS 1234 SN1\n"
+    ),
+    'scl3': (
+        "12 web1.scl3.mozilla.com. 3600 IN A 10.0.0.1\n"
+        "14 1.0.0.10.in-addr.arpa. 3600 IN PTR web1.scl3.mozilla.com.\n"
+        "web1.scl3.mozilla.com 10.8.0.1 INV SYS 1234 SN1\n"
+    ),
+    'm\xc3\xbcnchen': u"15 m\xfcnchen.mozilla.com. 3600 IN A 10.0.0.5\n",
+}
+
+
+class Response(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = json.dumps(body)
+        self.text = self.content.decode('utf-8')  # As requests does
+
+
+class SearchSession(object):
+    def get(self, url, params=None, headers=None):
+        if params['search'] not in RESULTS:
+            return Response(400, {'message': 'Bad query'})
+        return Response(200, {'text_response': RESULTS[params['search']]})
+
+
+class MultiQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = invtool.search_dispatch.session
+        invtool.search_dispatch.session = lambda *args: SearchSession()
+
+    def tearDown(self):
+        invtool.search_dispatch.session = self.session
+
+    def search(self, queries):
+        out = StringIO()
+        args = ['--json', 'search']
+        for query in queries:
+            args += ['-q', query]
+        nas, (ret_code, resp_list) = do_dispatch(args, OUT=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        return ret_code, lines, json.loads(resp_list[0])['summary']
+
+    def test_objects_are_only_printed_once(self):
+        ret_code, lines, summary = self.search(['web1', 'scl3'])
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(sorted(line['line'] for line in lines), sorted(
+            set(RESULTS['web1'].splitlines() + RESULTS['scl3'].splitlines())
+        ))
+        self.assertEqual((summary['results'], summary['duplicates']), (3, 2))
+
+    def test_a_failed_query_is_reported(self):
+        ret_code, lines, summary = self.search(['web1', 'bad query'])
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(
+            [line for line in lines if 'error' in line],
+            [{'query': 'bad query', 'error': 'Bad query'}]
+        )
+        self.assertEqual(summary['results'], 2)
+
+    def test_tsv_is_utf8(self):
+        out = BytesIO()  # Like stdout piped into a file: bytes only
+        do_dispatch([
+            'search', '--format', 'tsv', '-q', 'm\xc3\xbcnchen', '-q', 'web1'
+        ], OUT=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('#pk\t'))
+        self.assertTrue('m\xc3\xbcnchen.mozilla.com' in [
+            line.split('\t')[2] for line in lines[1:]
+        ])
+        self.assertEqual(
+            sorted(line.split('\t')[-1] for line in lines[1:]),
+            ['m\xc3\xbcnchen', 'web1', 'web1']
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
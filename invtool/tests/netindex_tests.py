@@ -0,0 +1,167 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from invtool import core_dispatch
+from invtool.core_dispatch import DispatchNetwork
+from invtool.lib.allocator import int_to_ip
+from invtool.lib.netindex import (
+    NetworkIndex, load_network_index, network_entries, save_network_index
+)
+from invtool.lib.utilization import network_range
+
+
+def entry(network):
+    return {'pk': 1, 'network': network, 'site': '', 'vlan': ''}
+
+
+class NetworkIndexTestCase(unittest.TestCase):
+    def test_longest_prefix_wins(self):
+        index = NetworkIndex(map(entry, [
+            '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '0.0.0.0/0',
+            '2620:101:8000::/48', '2620:101:8000:1::/64', 'bogus'
+        ]))
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.lookup('10.1.2.3')['network'], '10.1.2.0/24')
+        self.assertEqual(index.lookup('10.1.3.3')['network'], '10.1.0.0/16')
+        self.assertEqual(index.lookup('10.2.0.0')['network'], '10.0.0.0/8')
+        self.assertEqual(index.lookup('11.0.0.1')['network'], '0.0.0.0/0')
+        self.assertEqual(index.lookup('2620:101:8000:1::5')['network'],
+                         '2620:101:8000:1::/64')
+        self.assertEqual(index.lookup('2620:101:8000:2::5')['network'],
+                         '2620:101:8000::/48')
+        self.assertEqual(index.lookup('2620:101:8001::1'), None)
+        self.assertRaises(ValueError, index.lookup, '10.1')
+        self.assertRaises(ValueError, index.lookup, 'foo')
+
+    def test_agrees_with_brute_force(self):
+        rand = random.Random(0)
+        networks = set()
+        for i in range(300):
+            prefix = rand.randint(8, 32)
+            n = rand.randint(0, (1 << prefix) - 1) << (32 - prefix)
+            networks.add('{0}/{1}'.format(int_to_ip(n), prefix))
+        index = NetworkIndex(map(entry, networks))
+        ranges = [network_range(network) + (network,)
+                  for network in networks]
+        for i in range(2000):
+            n = rand.randint(0, (1 << 32) - 1)
+            matches = sorted((last - first, network)
+                             for first, last, ip_type, network in ranges
+                             if first <= n <= last)
+            found = index.lookup(int_to_ip(n))
+            if matches:
+                self.assertEqual(found['network'], matches[0][1])
+            else:
+                self.assertEqual(found, None)
+
+    def test_entries_and_cache(self):
+        entries = list(network_entries(
+            [{'id': 7, 'network_str': '10.0.0.0/24',
+              'site': '/en-US/core/api/v1_core/site/3/', 'vlan': None}],
+            [{'id': 3, 'name': 'scl3', 'full_name': 'scl3'}], []
+        ))
+        self.assertEqual(entries, [{
+            'pk': 7, 'network': '10.0.0.0/24', 'site': 'scl3', 'vlan': ''
+        }])
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'network_index.json')
+            save_network_index(NetworkIndex(entries), path, 'test')
+            index = load_network_index(path, 'test', 60)
+            self.assertEqual(index.lookup('10.0.0.9')['site'], 'scl3')
+            self.assertEqual(load_network_index(path, 'other', 60), None)
+            self.assertEqual(load_network_index(path, 'test', -1), None)
+        finally:
+            shutil.rmtree(tmp)
+
+
+SITE_URL = '/en-US/core/api/v1_core/site/{0}/'
+VLAN_URL = '/en-US/core/api/v1_core/vlan/{0}/'
+
+
+class ListedDispatchNetwork(DispatchNetwork):
+    """
+    Serves fixed site, vlan and network lists instead of asking Inventory.
+    """
+    lists = {
+        'site': [{'id': 3, 'name': 'scl3', 'full_name': 'scl3'},
+                 {'id': 4, 'name': 'phx1', 'full_name': 'phx1'}],
+        'vlan': [{'id': 5, 'name': 'db', 'number': 3}],
+        'network': [
+            {'id': 7, 'network_str': '10.0.0.0/24',
+             'site': SITE_URL.format(3), 'vlan': VLAN_URL.format(5)},
+            {'id': 8, 'network_str': '10.0.1.0/24',
+             'site': SITE_URL.format(4), 'vlan': None},
+        ]
+    }
+
+    def __init__(self, filters=True):
+        self.filters = filters
+        self.params = {}
+
+    def fetch_pages(self, nas, url, params, page_size, meta=None):
+        resource = url.rstrip('/').split('/')[-1]
+        self.params.setdefault(resource, []).append(params)
+        if 'site__in' in params and not self.filters:
+            yield 400, None, 'The site field does not allow filtering'
+            return
+        objects = self.lists[resource]
+        if 'site__in' in params:
+            objects = [obj for obj in objects if obj['site'] in [
+                SITE_URL.format(pk) for pk in params['site__in'].split(',')
+            ]]
+        yield 200, objects, None
+
+
+class FetchNetworksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.nas = argparse.Namespace(concurrency=2)
+
+    def test_site_filter_is_sent(self):
+        dispatch = ListedDispatchNetwork()
+        networks, sites, vlans, error = dispatch.fetch_networks(
+            self.nas, site='SCL3'
+        )
+        self.assertEqual(error, None)
+        self.assertEqual([obj['id'] for obj in networks], [7])
+        self.assertEqual([obj['id'] for obj in sites], [3])
+        self.assertEqual(dispatch.params['network'],
+                         [{'format': 'json', 'site__in': '3'}])
+
+    def test_unfiltered_fallback(self):
+        dispatch = ListedDispatchNetwork(filters=False)
+        networks, sites, vlans, error = dispatch.fetch_networks(
+            self.nas, site='phx1'
+        )
+        self.assertEqual([obj['id'] for obj in networks], [8])
+        self.assertEqual(dispatch.params['network'][-1], {'format': 'json'})
+
+    def test_no_match_fetches_no_networks(self):
+        dispatch = ListedDispatchNetwork()
+        networks, sites, vlans, error = dispatch.fetch_networks(
+            self.nas, vlan='web'
+        )
+        self.assertEqual(networks, [])
+        self.assertFalse('network' in dispatch.params)
+
+    def test_scoped_index_is_not_cached(self):
+        nas = argparse.Namespace(concurrency=2, local=False, refresh=False,
+                                 explain=False, site=None, vlan='db,3')
+        saved = []
+        original = core_dispatch.save_network_index
+        core_dispatch.save_network_index = saved.append
+        try:
+            index, error = ListedDispatchNetwork().network_index(nas)
+        finally:
+            core_dispatch.save_network_index = original
+        self.assertEqual(index.lookup('10.0.0.9')['vlan'], 'db,3')
+        self.assertEqual(index.lookup('10.0.1.9'), None)
+        self.assertEqual(saved, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
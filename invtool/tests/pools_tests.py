@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from invtool.lib.pools import PoolCache, range_pool_key, vlan_pool_key
+
+
+class PoolCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = PoolCache(
+            os.path.join(self.dir, 'pools.json'), remote='test', ttl=60
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get_put(self):
+        key = vlan_pool_key('scl3', 'db', None)
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, [['10.0.0.1', '10.0.0.10']])
+        self.assertEqual(self.cache.get(key), [[167772161, 167772170]])
+        other = PoolCache(self.cache.path, remote='other', ttl=60)
+        self.assertEqual(other.get(key), None)
+
+    def test_expires(self):
+        key = range_pool_key('10.0.0.0, 10.0.0.255')
+        self.assertEqual(key, range_pool_key('10.0.0.0,10.0.0.255'))
+        self.cache.put(key, [[1, 2]])
+        self.cache.ttl = 0.01
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get(key), None)
+
+    def test_invalidate(self):
+        self.cache.put('a', [['10.0.0.1', '10.0.0.10']])
+        self.cache.put('b', [['10.0.1.1', '10.0.1.10']])
+        self.cache.invalidate(['10.0.1.5'])
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertNotEqual(self.cache.get('a'), None)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get('a'), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.records import (
+    AddressRecord, KVRecord, SystemRecord, loads, loads_export, loads_records
+)
+
+
+def export_raw(count):
+    return json.dumps({'systems': dict(
+        ('web{0}.scl3'.format(i), {
+            'pk': i, 'hostname': 'web{0}.scl3'.format(i),
+            'staticreg_set': {}, 'keyvalue_set': {},
+            'operating_system': 'linux', 'views': ['public', 'private']
+        }) for i in range(count)
+    )})
+
+
+class RecordsTestCase(unittest.TestCase):
+    def test_loads_interns_within_one_call(self):
+        data = loads(json.dumps([{'view': u'public-view'},
+                                 {'view': u'public-view'}]))
+        self.assertTrue(data[0]['view'] is data[1]['view'])
+        self.assertEqual(data, json.loads(json.dumps(data)))
+
+    def test_loads_export(self):
+        raw = export_raw(3)
+        self.assertEqual(loads_export(raw), json.loads(raw))
+        blob = loads_export(raw, as_records=True)
+        systems = blob['systems']
+        self.assertTrue(all(isinstance(s, SystemRecord)
+                            for s in systems.values()))
+        a, b = systems['web1.scl3'], systems['web2.scl3']
+        self.assertTrue(a.operating_system is b.operating_system)
+        self.assertEqual(a['views'], ('public', 'private'))
+        self.assertEqual(a.as_dict(), json.loads(raw)['systems']['web1.scl3'])
+
+    def test_loads_records(self):
+        records = loads_records('A', json.dumps({'objects': [
+            {'pk': 1, 'fqdn': 'a.b', 'ip_str': '10.0.0.1', 'ip_type': '4',
+             'extra_field': 'x'}
+        ]}))
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertTrue(isinstance(record, AddressRecord))
+        self.assertEqual(record.fqdn, 'a.b')
+        self.assertEqual(record['extra_field'], 'x')
+        self.assertEqual(record.get('missing'), None)
+        kvs = loads_records('SYS_kv', json.dumps({'kvs': [
+            {'kv_pk': 9, 'key': 'nic.0.mac', 'value': 'aa'}
+        ]}))
+        self.assertTrue(isinstance(kvs[0], KVRecord))
+        self.assertEqual(kvs[0].pk, 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
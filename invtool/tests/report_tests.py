@@ -0,0 +1,64 @@
+import argparse
+import unittest
+
+from invtool import report_dispatch
+from invtool.report_dispatch import (
+    RangeReportDispatch, range_target, report_row
+)
+from invtool.tests.netindex_tests import ListedDispatchNetwork
+
+
+class RangeTargetTestCase(unittest.TestCase):
+    def test_range_target(self):
+        self.assertEqual(range_target(' 10.0.0.1, 10.0.0.9 '), {
+            'label': '10.0.0.1,10.0.0.9', 'start': '10.0.0.1',
+            'end': '10.0.0.9', 'site': '', 'vlan': ''
+        })
+        target = range_target('10.0.0.0/30')
+        self.assertEqual((target['start'], target['end']),
+                         ('10.0.0.0', '10.0.0.3'))
+        target = range_target('2001:db8::/126')
+        self.assertEqual((target['start'], target['end']),
+                         ('2001:db8::', '2001:db8::3'))
+
+    def test_bad_ranges(self):
+        for text in ('::1,10.0.0.1', '10.0.0.1,::1', '10.0.0.9,10.0.0.1',
+                     '10.0.0.1', 'a,b'):
+            self.assertRaises(ValueError, range_target, text)
+
+    def test_report_row(self):
+        row = report_row(range_target('10.0.0.0/30'), {
+            'used': 1, 'unused': 3, 'free_ranges': [[1, 3]]
+        })
+        self.assertEqual(
+            (row['size'], row['percent_used'], row['largest_free_block']),
+            (4, 25.0, 3)
+        )
+
+
+class TargetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original = report_dispatch.DispatchNetwork
+        self.listed = []
+
+        def dispatch():
+            self.listed.append(ListedDispatchNetwork())
+            return self.listed[-1]
+        report_dispatch.DispatchNetwork = dispatch
+
+    def tearDown(self):
+        report_dispatch.DispatchNetwork = self.original
+
+    def test_site_networks_are_fetched_by_filter(self):
+        nas = argparse.Namespace(site='scl3', vlan=None, ranges=[],
+                                 range_file=None, concurrency=2)
+        targets, error = RangeReportDispatch().targets(nas, None)
+        self.assertEqual(error, None)
+        self.assertEqual([(t['label'], t['site'], t['vlan'])
+                          for t in targets], [('10.0.0.0/24', 'scl3', 'db,3')])
+        self.assertEqual(self.listed[0].params['network'],
+                         [{'format': 'json', 'site__in': '3'}])
+
+
+if __name__ == "__main__":
+    unittest.main()
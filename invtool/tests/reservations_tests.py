@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from invtool.lib.allocator import IPAllocator
+from invtool.lib.reservations import ReservationLedger, ReservedPool
+
+
+class ReservationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ledger = ReservationLedger(
+            os.path.join(self.dir, 'reservations.json'), remote='test'
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def pool(self, reservation):
+        return ReservedPool(
+            IPAllocator([['10.0.0.1', '10.0.0.10']]), reservation
+        )
+
+    def test_runs_get_disjoint_ips(self):
+        a = self.pool(self.ledger.reservation('a'))
+        b = self.pool(self.ledger.reservation('b'))
+        a.prefetch(3)
+        self.assertEqual([b.next(), b.next()], ['10.0.0.4', '10.0.0.5'])
+        self.assertEqual(a.next(), '10.0.0.1')
+        self.assertEqual(len(self.ledger.held()), 5)
+
+    def test_release(self):
+        reservation = self.ledger.reservation('a')
+        self.pool(reservation).prefetch(4)
+        reservation.commit()
+        self.assertEqual(self.ledger.held(), {})
+        try:
+            with reservation:
+                self.pool(reservation).next()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.ledger.held(), {})
+
+    def test_expired_reservations_are_dropped(self):
+        self.ledger.ttl = -1
+        self.pool(self.ledger.reservation('a')).prefetch(4)
+        self.assertEqual(self.ledger.held(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
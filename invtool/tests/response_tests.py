@@ -0,0 +1,42 @@
+import unittest
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from invtool.lib.response import NO_MESSAGE, RawJSON
+
+
+class RawJSONTestCase(unittest.TestCase):
+    def test_str_splices_http_status(self):
+        raw = RawJSON('{"pk": 3, "fqdn": "a.b"}', 201)
+        self.assertEqual(json.loads(str(raw)),
+                         {'http_status': 201, 'pk': 3, 'fqdn': 'a.b'})
+        self.assertEqual(json.loads(str(RawJSON('{}', 200))),
+                         {'http_status': 200})
+        self.assertEqual(json.loads(str(RawJSON('', 204))),
+                         {'http_status': 204, 'message': NO_MESSAGE})
+
+    def test_str_passes_non_objects_through(self):
+        for body in ('<html><h1>Not Found</h1></html>', 'Bad request',
+                     '[1, 2]'):
+            self.assertEqual(str(RawJSON(body, 404)), body)
+
+    def test_pk(self):
+        self.assertEqual(RawJSON('{"pk": 12, "fqdn": "a"}').pk(), 12)
+        self.assertEqual(RawJSON('{"fqdn": "a"}').pk(), None)
+        self.assertEqual(RawJSON('{"system": {"pk": 12}}').pk(), None)
+        self.assertEqual(
+            RawJSON('{"system": {"pk": 12}, "pk": 4}').pk(), 4
+        )
+        self.assertEqual(RawJSON('{"pk": "SYS-1"}').pk(), 'SYS-1')
+
+    def test_has_key(self):
+        raw = RawJSON('{"error_messages": "nope"}', 400)
+        self.assertFalse(raw.has_key('objects'))
+        self.assertTrue(raw.has_key('error_messages'))
+
+
+if __name__ == "__main__":
+    unittest.main()
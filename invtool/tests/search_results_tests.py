@@ -0,0 +1,67 @@
+import unittest
+
+from invtool.lib.search_results import (
+    iter_hits, parse_line, parse_output_line, reverse_name_to_ip
+)
+
+TEXT = """\
+12 web1.scl3.mozilla.com. 3600 IN A 10.0.0.1
+13 www.mozilla.com. 3600 IN CNAME web1.scl3.mozilla.com.
+; a comment
+
+14 1.0.0.10.in-addr.arpa. 3600 IN PTR web1.scl3.mozilla.com.
+15 mozilla.com. 3600 IN MX 10 mx1.mozilla.com.
+16 _ldap._tcp.mozilla.com. 3600 IN SRV 0 5 389 ldap.mozilla.com.
+web1.scl3.mozilla.com 10.8.0.1 INV SYS 1234 SN1
+not a record
+"""
+
+
+class SearchResultsTestCase(unittest.TestCase):
+    def test_parse_line(self):
+        hit = parse_line('12 web1.scl3.mozilla.com. 3600 IN A 10.0.0.1\n')
+        self.assertEqual(hit.as_dict(), {
+            'pk': 12, 'type': 'A', 'fqdn': 'web1.scl3.mozilla.com',
+            'ttl': 3600, 'target': None, 'ip': '10.0.0.1', 'views': None,
+            'rdata': '10.0.0.1'
+        })
+        self.assertEqual(hit.key(), ('A', 12))
+        self.assertEqual(parse_line(''), None)
+        self.assertEqual(parse_line('; 1 a. 3600 IN A 10.0.0.1'), None)
+        self.assertEqual(parse_line('1 a. 3600 XX A 10.0.0.1'), None)
+
+    def test_iter_hits(self):
+        hits = list(iter_hits(TEXT))
+        self.assertEqual([hit.type for hit in hits],
+                         ['A', 'CNAME', 'PTR', 'MX', 'SRV', 'SYS'])
+        a, cname, ptr, mx, srv, system = hits
+        self.assertEqual(cname.target, 'web1.scl3.mozilla.com')
+        self.assertEqual((ptr.ip, ptr.target),
+                         ('10.0.0.1', 'web1.scl3.mozilla.com'))
+        self.assertEqual(mx.target, 'mx1.mozilla.com')
+        self.assertEqual(srv.target, 'ldap.mozilla.com')
+        self.assertEqual(system.key(), ('SYS', 'web1.scl3.mozilla.com'))
+        self.assertEqual((system.ip, system.rdata), ('10.8.0.1', '1234 SN1'))
+        # Any iterable of lines works too, e.g. a file
+        self.assertEqual(
+            [h.key() for h in iter_hits(TEXT.splitlines(True))],
+            [h.key() for h in hits]
+        )
+
+    def test_reverse_name_to_ip(self):
+        self.assertEqual(reverse_name_to_ip('4.3.2.10.in-addr.arpa.'),
+                         '10.2.3.4')
+        name = '.'.join(reversed('20010db8' + '0' * 23 + '1')) + '.ip6.arpa'
+        self.assertEqual(reverse_name_to_ip(name),
+                         '2001:0db8:0000:0000:0000:0000:0000:0001')
+
+    def test_parse_output_line(self):
+        for hit in iter_hits(TEXT):
+            for line in (hit.line, hit.as_json(), hit.as_tsv()):
+                self.assertEqual(parse_output_line(line).key(), hit.key())
+        self.assertEqual(parse_output_line('#pk\ttype'), None)
+        self.assertEqual(parse_output_line('{not json'), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import random
+import unittest
+
+from invtool.lib.utilization import (
+    SparseUsage, UsageBitmap, largest_free_block, usage, usage_map
+)
+
+
+def brute_usage(used, first, last):
+    used = sorted(set(n for n in used if first <= n <= last))
+    free_ranges, start = [], first
+    for n in used:
+        if n > start:
+            free_ranges.append([start, n - 1])
+        start = n + 1
+    if start <= last:
+        free_ranges.append([start, last])
+    return {
+        'used': len(used), 'unused': last - first + 1 - len(used),
+        'free_ranges': free_ranges
+    }
+
+
+class UtilizationTestCase(unittest.TestCase):
+    def test_usage_like_inventory(self):
+        umap = UsageBitmap(167772160, 167772175, [167772161, 167772163])
+        self.assertEqual(usage(umap), {
+            'used': 2, 'unused': 14, 'free_ranges': [
+                ['10.0.0.0', '10.0.0.0'], ['10.0.0.2', '10.0.0.2'],
+                ['10.0.0.4', '10.0.0.15']
+            ]
+        })
+
+    def test_bitmap_and_sparse_agree(self):
+        rand = random.Random(0)
+        for i in range(200):
+            first = rand.randint(0, 1000)
+            last = first + rand.randint(0, 300)
+            used = [rand.randint(first - 5, last + 5)
+                    for j in range(rand.randint(0, 60))]
+            a = rand.randint(first, last)
+            b = rand.randint(a, last)
+            expected = brute_usage(used, a, b)
+            for umap in (UsageBitmap(first, last, used),
+                         SparseUsage(first, last, used)):
+                self.assertEqual(usage(umap, a, b, integers=True), expected)
+
+    def test_large_ipv6_range_is_sparse(self):
+        umap = usage_map(0, (1 << 64) - 1, [5, 1 << 40], '6')
+        self.assertTrue(isinstance(umap, SparseUsage))
+        result = usage(umap, integers=True)
+        self.assertEqual(result['used'], 2)
+        self.assertEqual(largest_free_block(result['free_ranges']),
+                         (1 << 64) - (1 << 40) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()